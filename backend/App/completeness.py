@@ -0,0 +1,133 @@
+from typing import Any, Dict, Iterable, Optional, Set
+from sqlalchemy import and_, exists, func, inspect, or_, select, update # type: ignore
+from sqlalchemy.engine import Engine # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from sqlalchemy.schema import CreateColumn # type: ignore
+from App import models
+from App.pricing import chunked
+from App.write_tracking import ALL, on_commit
+
+# Compteurs de complétude des instances F-Pack, stockés sur FPM_sous_projet_fpack :
+# - nb_selections : sélections faites sur l'instance ;
+# - nb_groupes_attendus : colonnes de type "group" de son template.
+# Ils sont recalculés au commit (requêtes UPDATE corrélées, dans la même transaction)
+# pour les instances dont les sélections ont changé et pour toutes les instances des
+# templates dont les colonnes de configuration ont changé.
+
+COLONNES = ("nb_selections", "nb_groupes_attendus")
+
+
+def instance_incomplete(instance=models.SousProjetFpack):
+    """Condition SQL : instance sans groupe attendu ou avec des groupes non sélectionnés"""
+    return or_(instance.nb_groupes_attendus == 0, instance.nb_selections < instance.nb_groupes_attendus)
+
+
+def sous_projet_counters(sous_projet_id):
+    """
+    Expressions corrélées (nb_selections, nb_groupes_attendus) d'un sous-projet, telles
+    qu'affichées par les listes de sous-projets : sélections de toutes ses instances,
+    groupes attendus du template de sa première instance
+    """
+    instance = models.SousProjetFpack
+    nb_selections = select(func.sum(instance.nb_selections)).where(
+        instance.sous_projet_id == sous_projet_id
+    ).scalar_subquery()
+    nb_groupes_attendus = select(instance.nb_groupes_attendus).where(
+        instance.sous_projet_id == sous_projet_id
+    ).order_by(instance.id).limit(1).scalar_subquery()
+    return func.coalesce(nb_selections, 0), func.coalesce(nb_groupes_attendus, 0)
+
+
+def counters_complete(nb_selections, nb_groupes_attendus):
+    return and_(nb_groupes_attendus > 0, nb_selections >= nb_groupes_attendus)
+
+
+def projet_global_complet(projet_global_id):
+    """Condition SQL : au moins un sous-projet, chacun avec au moins une instance, toutes complètes"""
+    sous_projet = models.SousProjet
+    instance = models.SousProjetFpack
+    return and_(
+        exists().where(sous_projet.id_global == projet_global_id),
+        ~exists().where(
+            sous_projet.id_global == projet_global_id,
+            ~exists().where(instance.sous_projet_id == sous_projet.id)
+        ),
+        ~exists().where(
+            sous_projet.id_global == projet_global_id,
+            instance.sous_projet_id == sous_projet.id,
+            instance_incomplete(instance)
+        )
+    )
+
+
+def _counters_update():
+    table = models.SousProjetFpack.__table__
+    selections = models.ProjetSelection.__table__
+    colonnes = models.FPackConfigColumn.__table__
+    return update(table).values(
+        nb_selections=select(func.count())
+            .where(selections.c.sous_projet_fpack_id == table.c.id)
+            .scalar_subquery(),
+        nb_groupes_attendus=select(func.count())
+            .where(colonnes.c.fpack_id == table.c.fpack_id, colonnes.c.type == "group")
+            .scalar_subquery()
+    )
+
+
+def refresh_completeness_counters(
+    db: Session,
+    sous_projet_fpack_ids: Optional[Iterable[int]] = None,
+    fpack_ids: Optional[Iterable[int]] = None
+) -> None:
+    """
+    Recalcule les compteurs (sans commit) des instances données et des instances des templates
+    donnés. Sans argument, recalcule toutes les instances en une requête.
+    """
+    table = models.SousProjetFpack.__table__
+    if sous_projet_fpack_ids is None and fpack_ids is None:
+        db.execute(_counters_update())
+        return
+    for chunk in chunked(sous_projet_fpack_ids or ()):
+        db.execute(_counters_update().where(table.c.id.in_(chunk)))
+    for chunk in chunked(fpack_ids or ()):
+        db.execute(_counters_update().where(table.c.fpack_id.in_(chunk)))
+
+
+@on_commit
+def _refresh_on_commit(db: Session, pending: Dict[str, Set[Any]]):
+    if pending.get(ALL):
+        refresh_completeness_counters(db)
+        return
+    instances = pending.get("sous_projet_fpack")
+    fpacks = pending.get("fpack")
+    if instances or fpacks:
+        refresh_completeness_counters(db, instances or (), fpacks or ())
+
+
+def add_counter_columns(engine: Engine) -> bool:
+    """
+    Ajoute les colonnes de compteurs manquantes à une table existante (create_all ne modifie
+    pas les tables déjà créées). Renvoie True si des colonnes ont été ajoutées (à remplir).
+    """
+    table = models.SousProjetFpack.__table__
+    existantes = {column["name"] for column in inspect(engine).get_columns(table.name, schema=table.schema)}
+    manquantes = [name for name in COLONNES if name not in existantes]
+    if not manquantes:
+        return False
+    with engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        for name in manquantes:
+            definition = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD {definition}")
+    return True
+
+
+def ensure_completeness_counters(engine: Engine) -> None:
+    """
+    Ajoute les colonnes de compteurs si besoin puis les recalcule toutes (une requête) :
+    corrige les écarts dus aux écritures faites hors de l'application (SQL direct).
+    """
+    add_counter_columns(engine)
+    with Session(engine) as db:
+        refresh_completeness_counters(db)
+        db.commit()
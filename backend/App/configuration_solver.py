@@ -0,0 +1,298 @@
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+from fastapi import HTTPException # type: ignore
+from sqlalchemy import or_ # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+from App.pricing import PricingEngine, chunked
+
+# Solveur de configuration : pour chaque groupe non sélectionné d'une instance F-Pack,
+# choisit l'option la moins chère pour le client en respectant les contraintes
+# (mêmes règles que le contrôle d'incompatibilités de l'interface) :
+# - deux produits listés dans ProduitIncompatibilite ne sont jamais combinés
+#   (un équipement apporte tous les produits de sa nomenclature) ;
+# - un robot n'est retenu que s'il est déclaré compatible (RobotProduitCompatibilite)
+#   avec chacun des produits de la configuration.
+#
+# Les groupes sans contrainte entre eux sont résolus indépendamment (option minimale),
+# les autres par séparation et évaluation (branch and bound) avec filtrage des domaines
+# et borne inférieure = coût courant + somme des minima des groupes restants.
+# Si aucune combinaison ne remplit tous les groupes, ceux qui ne peuvent pas l'être
+# sont laissés vides et signalés. Au-delà de MAX_NOEUDS, la meilleure solution trouvée
+# est gardée (ou, à défaut, un choix glouton) et la réponse l'indique (limite_atteinte).
+
+MAX_NOEUDS = 200_000
+
+Option = Tuple[str, int]
+
+
+class ConfigurationSolver:
+
+    def __init__(self, db: Session, sous_projet_fpack_id: int, inclure_sans_prix: bool = False):
+        self.db = db
+        self.sous_projet_fpack_id = sous_projet_fpack_id
+        self.inclure_sans_prix = inclure_sans_prix
+        self.pricing = PricingEngine(db)
+        self.noeuds = 0
+        self.optimal = True
+
+    # ========== CHARGEMENT ==========
+
+    def _load(self):
+        self.pricing.load([self.sous_projet_fpack_id])
+        instance = self.pricing.instances.get(self.sous_projet_fpack_id)
+        if not instance:
+            raise HTTPException(status_code=404, detail="Sous-projet FPack non trouvé")
+        if not instance["client"]:
+            raise HTTPException(status_code=404, detail="Client non trouvé")
+        self.client_id = instance["client"].id
+
+        selections = self.db.query(models.ProjetSelection.groupe_id, models.ProjetSelection.type_item, models.ProjetSelection.ref_id)\
+            .filter(models.ProjetSelection.sous_projet_fpack_id == self.sous_projet_fpack_id)\
+            .all()
+        groupes_selectionnes = {groupe_id for groupe_id, _, _ in selections}
+
+        groupe_ids = []
+        for (ref_id,) in self.db.query(models.FPackConfigColumn.ref_id).filter(
+            models.FPackConfigColumn.fpack_id == instance["fpack_id"],
+            models.FPackConfigColumn.type == "group"
+        ).order_by(models.FPackConfigColumn.ordre).all():
+            if ref_id is not None and ref_id not in groupes_selectionnes and ref_id not in groupe_ids:
+                groupe_ids.append(ref_id)
+
+        self.groupe_noms = dict(
+            self.db.query(models.Groupes.id, models.Groupes.nom).filter(models.Groupes.id.in_(groupe_ids)).all()
+        ) if groupe_ids else {}
+
+        self.options: Dict[int, List[Option]] = {groupe_id: [] for groupe_id in groupe_ids}
+        for chunk in chunked(groupe_ids):
+            for groupe_id, type_item, ref_id in self.db.query(models.GroupeItem.group_id, models.GroupeItem.type, models.GroupeItem.ref_id)\
+                    .filter(models.GroupeItem.group_id.in_(chunk))\
+                    .order_by(models.GroupeItem.id)\
+                    .all():
+                if (type_item, ref_id) not in self.options[groupe_id]:
+                    self.options[groupe_id].append((type_item, ref_id))
+
+        # Items déjà présents : colonnes fixes du template et sélections faites à la main
+        self.fixes: List[Option] = list(self.pricing.config_columns.get(instance["fpack_id"], []))
+        self.fixes += [(type_item, ref_id) for _, type_item, ref_id in selections]
+
+        toutes_options = {option for options in self.options.values() for option in options}
+        self.pricing.load_catalogue(toutes_options | set(self.fixes), [self.client_id])
+
+        equipement_ids = {ref_id for type_item, ref_id in toutes_options | set(self.fixes) if type_item == "equipement"}
+        self.nomenclatures: Dict[int, Set[int]] = defaultdict(set)
+        for chunk in chunked(equipement_ids):
+            for equipement_id, produit_id in self.db.query(models.Equipement_Produit.equipement_id, models.Equipement_Produit.produit_id)\
+                    .filter(models.Equipement_Produit.equipement_id.in_(chunk)).all():
+                self.nomenclatures[equipement_id].add(produit_id)
+
+        produits_univers = set()
+        robots_univers = set()
+        for type_item, ref_id in toutes_options | set(self.fixes):
+            if type_item == "robot":
+                robots_univers.add(ref_id)
+            else:
+                produits_univers |= self.produits_de((type_item, ref_id))
+
+        self.incompatibilites: Dict[int, Set[int]] = defaultdict(set)
+        for chunk in chunked(produits_univers):
+            for p1, p2 in self.db.query(models.ProduitIncompatibilite.produit_id_1, models.ProduitIncompatibilite.produit_id_2)\
+                    .filter(or_(models.ProduitIncompatibilite.produit_id_1.in_(chunk), models.ProduitIncompatibilite.produit_id_2.in_(chunk)))\
+                    .all():
+                self.incompatibilites[p1].add(p2)
+                self.incompatibilites[p2].add(p1)
+
+        self.compatibilites_robot: Dict[int, Set[int]] = defaultdict(set)
+        for chunk in chunked(robots_univers):
+            for robot_id, produit_id in self.db.query(models.RobotProduitCompatibilite.robot_id, models.RobotProduitCompatibilite.produit_id)\
+                    .filter(models.RobotProduitCompatibilite.robot_id.in_(chunk)).all():
+                self.compatibilites_robot[robot_id].add(produit_id)
+
+    # ========== CONTRAINTES ==========
+
+    def produits_de(self, option: Option) -> FrozenSet[int]:
+        type_item, ref_id = option
+        if type_item == "produit":
+            return frozenset([ref_id])
+        if type_item == "equipement":
+            return frozenset(self.nomenclatures.get(ref_id, ()))
+        return frozenset()
+
+    def compatibles(self, a: Option, b: Option) -> bool:
+        produits_a, produits_b = self.produits_de(a), self.produits_de(b)
+        if a[0] == "robot" and not produits_b <= self.compatibilites_robot[a[1]]:
+            return False
+        if b[0] == "robot" and not produits_a <= self.compatibilites_robot[b[1]]:
+            return False
+        return not any(self.incompatibilites[p] & produits_b for p in produits_a)
+
+    def cout(self, option: Option) -> Optional[float]:
+        """Coût unitaire (prix + transport) pour le client, None si l'item n'existe pas ou n'a pas de prix"""
+        line = self.pricing.build_line(option[0], option[1], self.client_id)
+        if line is None:
+            return None
+        cout = line["prix_unitaire"] + line["prix_transport"]
+        if cout == 0 and not self.inclure_sans_prix:
+            return None
+        return cout
+
+    # ========== RÉSOLUTION ==========
+
+    def solve(self) -> Dict[str, Any]:
+        self._load()
+
+        # Domaines : options existantes, tarifées et compatibles avec les items déjà présents,
+        # triées par coût croissant (vecteurs de coûts précalculés)
+        domaines: Dict[int, List[Tuple[float, Option]]] = {}
+        sans_solution = []
+        for groupe_id, options in self.options.items():
+            domaine = []
+            for option in options:
+                cout = self.cout(option)
+                if cout is None:
+                    continue
+                if all(self.compatibles(option, fixe) for fixe in self.fixes):
+                    domaine.append((cout, option))
+            if domaine:
+                domaines[groupe_id] = sorted(domaine, key=lambda x: x[0])
+            else:
+                sans_solution.append({
+                    "groupe_id": groupe_id,
+                    "groupe_nom": self.groupe_noms.get(groupe_id),
+                    "raison": "Aucune option tarifée compatible avec la configuration"
+                })
+
+        # Conflits entre options de groupes différents
+        groupes = list(domaines)
+        conflits: Dict[Tuple[int, Option], Set[Tuple[int, Option]]] = defaultdict(set)
+        voisins: Dict[int, Set[int]] = defaultdict(set)
+        for i, g1 in enumerate(groupes):
+            for g2 in groupes[i + 1:]:
+                for _, o1 in domaines[g1]:
+                    for _, o2 in domaines[g2]:
+                        if not self.compatibles(o1, o2):
+                            conflits[(g1, o1)].add((g2, o2))
+                            conflits[(g2, o2)].add((g1, o1))
+                            voisins[g1].add(g2)
+                            voisins[g2].add(g1)
+
+        choix: Dict[int, Tuple[float, Option]] = {}
+        vus: Set[int] = set()
+        for groupe_id in groupes:
+            if groupe_id in vus:
+                continue
+            composante = self._composante(groupe_id, voisins)
+            vus |= composante
+            if len(composante) == 1:
+                choix[groupe_id] = domaines[groupe_id][0]
+                continue
+            # Laisser un groupe vide reste possible mais coûte plus que tous les choix réunis :
+            # on remplit d'abord le plus de groupes possible, puis on minimise le coût
+            penalite = sum(domaines[g][-1][0] for g in composante) + 1
+            domaines_composante = {g: domaines[g] + [(penalite, None)] for g in composante}
+            ordre = sorted(composante, key=lambda g: len(domaines[g]))
+            solution = self._branch_and_bound(ordre, domaines_composante, conflits)
+            raison = "Aucune option compatible avec les autres groupes"
+            if solution is None:
+                # Limite de noeuds atteinte avant toute solution complète : choix glouton
+                solution = self._glouton(ordre, domaines, conflits)
+                raison = "Limite d'exploration atteinte : aucune option compatible trouvée"
+            for g, (cout, option) in solution.items():
+                if option is None:
+                    sans_solution.append({
+                        "groupe_id": g,
+                        "groupe_nom": self.groupe_noms.get(g),
+                        "raison": raison
+                    })
+                else:
+                    choix[g] = (cout, option)
+
+        selections = []
+        for groupe_id in self.options:
+            if groupe_id not in choix:
+                continue
+            cout, (type_item, ref_id) = choix[groupe_id]
+            line = self.pricing.build_line(type_item, ref_id, self.client_id)
+            selections.append({
+                "groupe_id": groupe_id,
+                "groupe_nom": self.groupe_noms.get(groupe_id),
+                "type_item": type_item,
+                "ref_id": ref_id,
+                "nom": line["nom"],
+                "prix_unitaire": line["prix_unitaire"],
+                "prix_transport": line["prix_transport"],
+                "cout": cout
+            })
+
+        return {
+            "sous_projet_fpack_id": self.sous_projet_fpack_id,
+            "client_id": self.client_id,
+            "currency": "EUR",
+            "selections": selections,
+            "groupes_sans_solution": sans_solution,
+            "cout_selections": sum(s["cout"] for s in selections),
+            "optimal": self.optimal,
+            "limite_atteinte": not self.optimal,
+            "noeuds_explores": self.noeuds
+        }
+
+    @staticmethod
+    def _composante(depart: int, voisins: Dict[int, Set[int]]) -> Set[int]:
+        composante, pile = {depart}, [depart]
+        while pile:
+            for voisin in voisins[pile.pop()]:
+                if voisin not in composante:
+                    composante.add(voisin)
+                    pile.append(voisin)
+        return composante
+
+    @staticmethod
+    def _glouton(groupes: List[int], domaines, conflits) -> Dict[int, Tuple[float, Optional[Option]]]:
+        """Option la moins chère de chaque groupe compatible avec les choix précédents (None si aucune)"""
+        choix: Dict[int, Tuple[float, Optional[Option]]] = {}
+        for groupe_id in groupes:
+            choix[groupe_id] = (0.0, None)
+            for cout, option in domaines[groupe_id]:
+                exclues = conflits.get((groupe_id, option), set())
+                if not any((g, o) in exclues for g, (_, o) in choix.items() if o is not None):
+                    choix[groupe_id] = (cout, option)
+                    break
+        return choix
+
+    def _branch_and_bound(self, groupes: List[int], domaines, conflits) -> Optional[Dict[int, Tuple[float, Option]]]:
+        meilleur: Dict[str, Any] = {"cout": float("inf"), "choix": None}
+
+        def explorer(index: int, courant: float, choix: Dict[int, Tuple[float, Option]], restants: Dict[int, List[Tuple[float, Option]]]):
+            self.noeuds += 1
+            if self.noeuds > MAX_NOEUDS:
+                self.optimal = False
+                return
+            if index == len(groupes):
+                if courant < meilleur["cout"]:
+                    meilleur["cout"] = courant
+                    meilleur["choix"] = dict(choix)
+                return
+
+            groupe_id = groupes[index]
+            borne_restants = sum(restants[g][0][0] for g in groupes[index + 1:])
+            for cout, option in restants[groupe_id]:
+                # Domaines triés : au-delà de la borne, les options suivantes sont plus chères
+                if courant + cout + borne_restants >= meilleur["cout"]:
+                    break
+                exclues = conflits.get((groupe_id, option), set())
+                filtres = {}
+                for g in groupes[index + 1:]:
+                    domaine = [(c, o) for c, o in restants[g] if (g, o) not in exclues] if exclues else restants[g]
+                    if not domaine:
+                        break
+                    filtres[g] = domaine
+                else:
+                    choix[groupe_id] = (cout, option)
+                    explorer(index + 1, courant + cout, choix, {**restants, **filtres})
+                    del choix[groupe_id]
+                if self.noeuds > MAX_NOEUDS:
+                    return
+
+        explorer(0, 0.0, {}, {g: domaines[g] for g in groupes})
+        return meilleur["choix"]
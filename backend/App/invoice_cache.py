@@ -0,0 +1,231 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from sqlalchemy import event, func, select # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+from config import INVOICE_CACHE_MAX_BYTES, INVOICE_CACHE_TTL
+
+# Cache des factures (données JSON et documents PDF/Excel rendus).
+#
+# - Chaque facture est identifiée par une empreinte (ETag) calculée sur son contenu :
+#   lignes, prix, quantités, sélections, colonnes de configuration... Deux calculs qui
+#   donnent la même facture donnent le même ETag, et le document rendu est mis en cache
+#   sous cette empreinte : une écriture sans effet sur la facture ne provoque aucun re-rendu.
+# - Une facture en cache est réutilisée tant que l'empreinte des lignes dont elle dépend est
+#   inchangée (data_version, deux requêtes indexées) : versions des totaux matérialisés de
+#   ses instances, incrémentées au commit de toute écriture qui touche leurs totaux, quel que
+#   soit le processus (App.rollups), et noms affichés en en-tête. Une écriture n'invalide
+#   donc que les factures des instances concernées.
+# - Les écritures qui échappent à cette empreinte (SQL direct, noms des produits, robots et
+#   équipements, instance sans totaux matérialisés) sont prises en compte au plus tard après
+#   INVOICE_CACHE_TTL : la facture est alors recalculée, et son ETag change si son contenu a changé.
+# - Le compteur de génération (incrémenté au commit de toute écriture de ce processus) sert
+#   aux caches de statistiques globales.
+# - Éviction LRU avec un plafond en octets (INVOICE_CACHE_MAX_BYTES).
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def data_generation() -> int:
+    """Génération courante des données (incrémentée à chaque commit contenant des écritures)"""
+    return _generation
+
+
+def bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+# Tables dérivées (totaux matérialisés) : les écrire ne change aucune facture
+DERIVED_TABLES = frozenset(
+    model.__table__ for model in (models.RollupSousProjetFpack, models.RollupSousProjet, models.RollupProjetGlobal)
+)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if getattr(type(obj), "__table__", None) not in DERIVED_TABLES:
+            session.info["invoice_cache_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_statement(orm_execute_state):
+    # insert/update/delete exécutés directement (ex. recalcul des coûts d'équipement)
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        if getattr(orm_execute_state.statement, "table", None) not in DERIVED_TABLES:
+            orm_execute_state.session.info["invoice_cache_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    # Incrément après le commit seulement : une lecture concurrente ne peut pas mettre
+    # en cache des données périmées sous la nouvelle génération
+    if session.info.pop("invoice_cache_dirty", False):
+        bump_generation()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _clear_on_rollback(session, previous_transaction):
+    session.info.pop("invoice_cache_dirty", None)
+
+
+class InvoiceCache:
+    """Cache LRU borné en octets"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # Une entrée trop grosse viderait tout le cache : elle n'est pas conservée
+        self.max_entry_bytes = max_bytes // 4
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+invoice_cache = InvoiceCache(INVOICE_CACHE_MAX_BYTES)
+
+
+def facture_fingerprint(facture_data: Dict[str, Any]) -> Tuple[str, int]:
+    """Empreinte du contenu d'une facture et taille de sa sérialisation"""
+    payload = json.dumps(facture_data, sort_keys=True, default=str, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:32], len(payload)
+
+
+def _instances_condition(scope: str, object_id: int):
+    """Instances F-Pack couvertes par une facture"""
+    instance = models.SousProjetFpack
+    if scope == "sous_projet_fpack":
+        return instance.id == object_id
+    if scope == "sous_projet":
+        return instance.sous_projet_id == object_id
+    if scope == "projet_global":
+        return instance.sous_projet_id.in_(select(models.SousProjet.id).where(models.SousProjet.id_global == object_id))
+    raise ValueError(f"Portée inconnue : {scope}")
+
+
+def _header_query(scope: str, object_id: int):
+    """Noms affichés en en-tête d'une facture (non suivis par les versions des totaux)"""
+    if scope == "sous_projet_fpack":
+        instance = models.SousProjetFpack
+        return select(
+            instance.FPack_number, instance.Robot_Location_Code, models.FPack.nom, models.FPack.fpack_abbr,
+            models.SousProjet.nom, models.ProjetGlobal.projet, models.Client.nom
+        ).select_from(instance)\
+            .outerjoin(models.FPack, models.FPack.id == instance.fpack_id)\
+            .outerjoin(models.SousProjet, models.SousProjet.id == instance.sous_projet_id)\
+            .outerjoin(models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global)\
+            .outerjoin(models.Client, models.Client.id == models.ProjetGlobal.client)\
+            .where(instance.id == object_id)
+    if scope == "sous_projet":
+        return select(models.SousProjet.nom, models.ProjetGlobal.projet, models.Client.nom).select_from(models.SousProjet)\
+            .outerjoin(models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global)\
+            .outerjoin(models.Client, models.Client.id == models.ProjetGlobal.client)\
+            .where(models.SousProjet.id == object_id)
+    return select(models.ProjetGlobal.projet, models.Client.nom, models.SousProjet.id, models.SousProjet.nom)\
+        .select_from(models.ProjetGlobal)\
+        .outerjoin(models.Client, models.Client.id == models.ProjetGlobal.client)\
+        .outerjoin(models.SousProjet, models.SousProjet.id_global == models.ProjetGlobal.id)\
+        .where(models.ProjetGlobal.id == object_id)\
+        .order_by(models.SousProjet.id)
+
+
+def data_version(db: Session, scope: str, object_id: int) -> Optional[str]:
+    """
+    Empreinte des lignes dont dépend une facture ("sous_projet_fpack", "sous_projet" ou
+    "projet_global") : instances couvertes, version de leurs totaux matérialisés et noms
+    d'en-tête. None si une instance n'a pas encore de totaux matérialisés (non suivie).
+    """
+    instance = models.SousProjetFpack
+    rollup = models.RollupSousProjetFpack
+    nb_instances, somme_ids, nb_suivies, somme_versions = db.execute(
+        select(func.count(instance.id), func.sum(instance.id), func.count(rollup.sous_projet_fpack_id), func.sum(rollup.version))
+        .select_from(instance)
+        .outerjoin(rollup, rollup.sous_projet_fpack_id == instance.id)
+        .where(_instances_condition(scope, object_id))
+    ).one()
+    if nb_suivies < nb_instances:
+        return None
+    header = [tuple(row) for row in db.execute(_header_query(scope, object_id)).all()]
+    payload = repr((nb_instances, somme_ids, somme_versions, header)).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+def get_cached_facture(load_facture: Callable[[int, Session], Dict[str, Any]],
+                       object_id: int, db: Session, scope: str) -> Tuple[Dict[str, Any], str]:
+    """
+    Données de facture et ETag, depuis le cache si l'empreinte des lignes dont dépend la
+    facture (data_version) n'a pas changé depuis le dernier calcul et que l'entrée n'a pas
+    expiré. Les données renvoyées sont partagées : ne pas les modifier.
+    """
+    if INVOICE_CACHE_TTL <= 0:
+        facture_data = load_facture(object_id, db)
+        return facture_data, facture_fingerprint(facture_data)[0]
+
+    key = ("facture", load_facture.__name__, object_id)
+    # Lue avant la facture : une écriture validée entre les deux change la version suivante
+    version = data_version(db, scope, object_id)
+    cached = invoice_cache.get(key)
+    if cached is not None and version is not None and cached[0] == version and cached[1] > time.monotonic():
+        return cached[2], cached[3]
+
+    facture_data = load_facture(object_id, db)
+    fingerprint, size = facture_fingerprint(facture_data)
+    if version is not None:
+        invoice_cache.put(key, (version, time.monotonic() + INVOICE_CACHE_TTL, facture_data, fingerprint), size)
+    return facture_data, fingerprint
+
+
+def document_etag(fingerprint: str, document_format: str) -> str:
+    """ETag d'un document rendu : empreinte du contenu de la facture et format"""
+    return f'"{fingerprint}-{document_format}"'
+
+
+def get_cached_document(etag: str) -> Optional[bytes]:
+    return invoice_cache.get(("document", etag))
+
+
+def put_cached_document(etag: str, content: bytes):
+    invoice_cache.put(("document", etag), content, len(content))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Vérifie l'en-tête If-None-Match (liste d'ETags, éventuellement faibles)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == etag or tag == f"W/{etag}" for tag in candidates)
@@ -0,0 +1,580 @@
+import io
+import os
+import re
+import tempfile
+import zipfile
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+
+# Imports pour PDF
+from reportlab.lib import colors # type: ignore
+from reportlab.lib.pagesizes import A4 # type: ignore
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer # type: ignore
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle # type: ignore
+from reportlab.lib.units import cm # type: ignore
+from reportlab.lib.enums import TA_CENTER # type: ignore
+
+# Imports pour Excel
+import openpyxl # type: ignore
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle # type: ignore
+from openpyxl.utils import get_column_letter # type: ignore
+
+# Ce module ne dépend pas de la base : il est importé par les processus de rendu (App.workers)
+
+# Nombre de lignes par tableau du détail : un seul tableau de plusieurs milliers de lignes
+# est redécoupé page après page par reportlab (coût quadratique), on le découpe donc à l'avance
+PDF_TABLE_CHUNK_ROWS = 500
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class LazyStory(list):
+    """
+    Liste de flowables remplie à la demande par un générateur : doc.build consomme la liste
+    par le début, seuls les quelques flowables en cours de mise en page (au plus un tableau
+    de PDF_TABLE_CHUNK_ROWS lignes) sont construits en même temps.
+    """
+    LOOKAHEAD = 3
+
+    def __init__(self, flowables: Iterator[Any]):
+        super().__init__()
+        self._source: Optional[Iterator[Any]] = flowables
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self.LOOKAHEAD:
+            flowable = next(self._source, None)
+            if flowable is None:
+                self._source = None
+            else:
+                self.append(flowable)
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+
+def generate_pdf_invoice(facture_data: Dict[str, Any], output=None):
+    """Génère une facture PDF esthétique (dans output : chemin ou fichier, sinon en mémoire)"""
+    buffer = output if output is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, 
+                           topMargin=2*cm, bottomMargin=2*cm)
+    max_char = 20
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.HexColor('#2563eb'),
+        alignment=TA_CENTER
+    )
+    
+    header_style = ParagraphStyle(
+        'CustomHeader',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        textColor=colors.HexColor('#1e3a8a')
+    )
+    
+    def story() -> Iterator[Any]:
+        yield Paragraph("FACTURE", title_style)
+        yield Spacer(1, 20)
+    
+        info_data = [["Projet Global:", facture_data["projet_global"]["nom"]]]
+    
+        if "sous_projets" in facture_data:
+            info_data.append(["Sous-projets:", str(len(facture_data["sous_projets"]))])
+        else:
+            info_data.append(["Sous-projet:", facture_data.get("nom_sous_projet", "N/A")])
+    
+        info_data.append(["Client:", facture_data.get("client_nom", "N/A")])
+    
+        if "fpack" in facture_data:
+            info_data.extend([
+                ["FPack:", f"{facture_data['fpack']['nom']} ({facture_data['fpack']['abbr']})"],
+                ["Numéro FPack:", facture_data["fpack"]["FPack_number"] or "N/A"],
+                ["Code Robot:", facture_data["fpack"]["Robot_Location_Code"] or "N/A"]
+            ])
+    
+        info_data.extend([
+            ["Date:", datetime.now().strftime("%d/%m/%Y")],
+            ["Devise:", facture_data["currency"]]
+        ])
+    
+        info_table = Table(info_data, colWidths=[4*cm, 8*cm])
+        info_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
+            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1e3a8a')),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f8fafc')]),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
+        ]))
+    
+        yield info_table
+        yield Spacer(1, 30)
+    
+        if "sous_projets" in facture_data:
+            yield Paragraph("Sous-totaux par sous-projet", header_style)
+            yield Spacer(1, 10)
+        
+            sous_totaux_data = [["Sous-projet", "F-Packs", "Produit €", "Transport €", "Total €"]]
+            for sp in facture_data["sous_projets"]:
+                sous_totaux_data.append([
+                    sp["nom_sous_projet"],
+                    str(sp["nb_fpacks"]),
+                    f"{sp['totaux']['produit']:.2f}",
+                    f"{sp['totaux']['transport']:.2f}",
+                    f"{sp['totaux']['global']:.2f}"
+                ])
+        
+            sous_totaux_table = Table(sous_totaux_data, colWidths=[7*cm, 2*cm, 2.5*cm, 2.5*cm, 3*cm])
+            sous_totaux_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8fafc')]),
+                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ]))
+        
+            yield sous_totaux_table
+            yield Spacer(1, 30)
+    
+        yield Paragraph("Détail des éléments", header_style)
+        yield Spacer(1, 10)
+    
+        header_row = ["Élément", "Qté", "Prix €", "Transport €", "Total €", "Commentaire"]
+        lines = facture_data["lines"]
+        col_widths = [6*cm, 1.5*cm, 2*cm, 2*cm, 2.5*cm, 4*cm]
+    
+        base_style = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3b82f6')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 1), (-1, -1), 9),
+            ('ALIGN', (1, 1), (4, -1), 'RIGHT'), 
+            ('ALIGN', (0, 1), (0, -1), 'LEFT'),  
+            ('ALIGN', (5, 1), (5, -1), 'LEFT'),   
+        
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8fafc')]),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]
+    
+        total_style = [
+            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#059669')),
+            ('TEXTCOLOR', (0, -1), (-1, -1), colors.whitesmoke),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, -1), (-1, -1), 11),
+            ('ALIGN', (0, -1), (-1, -1), 'CENTER'),
+        ]
+    
+        chunk_starts = range(0, len(lines), PDF_TABLE_CHUNK_ROWS) if lines else [0]
+        for start in chunk_starts:
+            chunk = lines[start:start + PDF_TABLE_CHUNK_ROWS]
+            table_data = [header_row]
+            table_style = list(base_style)
+        
+            for i, line in enumerate(chunk, 1):
+                raw_comment = line["commentaire"] if line["commentaire"] else ("aucun prix" if line["prix_unitaire"] == 0 else "-")
+                if raw_comment and len(str(raw_comment)) > max_char:
+                    comment = str(raw_comment)[:max_char] + "..."
+                else:
+                    comment = raw_comment
+                table_data.append([
+                    line["nom"],
+                    str(line["qte"]),
+                    f"{line['prix_unitaire']:.2f}",
+                    f"{line['prix_transport']:.2f}",
+                    f"{line['total_ligne']:.2f}",
+                    comment
+                ])
+                if line["prix_unitaire"] == 0:
+                    table_style.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor('#fef2f2')))
+                    table_style.append(('TEXTCOLOR', (0, i), (-1, i), colors.HexColor('#991b1b')))
+        
+            if start + PDF_TABLE_CHUNK_ROWS >= len(lines):
+                table_data.append([
+                    "TOTAL",
+                    "",
+                    f"{facture_data['totaux']['produit']:.2f}",
+                    f"{facture_data['totaux']['transport']:.2f}",
+                    f"{facture_data['totaux']['global']:.2f} €",
+                    ""
+                ])
+                table_style.extend(total_style)
+        
+            products_table = Table(table_data, colWidths=col_widths, repeatRows=1)
+            products_table.setStyle(TableStyle(table_style))
+            yield products_table
+    
+        yield Spacer(1, 30)
+        yield Paragraph("Résumé", header_style)
+    
+        resume_data = [
+            ["Nombre de lignes:", str(facture_data["resume"]["nb_lignes"])],
+            ["Nombre de produits:", str(facture_data["resume"]["nb_produits"])],
+            ["Nombre de robots:", str(facture_data["resume"]["nb_robots"])],
+            ["Nombre d'équipements:", str(facture_data["resume"]["nb_equipements"])]
+        ]
+    
+        resume_table = Table(resume_data, colWidths=[5*cm, 2*cm])
+        resume_table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
+        ]))
+    
+        yield resume_table
+    
+        yield Spacer(1, 40)
+        footer_style = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=colors.HexColor('#64748b'),
+            alignment=TA_CENTER
+        )
+        yield Paragraph(f"Facture générée le {datetime.now().strftime('%d/%m/%Y à %H:%M')}", footer_style)
+    
+    doc.build(LazyStory(story()))
+    if output is None:
+        buffer.seek(0)
+    return buffer
+
+# Facture Excel : les styles sont des styles nommés enregistrés une fois dans un classeur
+# modèle (construit une fois par processus) ; chaque cellule ne fait que référencer un style
+# par son nom, sans créer ni hacher de Font/PatternFill/Border par cellule.
+EXCEL_TEMPLATE_SHEET = "Facture"
+EXCEL_COLUMN_WIDTHS = [50, 8, 12, 12, 15, 25]
+EXCEL_SHEET_TITLE_MAX = 31
+
+def _excel_named_styles():
+    border = Border(
+        left=Side(style='thin', color='E2E8F0'),
+        right=Side(style='thin', color='E2E8F0'),
+        top=Side(style='thin', color='E2E8F0'),
+        bottom=Side(style='thin', color='E2E8F0')
+    )
+    normal_font = Font(name='Segoe UI', size=10)
+    bold_font = Font(name='Segoe UI', size=10, bold=True)
+    red_font = Font(name='Segoe UI', size=10, color='991B1B')
+    red_fill = PatternFill(start_color='FEF2F2', end_color='FEF2F2', fill_type='solid')
+    center = Alignment(horizontal='center', vertical='center')
+    right = Alignment(horizontal='right')
+
+    return [
+        NamedStyle(name="Facture titre", font=Font(name='Segoe UI', size=18, bold=True, color='2563EB'), alignment=center),
+        NamedStyle(name="Facture section", font=Font(name='Segoe UI', size=12, bold=True, color='1E3A8A')),
+        NamedStyle(name="Facture libellé", font=bold_font, border=border,
+                   fill=PatternFill(start_color='F1F5F9', end_color='F1F5F9', fill_type='solid')),
+        NamedStyle(name="Facture libellé résumé", font=bold_font, border=border),
+        NamedStyle(name="Facture texte", font=normal_font, border=border),
+        NamedStyle(name="Facture nombre", font=normal_font, border=border, alignment=right),
+        NamedStyle(name="Facture sans prix", font=red_font, fill=red_fill, border=border),
+        NamedStyle(name="Facture sans prix nombre", font=red_font, fill=red_fill, border=border, alignment=right),
+        NamedStyle(name="Facture en-tête", font=Font(name='Segoe UI', size=10, bold=True, color='FFFFFF'), border=border, alignment=center,
+                   fill=PatternFill(start_color='3B82F6', end_color='3B82F6', fill_type='solid')),
+        NamedStyle(name="Facture total", font=Font(name='Segoe UI', size=11, bold=True, color='FFFFFF'), border=border, alignment=center,
+                   fill=PatternFill(start_color='059669', end_color='059669', fill_type='solid')),
+        NamedStyle(name="Facture pied", font=Font(name='Segoe UI', size=8, color='64748B')),
+    ]
+
+@lru_cache(maxsize=1)
+def excel_invoice_template() -> bytes:
+    """Classeur modèle sérialisé : styles nommés, titre et largeurs de colonnes (une fois par processus)"""
+    wb = openpyxl.Workbook()
+    for style in _excel_named_styles():
+        wb.add_named_style(style)
+
+    ws = wb.active
+    ws.title = EXCEL_TEMPLATE_SHEET
+    ws.merge_cells('A1:F1')
+    ws['A1'] = 'FACTURE'
+    ws['A1'].style = "Facture titre"
+    ws.row_dimensions[1].height = 30
+    for i, width in enumerate(EXCEL_COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def load_excel_template():
+    """Nouveau classeur à partir du modèle en cache"""
+    return openpyxl.load_workbook(io.BytesIO(excel_invoice_template()))
+
+def _write_row(ws, row: int, values, styles):
+    for col, (value, style) in enumerate(zip(values, styles), 1):
+        ws.cell(row=row, column=col, value=value).style = style
+
+def write_excel_invoice(ws, facture_data: Dict[str, Any]):
+    """Écrit une facture dans une feuille copiée du modèle (titre et colonnes déjà en place)"""
+    row = 3
+    info_data = [("Projet Global:", facture_data["projet_global"]["nom"])]
+    
+    if "sous_projets" in facture_data:
+        info_data.append(("Sous-projets:", len(facture_data["sous_projets"])))
+    else:
+        info_data.append(("Sous-projet:", facture_data.get("nom_sous_projet", "N/A")))
+    
+    info_data.append(("Client:", facture_data.get("client_nom", "N/A")))
+    
+    if "fpack" in facture_data:
+        info_data.extend([
+            ("FPack:", f"{facture_data['fpack']['nom']} ({facture_data['fpack']['abbr']})"),
+            ("Numéro FPack:", facture_data["fpack"]["FPack_number"] or "N/A"),
+            ("Code Robot:", facture_data["fpack"]["Robot_Location_Code"] or "N/A")
+        ])
+    
+    info_data.extend([
+        ("Date:", datetime.now().strftime("%d/%m/%Y")),
+        ("Devise:", facture_data["currency"])
+    ])
+    
+    for label, value in info_data:
+        _write_row(ws, row, (label, value), ("Facture libellé", "Facture texte"))
+        row += 1
+    
+    row += 2
+    
+    if "sous_projets" in facture_data:
+        ws.cell(row=row, column=1, value="SOUS-TOTAUX PAR SOUS-PROJET").style = "Facture section"
+        row += 1
+        
+        _write_row(ws, row, ["Sous-projet", "F-Packs", "Produit €", "Transport €", "Total €"], ["Facture en-tête"] * 5)
+        row += 1
+        
+        sous_total_styles = ["Facture texte"] + ["Facture nombre"] * 4
+        for sp in facture_data["sous_projets"]:
+            values = [
+                sp["nom_sous_projet"],
+                sp["nb_fpacks"],
+                sp["totaux"]["produit"],
+                sp["totaux"]["transport"],
+                sp["totaux"]["global"]
+            ]
+            _write_row(ws, row, values, sous_total_styles)
+            row += 1
+        
+        row += 2
+
+    headers = ["Élément", "Qté", "Prix unitaire €", "Transport unitaire €", "Total €", "Commentaire"]
+    _write_row(ws, row, headers, ["Facture en-tête"] * 6)
+    row += 1
+    
+    # Lignes écrites en bloc : un style nommé par cellule, choisi selon le prix et le type de valeur
+    for line in facture_data["lines"]:
+        sans_prix = line["prix_unitaire"] == 0
+        texte, nombre = ("Facture sans prix", "Facture sans prix nombre") if sans_prix else ("Facture texte", "Facture nombre")
+        values = (
+            line["nom"],
+            line["qte"],
+            line["prix_unitaire"],
+            line["prix_transport"], 
+            line["total_ligne"],
+            line["commentaire"] if line["commentaire"] else 
+            (" Aucun prix" if sans_prix else "-")
+        )
+        for col, value in enumerate(values, 1):
+            numeric = 2 <= col <= 5 and isinstance(value, (int, float))
+            ws.cell(row=row, column=col, value=value).style = nombre if numeric else texte
+        row += 1
+    
+    total_values = [
+        "TOTAL",
+        "",
+        facture_data["totaux"]["produit"],
+        facture_data["totaux"]["transport"],
+        f"{facture_data['totaux']['global']} € TTC",
+        ""
+    ]
+    _write_row(ws, row, total_values, ["Facture total"] * 6)
+
+    row += 3
+    ws.cell(row=row, column=1, value="RÉSUMÉ").style = "Facture section"
+    row += 1
+    
+    resume_data = [
+        ("Nombre de lignes:", facture_data["resume"]["nb_lignes"]),
+        ("Nombre de produits:", facture_data["resume"]["nb_produits"]),
+        ("Nombre de robots:", facture_data["resume"]["nb_robots"]),
+        ("Nombre d'équipements:", facture_data["resume"]["nb_equipements"])
+    ]
+    
+    for label, value in resume_data:
+        _write_row(ws, row, (label, value), ("Facture libellé résumé", "Facture texte"))
+        row += 1
+    
+    row += 2
+    ws.cell(row=row, column=1, value=f"Facture générée le {datetime.now().strftime('%d/%m/%Y à %H:%M')}").style = "Facture pied"
+
+def excel_sheet_title(title: Any, used: set) -> str:
+    """Nom de feuille Excel valide (31 caractères, sans []:*?/\\) et unique dans le classeur"""
+    base = re.sub(r'[\[\]:*?/\\]', '-', str(title)).strip().strip("'") or "Facture"
+    candidate = base[:EXCEL_SHEET_TITLE_MAX]
+    n = 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate = base[:EXCEL_SHEET_TITLE_MAX - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+def generate_excel_invoice(facture_data: Dict[str, Any], output=None):
+    """Génère une facture Excel esthétique (dans output : chemin ou fichier, sinon en mémoire)"""
+    buffer = output if output is not None else io.BytesIO()
+    wb = load_excel_template()
+    write_excel_invoice(wb[EXCEL_TEMPLATE_SHEET], facture_data)
+    
+    wb.save(buffer)
+    if output is None:
+        buffer.seek(0)
+    return buffer
+
+def generate_excel_workbook(factures: List[Tuple[str, Dict[str, Any]]], output=None):
+    """
+    Plusieurs factures dans un seul classeur, une feuille par facture.
+    factures : liste de (nom de feuille, données de facture), dans l'ordre des feuilles.
+    """
+    if not factures:
+        raise ValueError("Aucune facture à écrire dans le classeur")
+    buffer = output if output is not None else io.BytesIO()
+    wb = load_excel_template()
+    modele = wb[EXCEL_TEMPLATE_SHEET]
+    used: set = set()
+    for title, facture_data in factures:
+        ws = wb.copy_worksheet(modele)
+        ws.title = excel_sheet_title(title, used)
+        write_excel_invoice(ws, facture_data)
+    wb.remove(modele)
+    
+    wb.save(buffer)
+    if output is None:
+        buffer.seek(0)
+    return buffer
+
+
+def render_pdf_bytes(facture_data: Dict[str, Any]) -> bytes:
+    """Point d'entrée des processus de rendu : facture PDF sous forme de bytes"""
+    return generate_pdf_invoice(facture_data).getvalue()
+
+def render_excel_bytes(facture_data: Dict[str, Any]) -> bytes:
+    """Point d'entrée des processus de rendu : facture Excel sous forme de bytes"""
+    return generate_excel_invoice(facture_data).getvalue()
+
+
+def render_spooled(generate_fn, facture_data: Dict[str, Any], suffix: str,
+                   threshold: int, spool_dir: Optional[str] = None) -> Union[bytes, str]:
+    """
+    Rend la facture directement dans un fichier temporaire.
+    Sous le seuil (en octets) le contenu est relu et renvoyé en bytes, au-delà le chemin
+    du fichier est renvoyé pour être streamé par morceaux (puis supprimé par l'appelant).
+    """
+    fd, path = tempfile.mkstemp(prefix="facture-", suffix=suffix, dir=spool_dir)
+    os.close(fd)
+    try:
+        generate_fn(facture_data, path)
+        if os.path.getsize(path) > threshold:
+            return path
+        with open(path, "rb") as f:
+            content = f.read()
+    except BaseException:
+        remove_spool_file(path)
+        raise
+    remove_spool_file(path)
+    return content
+
+def render_pdf_spooled(facture_data: Dict[str, Any], threshold: int, spool_dir: Optional[str] = None) -> Union[bytes, str]:
+    """Point d'entrée des processus de rendu : facture PDF, bytes ou fichier temporaire"""
+    return render_spooled(generate_pdf_invoice, facture_data, ".pdf", threshold, spool_dir)
+
+def render_excel_spooled(facture_data: Dict[str, Any], threshold: int, spool_dir: Optional[str] = None) -> Union[bytes, str]:
+    """Point d'entrée des processus de rendu : facture Excel, bytes ou fichier temporaire"""
+    return render_spooled(generate_excel_invoice, facture_data, ".xlsx", threshold, spool_dir)
+
+def render_excel_workbook_spooled(factures: List[Tuple[str, Dict[str, Any]]], threshold: int, spool_dir: Optional[str] = None) -> Union[bytes, str]:
+    """Point d'entrée des processus de rendu : classeur de plusieurs factures, bytes ou fichier temporaire"""
+    return render_spooled(generate_excel_workbook, factures, ".xlsx", threshold, spool_dir)
+
+def iter_spool_file(path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Lit un fichier temporaire par morceaux et le supprime une fois lu"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        remove_spool_file(path)
+
+def remove_spool_file(path: str):
+    """Supprime un fichier temporaire de rendu (déjà supprimé : ignoré)"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def zip_entry_name(*parts: Any) -> str:
+    """Nom d'entrée d'archive (dossiers séparés par /, caractères interdits remplacés)"""
+    return "/".join(re.sub(r'[\\/:*?"<>|]+', "_", str(part)).strip() or "_" for part in parts)
+
+class ZipStream:
+    """
+    Archive ZIP écrite au fil de l'eau : chaque entrée ajoutée renvoie les octets produits,
+    à transmettre tout de suite au client. L'archive n'est jamais entièrement en mémoire.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        # Flux non positionnable : zipfile écrit des descripteurs de données après chaque entrée
+        self.zip = zipfile.ZipFile(self, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+    def add_bytes(self, name: str, content: bytes) -> bytes:
+        self.zip.writestr(name, content)
+        return self._take()
+
+    def add_file(self, name: str, path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        with open(path, "rb") as src, self.zip.open(name, mode="w", force_zip64=True) as dest:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                yield self._take()
+        yield self._take()
+
+    def close(self) -> bytes:
+        self.zip.close()
+        return self._take()
@@ -1,13 +1,42 @@
+import multiprocessing
+
+if __name__ == "__main__":
+    # Avant tout autre import : dans l'exécutable PyInstaller, un processus du pool de rendu
+    # des factures est pris en charge ici sans se connecter à la base
+    multiprocessing.freeze_support()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
-from App.database import engine
+from App.database import engine, SessionLocal
 from App import models
+from App.pricing import ensure_equipement_costs
+from App.completeness import ensure_completeness_counters
+from App.rollups import start_rollup_refresher, stop_rollup_refresher
+from App.workers import shutdown_render_pool
 from App.main_routes import router
 import uvicorn # type: ignore
 
-models.Base.metadata.create_all(bind=engine)
+def ensure_indexes():
+    """Crée les index manquants : create_all ne crée les index que des nouvelles tables"""
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schéma créé au démarrage du serveur seulement (pas à l'import, refait par chaque processus de rendu)
+    models.Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    ensure_completeness_counters(engine)
+    with SessionLocal() as db:
+        ensure_equipement_costs(db)
+    start_rollup_refresher(SessionLocal)
+    yield
+    stop_rollup_refresher()
+    shutdown_render_pool()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173"
@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base # type: ignore
-from sqlalchemy import Column, Integer, Numeric, String, ForeignKey, Text, Float # type: ignore
+from sqlalchemy import Column, Integer, Numeric, String, ForeignKey, Text, Float, DateTime, LargeBinary, Boolean, Index # type: ignore
 from sqlalchemy.orm import relationship # type: ignore
 
 Base = declarative_base()
@@ -104,6 +104,16 @@ class Equipement_Produit(Base):
     produits = relationship("Produit", back_populates="equipement_produit", passive_deletes=True)
     equipements = relationship("Equipements", back_populates="equipement_produit", passive_deletes=True)
 
+class EquipementCost(Base):
+    """Coût matérialisé d'un équipement par client (somme des prix de ses produits internes)"""
+    __tablename__ = "FPM_equipement_cost"
+    __table_args__ = {'schema': 'dbo'}
+
+    equipement_id = Column(Integer, ForeignKey("dbo.FPM_equipements.id", ondelete="CASCADE"), primary_key=True)
+    client_id = Column(Integer, ForeignKey("dbo.FPM_clients.id", ondelete="CASCADE"), primary_key=True)
+    prix_produit = Column(Float, nullable=False, default=0)
+    prix_transport = Column(Float, nullable=False, default=0)
+
 # FPACK
 class FPack(Base):
     __tablename__ = "FPM_fpacks"
@@ -130,7 +140,10 @@ class Groupes(Base):
 
 class GroupeItem(Base):
     __tablename__ = "FPM_groupe_items"
-    __table_args__ = {'schema': 'dbo'}
+    __table_args__ = (
+        Index("ix_FPM_groupe_items_groupe_item", "group_id", "type", "ref_id"),
+        {'schema': 'dbo'}
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     group_id = Column(Integer, ForeignKey("dbo.FPM_groupes.id", ondelete="CASCADE"), nullable=False)
@@ -145,7 +158,7 @@ class FPackConfigColumn(Base):
     __table_args__ = {'schema': 'dbo'}
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    fpack_id = Column(Integer, ForeignKey("dbo.FPM_fpacks.id", ondelete="CASCADE"), nullable=False)
+    fpack_id = Column(Integer, ForeignKey("dbo.FPM_fpacks.id", ondelete="CASCADE"), nullable=False, index=True)
     ordre = Column(Integer, nullable=False)
     type = Column(String(50), nullable=False)  # 'produit' | 'equipement' | 'group'
     ref_id = Column(Integer, nullable=True)
@@ -178,8 +191,8 @@ class ProjetGlobal(Base):
     __table_args__ = {'schema': 'dbo'}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    projet = Column(String(255), nullable=True)  
-    client = Column(Integer, ForeignKey("dbo.FPM_clients.id", ondelete="CASCADE"), nullable=False)
+    projet = Column(String(255), nullable=True, index=True)
+    client = Column(Integer, ForeignKey("dbo.FPM_clients.id", ondelete="CASCADE"), nullable=False, index=True)
 
     projets = relationship("SousProjet", back_populates="global_rel", cascade="all, delete-orphan", passive_deletes=True)
     client_rel = relationship("Client", back_populates="projets_globaux", passive_deletes=True)
@@ -190,8 +203,8 @@ class SousProjet(Base):
     __table_args__ = {'schema': 'dbo'}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    nom = Column(String(255), nullable=False)
-    id_global = Column(Integer, ForeignKey("dbo.FPM_projets_global.id", ondelete="CASCADE"), nullable=False)  
+    nom = Column(String(255), nullable=False, index=True)
+    id_global = Column(Integer, ForeignKey("dbo.FPM_projets_global.id", ondelete="CASCADE"), nullable=False, index=True)
 
     global_rel = relationship("ProjetGlobal", back_populates="projets", passive_deletes=True)
     fpacks = relationship("SousProjetFpack", back_populates="sous_projet", cascade="all, delete-orphan", passive_deletes=True)
@@ -201,14 +214,17 @@ class SousProjetFpack(Base):
     __table_args__ = {'schema': 'dbo'}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    sous_projet_id = Column(Integer, ForeignKey("dbo.FPM_sous_projets.id", ondelete="CASCADE"))
-    fpack_id = Column(Integer, ForeignKey("dbo.FPM_fpacks.id", ondelete="CASCADE"))
+    sous_projet_id = Column(Integer, ForeignKey("dbo.FPM_sous_projets.id", ondelete="CASCADE"), index=True)
+    fpack_id = Column(Integer, ForeignKey("dbo.FPM_fpacks.id", ondelete="CASCADE"), index=True)
     FPack_number = Column(String(255), nullable=True)
     Robot_Location_Code = Column(String(255), nullable=True)
     contractor = Column(String(255), nullable=False, default="N/A")
     required_delivery_time = Column(String(255), nullable=False, default="N/A")
     delivery_site = Column(String(255), nullable=False, default="N/A")
     tracking = Column(String(255), nullable=False, default="N/A")
+    # Compteurs de complétude dénormalisés, maintenus au commit par App.completeness
+    nb_selections = Column(Integer, nullable=False, default=0, server_default="0")
+    nb_groupes_attendus = Column(Integer, nullable=False, default=0, server_default="0")
 
     sous_projet = relationship("SousProjet", back_populates="fpacks", passive_deletes=True)
     fpack = relationship("FPack", back_populates="sous_projets", passive_deletes=True)
@@ -216,7 +232,10 @@ class SousProjetFpack(Base):
     
 class ProjetSelection(Base):
     __tablename__ = "FPM_projet_selection"
-    __table_args__ = {'schema': 'dbo'}
+    __table_args__ = (
+        Index("ix_FPM_projet_selection_item", "type_item", "ref_id"),
+        {'schema': 'dbo'}
+    )
 
     sous_projet_fpack_id = Column(Integer, ForeignKey("dbo.FPM_sous_projet_fpack.id", ondelete="CASCADE"), primary_key=True)
     groupe_id = Column(Integer, ForeignKey("dbo.FPM_groupes.id", ondelete="CASCADE"), primary_key=True)
@@ -224,4 +243,107 @@ class ProjetSelection(Base):
     ref_id = Column(Integer, nullable=False)
 
     sous_projet_fpack = relationship("SousProjetFpack", back_populates="selections", passive_deletes=True)
-    groupe = relationship("Groupes", back_populates="projet_selections", passive_deletes=True)
\ No newline at end of file
+    groupe = relationship("Groupes", back_populates="projet_selections", passive_deletes=True)
+
+# FACTURES ÉMISES (figées : lignes, totaux et documents ne sont plus recalculés)
+class FactureEmise(Base):
+    __tablename__ = "FPM_factures_emises"
+    __table_args__ = {'schema': 'dbo'}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    numero = Column(String(50), unique=True, nullable=True)
+    date_emission = Column(DateTime, nullable=False)
+    # Conservée si l'instance est supprimée : la facture reste consultable
+    sous_projet_fpack_id = Column(Integer, ForeignKey("dbo.FPM_sous_projet_fpack.id", ondelete="SET NULL"), nullable=True, index=True)
+    sous_projet_id = Column(Integer, nullable=True)
+    nom_sous_projet = Column(String(255), nullable=True)
+    projet_global_id = Column(Integer, nullable=True)
+    projet_global_nom = Column(String(255), nullable=True)
+    client_id = Column(Integer, nullable=True)
+    client_nom = Column(String(255), nullable=True)
+    fpack_id = Column(Integer, nullable=True)
+    fpack_nom = Column(String(255), nullable=True)
+    fpack_abbr = Column(String(25), nullable=True)
+    FPack_number = Column(String(255), nullable=True)
+    Robot_Location_Code = Column(String(255), nullable=True)
+    currency = Column(String(10), nullable=False, default="EUR")
+    total_produit = Column(Float, nullable=False, default=0)
+    total_transport = Column(Float, nullable=False, default=0)
+    total_global = Column(Float, nullable=False, default=0)
+
+    lignes = relationship("FactureEmiseLigne", back_populates="facture", cascade="all, delete-orphan", passive_deletes=True, order_by="FactureEmiseLigne.position")
+    documents = relationship("FactureEmiseDocument", back_populates="facture", cascade="all, delete-orphan", passive_deletes=True)
+
+class FactureEmiseLigne(Base):
+    __tablename__ = "FPM_facture_emise_lignes"
+    __table_args__ = {'schema': 'dbo'}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    facture_id = Column(Integer, ForeignKey("dbo.FPM_factures_emises.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    type = Column(String(50), nullable=False)  # 'produit' | 'equipement' | 'robot'
+    ref_id = Column(Integer, nullable=False)
+    nom = Column(String(255), nullable=False)
+    qte = Column(Integer, nullable=False)
+    prix_unitaire = Column(Float, nullable=False)
+    prix_transport = Column(Float, nullable=False)
+    total_ligne = Column(Float, nullable=False)
+    commentaire = Column(String(255), nullable=True)
+
+    facture = relationship("FactureEmise", back_populates="lignes")
+
+class FactureEmiseDocument(Base):
+    __tablename__ = "FPM_facture_emise_documents"
+    __table_args__ = {'schema': 'dbo'}
+
+    facture_id = Column(Integer, ForeignKey("dbo.FPM_factures_emises.id", ondelete="CASCADE"), primary_key=True)
+    format = Column(String(10), primary_key=True)  # 'pdf' | 'excel'
+    contenu = Column(LargeBinary, nullable=False)
+
+    facture = relationship("FactureEmise", back_populates="documents")
+
+# TOTAUX MATÉRIALISÉS (tables dérivées maintenues par App.rollups, sans clé étrangère :
+# les lignes orphelines sont nettoyées au rafraîchissement)
+class RollupSousProjetFpack(Base):
+    __tablename__ = "FPM_rollup_sous_projet_fpack"
+    __table_args__ = {'schema': 'dbo'}
+
+    sous_projet_fpack_id = Column(Integer, primary_key=True)
+    sous_projet_id = Column(Integer, nullable=True, index=True)
+    projet_global_id = Column(Integer, nullable=True, index=True)
+    total_produit = Column(Float, nullable=False, default=0)
+    total_transport = Column(Float, nullable=False, default=0)
+    total_global = Column(Float, nullable=False, default=0)
+    nb_lignes = Column(Integer, nullable=False, default=0)
+    nb_lignes_sans_prix = Column(Integer, nullable=False, default=0)
+    # stale : à recalculer ; version : incrémentée à chaque invalidation (rafraîchissement optimiste)
+    stale = Column(Boolean, nullable=False, default=False, index=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+class RollupSousProjet(Base):
+    __tablename__ = "FPM_rollup_sous_projet"
+    __table_args__ = {'schema': 'dbo'}
+
+    sous_projet_id = Column(Integer, primary_key=True)
+    projet_global_id = Column(Integer, nullable=True, index=True)
+    nb_fpacks = Column(Integer, nullable=False, default=0)
+    total_produit = Column(Float, nullable=False, default=0)
+    total_transport = Column(Float, nullable=False, default=0)
+    total_global = Column(Float, nullable=False, default=0)
+    nb_lignes_sans_prix = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+class RollupProjetGlobal(Base):
+    __tablename__ = "FPM_rollup_projet_global"
+    __table_args__ = {'schema': 'dbo'}
+
+    projet_global_id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, nullable=True, index=True)
+    nb_sous_projets = Column(Integer, nullable=False, default=0)
+    nb_fpacks = Column(Integer, nullable=False, default=0)
+    total_produit = Column(Float, nullable=False, default=0)
+    total_transport = Column(Float, nullable=False, default=0)
+    total_global = Column(Float, nullable=False, default=0)
+    nb_lignes_sans_prix = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
@@ -0,0 +1,19 @@
+from typing import Any, List, Optional, Tuple
+
+# Pagination par curseur (keyset) : les pages sont lues dans l'ordre croissant d'une clé
+# indexée (l'id), à partir de la dernière clé de la page précédente. Le coût d'une page
+# ne dépend pas de sa position, contrairement à OFFSET.
+
+
+def keyset_page(query, key, after: Optional[int], limit: Optional[int]) -> Tuple[List[Any], bool]:
+    """
+    Lignes de query après le curseur after, triées par key ; lit limit + 1 lignes pour
+    savoir s'il reste une page. Sans limit, renvoie toutes les lignes.
+    """
+    if after is not None:
+        query = query.filter(key > after)
+    query = query.order_by(key)
+    if limit is None:
+        return query.all(), False
+    rows = query.limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,177 @@
+from collections import defaultdict
+from typing import Any, Dict, Optional
+from sqlalchemy import and_, exists, literal, select, union # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+
+# Couverture tarifaire : items utilisés sans prix pour le client concerné.
+# Chaque périmètre (projets globaux ou client) est décrit par des sous-requêtes
+# (perimetre_id, client_id, ref_id) par type d'item, puis une seule requête d'anti-jointure
+# (NOT EXISTS) par type liste les manquants : produits, robots, composants d'équipements,
+# équipements sans nomenclature. Comme dans les factures (prix_unitaire == 0), un prix
+# à zéro compte comme manquant.
+
+
+def _used_items_projets(type_item: str, projet_global_id: Optional[int] = None):
+    """Items d'un type utilisés par les projets globaux : colonnes fixes des templates et sélections"""
+    colonnes = select(
+        models.ProjetGlobal.id.label("perimetre_id"),
+        models.ProjetGlobal.client.label("client_id"),
+        models.FPackConfigColumn.ref_id.label("ref_id")
+    ).join(
+        models.SousProjet, models.SousProjet.id_global == models.ProjetGlobal.id
+    ).join(
+        models.SousProjetFpack, models.SousProjetFpack.sous_projet_id == models.SousProjet.id
+    ).join(
+        models.FPackConfigColumn, models.FPackConfigColumn.fpack_id == models.SousProjetFpack.fpack_id
+    ).where(models.FPackConfigColumn.type == type_item)
+
+    selections = select(
+        models.ProjetGlobal.id.label("perimetre_id"),
+        models.ProjetGlobal.client.label("client_id"),
+        models.ProjetSelection.ref_id.label("ref_id")
+    ).join(
+        models.SousProjet, models.SousProjet.id_global == models.ProjetGlobal.id
+    ).join(
+        models.SousProjetFpack, models.SousProjetFpack.sous_projet_id == models.SousProjet.id
+    ).join(
+        models.ProjetSelection, models.ProjetSelection.sous_projet_fpack_id == models.SousProjetFpack.id
+    ).where(models.ProjetSelection.type_item == type_item)
+
+    if projet_global_id is not None:
+        colonnes = colonnes.where(models.ProjetGlobal.id == projet_global_id)
+        selections = selections.where(models.ProjetGlobal.id == projet_global_id)
+
+    return union(colonnes, selections).subquery()
+
+
+def _used_items_client(type_item: str, client_id: int):
+    """Items d'un type atteignables depuis les F-Packs d'un client : colonnes fixes et options des groupes"""
+    colonnes = select(
+        literal(client_id).label("perimetre_id"),
+        literal(client_id).label("client_id"),
+        models.FPackConfigColumn.ref_id.label("ref_id")
+    ).join(
+        models.FPack, models.FPack.id == models.FPackConfigColumn.fpack_id
+    ).where(
+        models.FPack.client == client_id,
+        models.FPackConfigColumn.type == type_item
+    )
+
+    options = select(
+        literal(client_id).label("perimetre_id"),
+        literal(client_id).label("client_id"),
+        models.GroupeItem.ref_id.label("ref_id")
+    ).join(
+        models.FPackConfigColumn, and_(
+            models.FPackConfigColumn.type == "group",
+            models.FPackConfigColumn.ref_id == models.GroupeItem.group_id
+        )
+    ).join(
+        models.FPack, models.FPack.id == models.FPackConfigColumn.fpack_id
+    ).where(
+        models.FPack.client == client_id,
+        models.GroupeItem.type == type_item
+    )
+
+    return union(colonnes, options).subquery()
+
+
+def missing_prices(db: Session, used_items) -> Dict[str, list]:
+    """
+    Anti-jointures sur les items utilisés (used_items : fonction type_item -> sous-requête
+    perimetre_id, client_id, ref_id). Renvoie les lignes manquantes par catégorie.
+    """
+    produits = used_items("produit")
+    rows_produits = db.execute(
+        select(produits.c.perimetre_id, models.Produit.id, models.Produit.reference, models.Produit.nom)
+        .join(models.Produit, models.Produit.id == produits.c.ref_id)
+        .where(~exists().where(
+            models.Prix.produit_id == produits.c.ref_id,
+            models.Prix.client_id == produits.c.client_id,
+            models.Prix.prix_produit != 0
+        ))
+        .distinct()
+        .order_by(produits.c.perimetre_id, models.Produit.id)
+    ).all()
+
+    robots = used_items("robot")
+    rows_robots = db.execute(
+        select(robots.c.perimetre_id, models.Robots.id, models.Robots.reference, models.Robots.nom)
+        .join(models.Robots, models.Robots.id == robots.c.ref_id)
+        .where(~exists().where(models.PrixRobot.id == robots.c.ref_id, models.PrixRobot.prix_robot != 0))
+        .distinct()
+        .order_by(robots.c.perimetre_id, models.Robots.id)
+    ).all()
+
+    equipements = used_items("equipement")
+    rows_composants = db.execute(
+        select(
+            equipements.c.perimetre_id,
+            models.Equipements.id, models.Equipements.nom,
+            models.Produit.id, models.Produit.reference, models.Produit.nom
+        )
+        .join(models.Equipements, models.Equipements.id == equipements.c.ref_id)
+        .join(models.Equipement_Produit, models.Equipement_Produit.equipement_id == equipements.c.ref_id)
+        .join(models.Produit, models.Produit.id == models.Equipement_Produit.produit_id)
+        .where(~exists().where(
+            models.Prix.produit_id == models.Equipement_Produit.produit_id,
+            models.Prix.client_id == equipements.c.client_id,
+            models.Prix.prix_produit != 0
+        ))
+        .distinct()
+        .order_by(equipements.c.perimetre_id, models.Equipements.id, models.Produit.id)
+    ).all()
+
+    rows_equipements_vides = db.execute(
+        select(equipements.c.perimetre_id, models.Equipements.id, models.Equipements.nom)
+        .join(models.Equipements, models.Equipements.id == equipements.c.ref_id)
+        .where(~exists().where(models.Equipement_Produit.equipement_id == equipements.c.ref_id))
+        .distinct()
+        .order_by(equipements.c.perimetre_id, models.Equipements.id)
+    ).all()
+
+    resultat = defaultdict(lambda: {"produits": [], "robots": [], "composants_equipements": [], "equipements_vides": []})
+    for perimetre_id, pid, reference, nom in rows_produits:
+        resultat[perimetre_id]["produits"].append({"id": pid, "reference": reference, "nom": nom})
+    for perimetre_id, rid, reference, nom in rows_robots:
+        resultat[perimetre_id]["robots"].append({"id": rid, "reference": reference, "nom": nom})
+    for perimetre_id, eid, equipement_nom, pid, reference, nom in rows_composants:
+        resultat[perimetre_id]["composants_equipements"].append({
+            "equipement_id": eid,
+            "equipement_nom": equipement_nom,
+            "produit_id": pid,
+            "reference": reference,
+            "nom": nom
+        })
+    for perimetre_id, eid, nom in rows_equipements_vides:
+        resultat[perimetre_id]["equipements_vides"].append({"id": eid, "nom": nom})
+    return resultat
+
+
+def coverage_report(manquants: Dict[str, list]) -> Dict[str, Any]:
+    nb_manquants = sum(len(lignes) for lignes in manquants.values())
+    return {
+        "produits_sans_prix": manquants["produits"],
+        "robots_sans_prix": manquants["robots"],
+        "composants_equipements_sans_prix": manquants["composants_equipements"],
+        "equipements_sans_composants": manquants["equipements_vides"],
+        "nb_manquants": nb_manquants,
+        "complet": nb_manquants == 0
+    }
+
+
+def price_coverage_projet_global(db: Session, projet_global_id: int) -> Dict[str, Any]:
+    manquants = missing_prices(db, lambda type_item: _used_items_projets(type_item, projet_global_id))
+    return coverage_report(manquants[projet_global_id])
+
+
+def price_coverage_client(db: Session, client_id: int) -> Dict[str, Any]:
+    manquants = missing_prices(db, lambda type_item: _used_items_client(type_item, client_id))
+    return coverage_report(manquants[client_id])
+
+
+def price_coverage_all_projets(db: Session) -> Dict[int, Dict[str, Any]]:
+    """Couverture de tous les projets globaux en quatre requêtes (contrôle nocturne)"""
+    manquants = missing_prices(db, _used_items_projets)
+    return {projet_global_id: coverage_report(m) for projet_global_id, m in manquants.items()}
@@ -0,0 +1,669 @@
+from collections import defaultdict
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import numpy as np # type: ignore
+from fastapi import HTTPException # type: ignore
+from sqlalchemy import func, select, insert, delete # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+
+IN_CHUNK_SIZE = 1000
+COMMENTAIRE_EQUIPEMENT = "Somme des prix des produits internes"
+
+
+def chunked(ids: Iterable[int], size: int = IN_CHUNK_SIZE):
+    """Découpe une liste d'IDs pour rester sous la limite de paramètres de SQL Server"""
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def equipement_ids_for_produits(db: Session, produit_ids: Iterable[int]) -> List[int]:
+    """Équipements dont la nomenclature contient au moins un des produits"""
+    equipement_ids = set()
+    for chunk in chunked(set(produit_ids)):
+        rows = db.query(models.Equipement_Produit.equipement_id)\
+            .filter(models.Equipement_Produit.produit_id.in_(chunk))\
+            .distinct().all()
+        equipement_ids.update(eid for eid, in rows)
+    return list(equipement_ids)
+
+
+def refresh_equipement_costs(
+    db: Session,
+    equipement_ids: Optional[Iterable[int]] = None,
+    client_ids: Optional[Iterable[int]] = None
+) -> None:
+    """
+    Recalcule la table FPM_equipement_cost (sans commit) pour les équipements et clients donnés,
+    ou pour toute la table si aucun filtre n'est passé.
+    Un produit sans prix pour le client ne compte pas ; une quantité nulle compte pour 1.
+    """
+    equipement_ids = None if equipement_ids is None else list(set(equipement_ids))
+    client_ids = None if client_ids is None else list(set(client_ids))
+    if equipement_ids == [] or client_ids == []:
+        return
+
+    db.flush()
+
+    cost_table = models.EquipementCost.__table__
+    quantite = func.coalesce(func.nullif(models.Equipement_Produit.quantite, 0), 1)
+
+    for chunk in (chunked(equipement_ids) if equipement_ids is not None else [None]):
+        delete_stmt = delete(cost_table)
+        aggregate = select(
+            models.Equipement_Produit.equipement_id,
+            models.Prix.client_id,
+            func.sum(func.coalesce(models.Prix.prix_produit, 0) * quantite),
+            func.sum(func.coalesce(models.Prix.prix_transport, 0) * quantite)
+        ).join(
+            models.Prix, models.Prix.produit_id == models.Equipement_Produit.produit_id
+        ).group_by(
+            models.Equipement_Produit.equipement_id,
+            models.Prix.client_id
+        )
+
+        if chunk is not None:
+            delete_stmt = delete_stmt.where(cost_table.c.equipement_id.in_(chunk))
+            aggregate = aggregate.where(models.Equipement_Produit.equipement_id.in_(chunk))
+        if client_ids is not None:
+            delete_stmt = delete_stmt.where(cost_table.c.client_id.in_(client_ids))
+            aggregate = aggregate.where(models.Prix.client_id.in_(client_ids))
+
+        db.execute(delete_stmt)
+        db.execute(insert(cost_table).from_select(
+            ["equipement_id", "client_id", "prix_produit", "prix_transport"],
+            aggregate
+        ))
+
+
+def refresh_costs_for_produits(db: Session, produit_ids: Iterable[int], client_ids: Optional[Iterable[int]] = None) -> None:
+    """Invalide les coûts des équipements contenant les produits dont le prix a changé"""
+    refresh_equipement_costs(db, equipement_ids_for_produits(db, produit_ids), client_ids)
+
+
+def ensure_equipement_costs(db: Session) -> None:
+    """Remplit la table des coûts d'équipements au premier démarrage (table vide, nomenclatures existantes)"""
+    if db.query(models.EquipementCost).first() is None and db.query(models.Equipement_Produit).first() is not None:
+        refresh_equipement_costs(db)
+        db.commit()
+
+
+class PricingEngine:
+    """
+    Moteur de tarification ensembliste des factures F-Pack.
+    Toutes les données (instances, configuration, sélections, noms, prix, coûts d'équipements)
+    sont chargées en un nombre fixe de requêtes IN (...), puis la facture est construite en mémoire.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.instances: Dict[int, Dict[str, Any]] = {}
+        self.config_columns: Dict[int, List[Tuple[str, int]]] = {}
+        self.selections: Dict[int, List[Tuple[str, int]]] = {}
+        self.produit_noms: Dict[int, str] = {}
+        self.equipement_noms: Dict[int, str] = {}
+        self.robot_noms: Dict[int, str] = {}
+        self.prix: Dict[Tuple[int, int], models.Prix] = {}
+        self.prix_robot: Dict[int, models.PrixRobot] = {}
+        self.couts_equipement: Dict[Tuple[int, int], models.EquipementCost] = {}
+
+    # ========== CHARGEMENT ==========
+
+    def load(self, sous_projet_fpack_ids: Iterable[int]) -> "PricingEngine":
+        """Charge en lot toutes les données nécessaires aux factures des instances demandées"""
+        ids = [i for i in set(sous_projet_fpack_ids) if i not in self.instances]
+        if not ids:
+            return self
+
+        self._load_instances(ids)
+        loaded_ids = [i for i in ids if i in self.instances]
+
+        fpack_ids = {self.instances[i]["fpack_id"] for i in loaded_ids} - set(self.config_columns)
+        self._load_config_columns(fpack_ids)
+        self._load_selections(loaded_ids)
+
+        keys = set()
+        for i in loaded_ids:
+            keys.update(self.config_columns.get(self.instances[i]["fpack_id"], []))
+            keys.update(self.selections.get(i, []))
+
+        client_ids = {self.instances[i]["client"].id for i in loaded_ids if self.instances[i]["client"]}
+        self.load_catalogue(keys, client_ids)
+        return self
+
+    def load_catalogue(self, keys: Iterable[Tuple[str, int]], client_ids: Iterable[int]):
+        """Charge noms et prix pour un ensemble d'items (type, ref_id) et de clients"""
+        produit_ids, equipement_ids, robot_ids = set(), set(), set()
+        for type_item, ref_id in keys:
+            if type_item == "produit":
+                produit_ids.add(ref_id)
+            elif type_item == "equipement":
+                equipement_ids.add(ref_id)
+            elif type_item == "robot":
+                robot_ids.add(ref_id)
+
+        self._load_items(produit_ids, equipement_ids, robot_ids)
+        self._load_prices(set(client_ids), produit_ids, equipement_ids, robot_ids)
+
+    def _load_instances(self, ids: List[int]):
+        """Charge les instances avec sous-projet, projet global, client et template en une jointure"""
+        for chunk in chunked(ids):
+            rows = self.db.query(
+                models.SousProjetFpack,
+                models.SousProjet,
+                models.ProjetGlobal,
+                models.Client,
+                models.FPack
+            ).outerjoin(
+                models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+            ).outerjoin(
+                models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global
+            ).outerjoin(
+                models.Client, models.Client.id == models.ProjetGlobal.client
+            ).outerjoin(
+                models.FPack, models.FPack.id == models.SousProjetFpack.fpack_id
+            ).filter(models.SousProjetFpack.id.in_(chunk)).all()
+
+            for spf, sous_projet, projet_global, client, fpack in rows:
+                self.instances[spf.id] = {
+                    "sous_projet_fpack": spf,
+                    "fpack_id": spf.fpack_id,
+                    "sous_projet": sous_projet,
+                    "projet_global": projet_global,
+                    "client": client,
+                    "fpack": fpack
+                }
+
+    def _load_config_columns(self, fpack_ids: Iterable[int]):
+        """Charge les colonnes produit/équipement des templates, triées par ordre"""
+        fpack_ids = [f for f in fpack_ids if f is not None]
+        for fpack_id in fpack_ids:
+            self.config_columns[fpack_id] = []
+
+        for chunk in chunked(fpack_ids):
+            rows = self.db.query(
+                models.FPackConfigColumn.fpack_id,
+                models.FPackConfigColumn.type,
+                models.FPackConfigColumn.ref_id
+            ).filter(
+                models.FPackConfigColumn.fpack_id.in_(chunk),
+                models.FPackConfigColumn.type.in_(["produit", "equipement"])
+            ).order_by(
+                models.FPackConfigColumn.fpack_id,
+                models.FPackConfigColumn.ordre
+            ).all()
+
+            for fpack_id, type_col, ref_id in rows:
+                self.config_columns[fpack_id].append((type_col, ref_id))
+
+    def _load_selections(self, ids: List[int]):
+        """Charge les sélections de groupes des instances"""
+        for i in ids:
+            self.selections[i] = []
+
+        for chunk in chunked(ids):
+            rows = self.db.query(
+                models.ProjetSelection.sous_projet_fpack_id,
+                models.ProjetSelection.type_item,
+                models.ProjetSelection.ref_id
+            ).filter(models.ProjetSelection.sous_projet_fpack_id.in_(chunk)).all()
+
+            for spf_id, type_item, ref_id in rows:
+                self.selections[spf_id].append((type_item, ref_id))
+
+    def _load_items(self, produit_ids: set, equipement_ids: set, robot_ids: set):
+        """Charge les noms des items"""
+        for chunk in chunked(produit_ids - set(self.produit_noms)):
+            for pid, nom in self.db.query(models.Produit.id, models.Produit.nom).filter(models.Produit.id.in_(chunk)).all():
+                self.produit_noms[pid] = nom
+
+        for chunk in chunked(robot_ids - set(self.robot_noms)):
+            rows = self.db.query(models.Robots.id, models.Robots.nom, models.Robots.reference)\
+                .filter(models.Robots.id.in_(chunk)).all()
+            for rid, nom, reference in rows:
+                self.robot_noms[rid] = f"{nom} ({reference})"
+
+        for chunk in chunked(equipement_ids - set(self.equipement_noms)):
+            for eid, nom in self.db.query(models.Equipements.id, models.Equipements.nom).filter(models.Equipements.id.in_(chunk)).all():
+                self.equipement_noms[eid] = nom
+
+    def _load_prices(self, client_ids: set, produit_ids: set, equipement_ids: set, robot_ids: set):
+        """Charge les prix clients des produits, les coûts matérialisés des équipements et les prix des robots"""
+        if client_ids:
+            for chunk in chunked(produit_ids):
+                rows = self.db.query(models.Prix).filter(
+                    models.Prix.client_id.in_(client_ids),
+                    models.Prix.produit_id.in_(chunk)
+                ).all()
+                for prix in rows:
+                    self.prix[(prix.client_id, prix.produit_id)] = prix
+
+            for chunk in chunked(equipement_ids):
+                rows = self.db.query(models.EquipementCost).filter(
+                    models.EquipementCost.client_id.in_(client_ids),
+                    models.EquipementCost.equipement_id.in_(chunk)
+                ).all()
+                for cout in rows:
+                    self.couts_equipement[(cout.equipement_id, cout.client_id)] = cout
+
+        for chunk in chunked(robot_ids - set(self.prix_robot)):
+            for prix in self.db.query(models.PrixRobot).filter(models.PrixRobot.id.in_(chunk)).all():
+                self.prix_robot[prix.id] = prix
+
+    # ========== CALCUL ==========
+
+    def prix_equipement(self, equipement_id: int, client_id: int) -> Dict[str, float]:
+        """Prix d'un équipement lu dans la table des coûts matérialisés"""
+        cout = self.couts_equipement.get((equipement_id, client_id))
+        return {
+            "prix_produit": float(cout.prix_produit) if cout else 0.0,
+            "prix_transport": float(cout.prix_transport) if cout else 0.0
+        }
+
+    def build_line(self, type_item: str, ref_id: int, client_id: int) -> Optional[Dict[str, Any]]:
+        """Construit une ligne de facture (qte = 1) ou None si l'item n'existe pas"""
+        if type_item == "produit":
+            if ref_id not in self.produit_noms:
+                return None
+            prix = self.prix.get((client_id, ref_id))
+            return {
+                "type": "produit",
+                "produit_id": ref_id,
+                "nom": self.produit_noms[ref_id],
+                "qte": 1,
+                "prix_unitaire": float(prix.prix_produit) if prix and prix.prix_produit else 0.0,
+                "prix_transport": float(prix.prix_transport) if prix and prix.prix_transport else 0.0,
+                "commentaire": prix.commentaire if prix else None,
+                "total_ligne": 0.0
+            }
+
+        if type_item == "robot":
+            if ref_id not in self.robot_noms:
+                return None
+            prix_robot = self.prix_robot.get(ref_id)
+            return {
+                "type": "robot",
+                "produit_id": ref_id,
+                "nom": self.robot_noms[ref_id],
+                "qte": 1,
+                "prix_unitaire": float(prix_robot.prix_robot) if prix_robot and prix_robot.prix_robot else 0.0,
+                "prix_transport": float(prix_robot.prix_transport) if prix_robot and prix_robot.prix_transport else 0.0,
+                "commentaire": prix_robot.commentaire if prix_robot else None,
+                "total_ligne": 0.0
+            }
+
+        if type_item == "equipement":
+            if ref_id not in self.equipement_noms:
+                return None
+            prix_calc = self.prix_equipement(ref_id, client_id)
+            return {
+                "type": "equipement",
+                "produit_id": ref_id,
+                "nom": self.equipement_noms[ref_id],
+                "qte": 1,
+                "prix_unitaire": prix_calc["prix_produit"],
+                "prix_transport": prix_calc["prix_transport"],
+                "commentaire": COMMENTAIRE_EQUIPEMENT,
+                "total_ligne": 0.0
+            }
+
+        return None
+
+    def item_counts(self, sous_projet_fpack_id: int) -> Dict[Tuple[str, int], int]:
+        """Quantités par item (colonnes fixes puis sélections), dans l'ordre d'apparition"""
+        instance = self.instances[sous_projet_fpack_id]
+        counts: Dict[Tuple[str, int], int] = defaultdict(int)
+        for key in self.config_columns.get(instance["fpack_id"], []) + self.selections.get(sous_projet_fpack_id, []):
+            counts[key] += 1
+        return counts
+
+    def build_lines(self, counts: Dict[Tuple[str, int], int], client_id: int) -> List[Dict[str, Any]]:
+        """Construit les lignes de facture groupées à partir des quantités par item"""
+        lines = []
+        for (type_item, ref_id), qte in counts.items():
+            line = self.build_line(type_item, ref_id, client_id)
+            if line is None:
+                continue
+            line["qte"] = qte
+            line["total_ligne"] = (line["prix_unitaire"] + line["prix_transport"]) * qte
+            lines.append(line)
+        return lines
+
+    @staticmethod
+    def summarize(lines: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Calcule les totaux et le résumé d'une liste de lignes"""
+        total_produit = 0
+        total_transport = 0
+        nb_produits = 0
+        nb_robots = 0
+        nb_equipements = 0
+
+        for item in lines:
+            total_produit += item["prix_unitaire"] * item["qte"]
+            total_transport += item["prix_transport"] * item["qte"]
+
+            if item["type"] == "produit":
+                nb_produits += item["qte"]
+            elif item["type"] == "robot":
+                nb_robots += item["qte"]
+            elif item["type"] == "equipement":
+                nb_equipements += item["qte"]
+
+        return {
+            "totaux": {
+                "produit": total_produit,
+                "transport": total_transport,
+                "global": total_produit + total_transport
+            },
+            "resume": {
+                "nb_lignes": len(lines),
+                "nb_produits": nb_produits,
+                "nb_robots": nb_robots,
+                "nb_equipements": nb_equipements
+            }
+        }
+
+    def facture_sous_projet_fpack(self, sous_projet_fpack_id: int) -> Dict[str, Any]:
+        """Facture d'une instance F-Pack, au même format que l'endpoint historique"""
+        self.load([sous_projet_fpack_id])
+
+        instance = self.instances.get(sous_projet_fpack_id)
+        if not instance:
+            raise HTTPException(status_code=404, detail="Sous-projet FPack non trouvé")
+
+        client = instance["client"]
+        if not client:
+            raise HTTPException(status_code=404, detail="Client non trouvé")
+
+        sous_projet_fpack = instance["sous_projet_fpack"]
+        sous_projet = instance["sous_projet"]
+        projet_global = instance["projet_global"]
+        fpack = instance["fpack"]
+
+        lines = self.build_lines(self.item_counts(sous_projet_fpack_id), client.id)
+
+        return {
+            "sous_projet_fpack_id": sous_projet_fpack_id,
+            "sous_projet_id": sous_projet_fpack.sous_projet_id,
+            "nom_sous_projet": sous_projet.nom if sous_projet else "Sous-projet inconnu",
+            "projet_global": {
+                "id": projet_global.id if projet_global else None,
+                "nom": projet_global.projet if projet_global else "Projet inconnu"
+            },
+            "client_id": client.id,
+            "client_nom": client.nom,
+            "fpack": {
+                "id": fpack.id if fpack else None,
+                "nom": fpack.nom if fpack else "FPack inconnu",
+                "abbr": fpack.fpack_abbr if fpack else "",
+                "FPack_number": sous_projet_fpack.FPack_number,
+                "Robot_Location_Code": sous_projet_fpack.Robot_Location_Code
+            },
+            "currency": "EUR",
+            "lines": lines,
+            **self.summarize(lines)
+        }
+
+    def facture_sous_projet(self, sous_projet_id: int) -> Dict[str, Any]:
+        """
+        Facture d'un sous-projet : toutes ses instances F-Pack, items identiques regroupés.
+        Les lignes suivent l'ordre d'apparition (instance par instance, colonnes puis sélections).
+        """
+        row = self.db.query(models.SousProjet, models.ProjetGlobal, models.Client)\
+            .outerjoin(models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global)\
+            .outerjoin(models.Client, models.Client.id == models.ProjetGlobal.client)\
+            .filter(models.SousProjet.id == sous_projet_id)\
+            .first()
+
+        if not row:
+            raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
+
+        sous_projet, projet_global, client = row
+        if not client:
+            raise HTTPException(status_code=404, detail="Client non trouvé")
+
+        ids = [spf_id for (spf_id,) in self.db.query(models.SousProjetFpack.id)
+               .filter(models.SousProjetFpack.sous_projet_id == sous_projet_id)
+               .order_by(models.SousProjetFpack.id)
+               .all()]
+        self.load(ids)
+
+        counts: Dict[Tuple[str, int], int] = defaultdict(int)
+        for spf_id in ids:
+            for key, qte in self.item_counts(spf_id).items():
+                counts[key] += qte
+
+        lines = self.build_lines(counts, client.id)
+
+        return {
+            "sous_projet_id": sous_projet_id,
+            "nom_sous_projet": sous_projet.nom,
+            "projet_global": {
+                "id": projet_global.id if projet_global else None,
+                "nom": projet_global.projet if projet_global else "Projet inconnu"
+            },
+            "client_id": client.id,
+            "client_nom": client.nom,
+            "currency": "EUR",
+            "lines": lines,
+            **self.summarize(lines)
+        }
+
+    # ========== AGRÉGATS SOUS-PROJETS ==========
+
+    def aggregate_sous_projets(self, condition) -> Dict[int, Dict[str, Any]]:
+        """
+        Quantités par item et par sous-projet, calculées en SQL (GROUP BY) :
+        une ligne par (template, sous-projet) et par item sélectionné distinct,
+        quel que soit le nombre d'instances F-Pack.
+        """
+        sous_projets = self.db.query(models.SousProjet.id, models.SousProjet.nom)\
+            .filter(condition)\
+            .order_by(models.SousProjet.id)\
+            .all()
+
+        result = {
+            sp_id: {"nom": nom, "nb_fpacks": 0, "counts": defaultdict(int)}
+            for sp_id, nom in sous_projets
+        }
+        if not result:
+            return result
+
+        templates = self.db.query(
+            models.SousProjetFpack.sous_projet_id,
+            models.SousProjetFpack.fpack_id,
+            func.count(models.SousProjetFpack.id)
+        ).join(
+            models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+        ).filter(condition).group_by(
+            models.SousProjetFpack.sous_projet_id,
+            models.SousProjetFpack.fpack_id
+        ).all()
+
+        selections = self.db.query(
+            models.SousProjetFpack.sous_projet_id,
+            models.ProjetSelection.type_item,
+            models.ProjetSelection.ref_id,
+            func.count()
+        ).join(
+            models.SousProjetFpack, models.SousProjetFpack.id == models.ProjetSelection.sous_projet_fpack_id
+        ).join(
+            models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+        ).filter(condition).group_by(
+            models.SousProjetFpack.sous_projet_id,
+            models.ProjetSelection.type_item,
+            models.ProjetSelection.ref_id
+        ).all()
+
+        self._load_config_columns({fpack_id for _, fpack_id, _ in templates} - set(self.config_columns))
+
+        for sp_id, fpack_id, nb_instances in templates:
+            result[sp_id]["nb_fpacks"] += nb_instances
+            for key in self.config_columns.get(fpack_id, []):
+                result[sp_id]["counts"][key] += nb_instances
+
+        for sp_id, type_item, ref_id, nb in selections:
+            result[sp_id]["counts"][(type_item, ref_id)] += nb
+
+        return result
+
+    def facture_projet_global(self, projet_global_id: int) -> Dict[str, Any]:
+        """
+        Facture consolidée d'un projet global : sous-totaux par sous-projet et total général.
+        Chaque item distinct n'est tarifé qu'une fois pour le client du projet.
+        """
+        row = self.db.query(models.ProjetGlobal, models.Client)\
+            .outerjoin(models.Client, models.Client.id == models.ProjetGlobal.client)\
+            .filter(models.ProjetGlobal.id == projet_global_id)\
+            .first()
+
+        if not row:
+            raise HTTPException(status_code=404, detail="Projet global non trouvé")
+
+        projet_global, client = row
+        if not client:
+            raise HTTPException(status_code=404, detail="Client non trouvé")
+
+        aggregats = self.aggregate_sous_projets(models.SousProjet.id_global == projet_global_id)
+
+        counts_global: Dict[Tuple[str, int], int] = defaultdict(int)
+        for aggregat in aggregats.values():
+            for key, qte in aggregat["counts"].items():
+                counts_global[key] += qte
+
+        self.load_catalogue(counts_global.keys(), [client.id])
+
+        sous_projets = []
+        for sp_id, aggregat in aggregats.items():
+            lines = self.build_lines(aggregat["counts"], client.id)
+            sous_projets.append({
+                "sous_projet_id": sp_id,
+                "nom_sous_projet": aggregat["nom"],
+                "nb_fpacks": aggregat["nb_fpacks"],
+                "lines": lines,
+                **self.summarize(lines)
+            })
+
+        lines = self.build_lines(counts_global, client.id)
+
+        return {
+            "projet_global": {
+                "id": projet_global.id,
+                "nom": projet_global.projet
+            },
+            "client_id": client.id,
+            "client_nom": client.nom,
+            "currency": "EUR",
+            "sous_projets": sous_projets,
+            "lines": lines,
+            **self.summarize(lines)
+        }
+
+    # ========== COMPARAISON MULTI-CLIENTS ==========
+
+    def quote_comparison(self, sous_projet_id: int, client_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """
+        Coût d'un sous-projet selon la grille tarifaire de chaque client.
+        Les prix sont chargés une fois en matrices items x clients, les totaux
+        sont le produit du vecteur des quantités par ces matrices.
+        """
+        row = self.db.query(models.SousProjet, models.ProjetGlobal)\
+            .outerjoin(models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global)\
+            .filter(models.SousProjet.id == sous_projet_id)\
+            .first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
+        sous_projet, projet_global = row
+
+        clients_query = self.db.query(models.Client.id, models.Client.nom)
+        if client_ids is not None:
+            clients_query = clients_query.filter(models.Client.id.in_(list(client_ids)))
+        clients = clients_query.order_by(models.Client.id).all()
+
+        aggregat = self.aggregate_sous_projets(models.SousProjet.id == sous_projet_id)[sous_projet_id]
+        produit_ids, equipement_ids, robot_ids = set(), set(), set()
+        for type_item, ref_id in aggregat["counts"]:
+            if type_item == "produit":
+                produit_ids.add(ref_id)
+            elif type_item == "equipement":
+                equipement_ids.add(ref_id)
+            elif type_item == "robot":
+                robot_ids.add(ref_id)
+        self._load_items(produit_ids, equipement_ids, robot_ids)
+
+        # Items existants uniquement, comme dans les factures
+        items = [
+            key for key in aggregat["counts"]
+            if (key[0] == "produit" and key[1] in self.produit_noms)
+            or (key[0] == "equipement" and key[1] in self.equipement_noms)
+            or (key[0] == "robot" and key[1] in self.robot_noms)
+        ]
+        item_index = {key: i for i, key in enumerate(items)}
+        client_index = {client_id: j for j, (client_id, _) in enumerate(clients)}
+
+        quantites = np.array([aggregat["counts"][key] for key in items], dtype=np.float64)
+        prix_produit = np.zeros((len(items), len(clients)), dtype=np.float64)
+        prix_transport = np.zeros((len(items), len(clients)), dtype=np.float64)
+
+        def remplir(type_item: str, rows: List[Tuple[int, int, Any, Any]]):
+            cellules = [
+                (item_index[(type_item, ref_id)], client_index[client_id], produit, transport)
+                for ref_id, client_id, produit, transport in rows
+                if (type_item, ref_id) in item_index and client_id in client_index
+            ]
+            if not cellules:
+                return
+            lignes, colonnes, produits, transports = zip(*cellules)
+            lignes, colonnes = np.array(lignes), np.array(colonnes)
+            prix_produit[lignes, colonnes] = np.array([float(p or 0) for p in produits])
+            prix_transport[lignes, colonnes] = np.array([float(t or 0) for t in transports])
+
+        if clients:
+            for chunk in chunked(produit_ids & set(self.produit_noms)):
+                remplir("produit", self.db.query(
+                    models.Prix.produit_id, models.Prix.client_id, models.Prix.prix_produit, models.Prix.prix_transport
+                ).filter(models.Prix.produit_id.in_(chunk), models.Prix.client_id.in_(list(client_index))).all())
+
+            for chunk in chunked(equipement_ids & set(self.equipement_noms)):
+                remplir("equipement", self.db.query(
+                    models.EquipementCost.equipement_id, models.EquipementCost.client_id,
+                    models.EquipementCost.prix_produit, models.EquipementCost.prix_transport
+                ).filter(models.EquipementCost.equipement_id.in_(chunk), models.EquipementCost.client_id.in_(list(client_index))).all())
+
+            # Le prix d'un robot ne dépend pas du client : même ligne pour toutes les colonnes
+            for chunk in chunked(robot_ids & set(self.robot_noms)):
+                for rid, prix_robot, transport in self.db.query(
+                    models.PrixRobot.id, models.PrixRobot.prix_robot, models.PrixRobot.prix_transport
+                ).filter(models.PrixRobot.id.in_(chunk)).all():
+                    i = item_index[("robot", rid)]
+                    prix_produit[i, :] = float(prix_robot or 0)
+                    prix_transport[i, :] = float(transport or 0)
+
+        totaux_produit = quantites @ prix_produit
+        totaux_transport = quantites @ prix_transport
+        # Sans prix comme dans les factures : prix unitaire absent, NULL ou nul
+        nb_sans_prix = (prix_produit == 0).sum(axis=0)
+
+        client_projet = projet_global.client if projet_global else None
+        return {
+            "sous_projet_id": sous_projet_id,
+            "nom_sous_projet": sous_projet.nom,
+            "client_projet_id": client_projet,
+            "currency": "EUR",
+            "nb_fpacks": aggregat["nb_fpacks"],
+            "nb_items": len(items),
+            "clients": [
+                {
+                    "client_id": client_id,
+                    "client_nom": client_nom,
+                    "est_client_projet": client_id == client_projet,
+                    "totaux": {
+                        "produit": float(totaux_produit[j]),
+                        "transport": float(totaux_transport[j]),
+                        "global": float(totaux_produit[j] + totaux_transport[j])
+                    },
+                    "items_sans_prix": int(nb_sans_prix[j])
+                }
+                for j, (client_id, client_nom) in enumerate(clients)
+            ]
+        }
@@ -0,0 +1,323 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import event, exists, func, insert, or_, select, union, update, delete, bindparam # type: ignore
+from sqlalchemy.exc import IntegrityError # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+from config import ROLLUP_REFRESH_INTERVAL
+from App.pricing import PricingEngine, chunked
+from App.write_tracking import ALL, on_commit
+
+# Totaux matérialisés des instances F-Pack, sous-projets et projets globaux (tableaux de bord).
+#
+# - Invalidation : toute écriture qui peut changer un total (sélections, colonnes de
+#   configuration, prix produits/robots, nomenclatures, rattachement d'une instance,
+#   d'un sous-projet ou client d'un projet) est repérée par App.write_tracking, puis les
+#   lignes concernées sont marquées stale dans la même transaction, au commit.
+# - Rafraîchissement : refresh_rollups recalcule en lot (PricingEngine) les instances stale
+#   ou sans ligne, supprime les orphelines et recalcule les sous-projets et projets
+#   globaux touchés par agrégation SQL. Une instance invalidée pendant le recalcul reste
+#   stale (contrôle de version à l'écriture).
+# - Le rafraîchissement tourne en tâche de fond (start_rollup_refresher), réveillée par les
+#   commits qui invalident des totaux et au plus tard toutes les ROLLUP_REFRESH_INTERVAL
+#   secondes : les lectures des tableaux de bord n'écrivent jamais en base.
+
+logger = logging.getLogger(__name__)
+
+STALE_KEY = "rollups_stale"
+
+def _instances_using(type_item: str, ref_ids) -> list:
+    """Requêtes des instances dont un item (colonne fixe du template ou sélection) est dans ref_ids"""
+    colonnes = select(models.SousProjetFpack.id).join(
+        models.FPackConfigColumn, models.FPackConfigColumn.fpack_id == models.SousProjetFpack.fpack_id
+    ).where(
+        models.FPackConfigColumn.type == type_item,
+        models.FPackConfigColumn.ref_id.in_(ref_ids)
+    )
+    selections = select(models.ProjetSelection.sous_projet_fpack_id).where(
+        models.ProjetSelection.type_item == type_item,
+        models.ProjetSelection.ref_id.in_(ref_ids)
+    )
+    return [colonnes, selections]
+
+
+def _instances_for_scope(scope: str, chunk: List[Any]):
+    if scope == "sous_projet_fpack":
+        return chunk
+    if scope == "fpack":
+        return select(models.SousProjetFpack.id).where(models.SousProjetFpack.fpack_id.in_(chunk))
+    if scope == "produit":
+        # Un produit compte aussi à travers les équipements qui le contiennent
+        equipements = select(models.Equipement_Produit.equipement_id).where(models.Equipement_Produit.produit_id.in_(chunk))
+        return union(*_instances_using("produit", chunk), *_instances_using("equipement", equipements))
+    if scope in ("equipement", "robot"):
+        return union(*_instances_using(scope, chunk))
+    if scope == "sous_projet":
+        return select(models.SousProjetFpack.id).where(models.SousProjetFpack.sous_projet_id.in_(chunk))
+    if scope == "projet_global":
+        return select(models.SousProjetFpack.id).join(
+            models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+        ).where(models.SousProjet.id_global.in_(chunk))
+    raise ValueError(f"Portée inconnue : {scope}")
+
+
+@on_commit
+def _mark_stale(db: Session, pending: Dict[str, Set[Any]]):
+    """Marque stale (et incrémente la version) les totaux d'instances touchés, en requêtes ensemblistes"""
+    table = models.RollupSousProjetFpack.__table__
+    stale = update(table).values(stale=True, version=table.c.version + 1)
+    db.info[STALE_KEY] = True
+    if pending.get(ALL):
+        db.execute(stale)
+        return
+    for scope, ids in pending.items():
+        for chunk in chunked(ids):
+            db.execute(stale.where(table.c.sous_projet_fpack_id.in_(_instances_for_scope(scope, chunk))))
+
+
+# ========== RAFRAÎCHISSEMENT ==========
+
+def _instance_rollup(engine: PricingEngine, sous_projet_fpack_id: int) -> Dict[str, Any]:
+    instance = engine.instances[sous_projet_fpack_id]
+    client = instance["client"]
+    lines = engine.build_lines(engine.item_counts(sous_projet_fpack_id), client.id) if client else []
+    totaux = PricingEngine.summarize(lines)["totaux"]
+    projet_global = instance["projet_global"]
+    return {
+        "sous_projet_fpack_id": sous_projet_fpack_id,
+        "sous_projet_id": instance["sous_projet_fpack"].sous_projet_id,
+        "projet_global_id": projet_global.id if projet_global else None,
+        "total_produit": totaux["produit"],
+        "total_transport": totaux["transport"],
+        "total_global": totaux["global"],
+        "nb_lignes": len(lines),
+        "nb_lignes_sans_prix": sum(1 for line in lines if line["prix_unitaire"] == 0)
+    }
+
+
+def _refresh_instances(db: Session, ids: List[int], now: datetime) -> Tuple[Set[int], Set[int]]:
+    """Recalcule les totaux d'instances ; renvoie les sous-projets et projets globaux touchés"""
+    rollup = models.RollupSousProjetFpack
+    table = rollup.__table__
+    sous_projets, projets = set(), set()
+
+    for chunk in chunked(ids):
+        existing = {
+            spf_id: (version, sous_projet_id, projet_global_id)
+            for spf_id, version, sous_projet_id, projet_global_id in db.query(
+                rollup.sous_projet_fpack_id, rollup.version, rollup.sous_projet_id, rollup.projet_global_id
+            ).filter(rollup.sous_projet_fpack_id.in_(chunk)).all()
+        }
+        engine = PricingEngine(db).load(chunk)
+
+        updates, inserts = [], []
+        for spf_id in chunk:
+            if spf_id not in engine.instances:
+                continue
+            row = _instance_rollup(engine, spf_id)
+            row["updated_at"] = now
+            sous_projets.add(row["sous_projet_id"])
+            projets.add(row["projet_global_id"])
+            if spf_id in existing:
+                version, ancien_sous_projet, ancien_projet = existing[spf_id]
+                sous_projets.add(ancien_sous_projet)
+                projets.add(ancien_projet)
+                updates.append({**row, "b_id": spf_id, "b_version": version})
+            else:
+                inserts.append({**row, "stale": False, "version": 0})
+
+        if updates:
+            # Ligne invalidée entre la lecture et l'écriture : version différente, elle reste stale
+            db.execute(
+                update(table)
+                .where(table.c.sous_projet_fpack_id == bindparam("b_id"), table.c.version == bindparam("b_version"))
+                .values(
+                    sous_projet_id=bindparam("sous_projet_id"),
+                    projet_global_id=bindparam("projet_global_id"),
+                    total_produit=bindparam("total_produit"),
+                    total_transport=bindparam("total_transport"),
+                    total_global=bindparam("total_global"),
+                    nb_lignes=bindparam("nb_lignes"),
+                    nb_lignes_sans_prix=bindparam("nb_lignes_sans_prix"),
+                    updated_at=bindparam("updated_at"),
+                    stale=False
+                ),
+                updates
+            )
+        if inserts:
+            db.execute(insert(table), inserts)
+
+    return sous_projets - {None}, projets - {None}
+
+
+def _refresh_sous_projets(db: Session, ids: Iterable[int], now: datetime):
+    table = models.RollupSousProjet.__table__
+    rollup = models.RollupSousProjetFpack
+    for chunk in chunked(ids):
+        db.execute(delete(table).where(table.c.sous_projet_id.in_(chunk)))
+        db.execute(insert(table).from_select(
+            ["sous_projet_id", "projet_global_id", "nb_fpacks", "total_produit", "total_transport",
+             "total_global", "nb_lignes_sans_prix", "updated_at"],
+            select(
+                models.SousProjet.id,
+                models.SousProjet.id_global,
+                func.count(rollup.sous_projet_fpack_id),
+                func.sum(rollup.total_produit),
+                func.sum(rollup.total_transport),
+                func.sum(rollup.total_global),
+                func.sum(rollup.nb_lignes_sans_prix),
+                bindparam("now", now)
+            ).join(
+                rollup, rollup.sous_projet_id == models.SousProjet.id
+            ).where(
+                models.SousProjet.id.in_(chunk)
+            ).group_by(models.SousProjet.id, models.SousProjet.id_global)
+        ))
+
+
+def _refresh_projets(db: Session, ids: Iterable[int], now: datetime):
+    table = models.RollupProjetGlobal.__table__
+    rollup = models.RollupSousProjet
+    for chunk in chunked(ids):
+        db.execute(delete(table).where(table.c.projet_global_id.in_(chunk)))
+        db.execute(insert(table).from_select(
+            ["projet_global_id", "client_id", "nb_sous_projets", "nb_fpacks", "total_produit",
+             "total_transport", "total_global", "nb_lignes_sans_prix", "updated_at"],
+            select(
+                models.ProjetGlobal.id,
+                models.ProjetGlobal.client,
+                func.count(rollup.sous_projet_id),
+                func.sum(rollup.nb_fpacks),
+                func.sum(rollup.total_produit),
+                func.sum(rollup.total_transport),
+                func.sum(rollup.total_global),
+                func.sum(rollup.nb_lignes_sans_prix),
+                bindparam("now", now)
+            ).join(
+                rollup, rollup.projet_global_id == models.ProjetGlobal.id
+            ).where(
+                models.ProjetGlobal.id.in_(chunk)
+            ).group_by(models.ProjetGlobal.id, models.ProjetGlobal.client)
+        ))
+
+
+def refresh_rollups(db: Session) -> Dict[str, int]:
+    """
+    Met à jour les totaux matérialisés (sans commit) : instances stale ou absentes,
+    lignes orphelines, puis sous-projets et projets globaux concernés.
+    Sans invalidation en attente, coûte deux requêtes.
+    """
+    now = datetime.now()
+    rollup = models.RollupSousProjetFpack
+
+    orphelins = db.query(rollup.sous_projet_fpack_id, rollup.sous_projet_id, rollup.projet_global_id).filter(
+        ~exists().where(models.SousProjetFpack.id == rollup.sous_projet_fpack_id)
+    ).all()
+
+    a_recalculer = [spf_id for (spf_id,) in db.query(models.SousProjetFpack.id).outerjoin(
+        rollup, rollup.sous_projet_fpack_id == models.SousProjetFpack.id
+    ).filter(
+        or_(rollup.sous_projet_fpack_id.is_(None), rollup.stale.is_(True))
+    ).order_by(models.SousProjetFpack.id).all()]
+
+    if not orphelins and not a_recalculer:
+        return {"instances": 0, "orphelins": 0, "sous_projets": 0, "projets_globaux": 0}
+
+    sous_projets = {sous_projet_id for _, sous_projet_id, _ in orphelins}
+    projets = {projet_global_id for _, _, projet_global_id in orphelins}
+    for chunk in chunked([spf_id for spf_id, _, _ in orphelins]):
+        db.execute(delete(rollup.__table__).where(rollup.__table__.c.sous_projet_fpack_id.in_(chunk)))
+
+    touches_sous_projets, touches_projets = _refresh_instances(db, a_recalculer, now)
+    sous_projets = (sous_projets | touches_sous_projets) - {None}
+    projets = (projets | touches_projets) - {None}
+
+    # Sous-projet déplacé ou supprimé : l'ancien projet global est aussi recalculé
+    for chunk in chunked(sous_projets):
+        projets.update(
+            projet_global_id for (projet_global_id,) in db.query(models.RollupSousProjet.projet_global_id)
+            .filter(models.RollupSousProjet.sous_projet_id.in_(chunk)).all()
+            if projet_global_id is not None
+        )
+
+    _refresh_sous_projets(db, sous_projets, now)
+    _refresh_projets(db, projets, now)
+
+    return {
+        "instances": len(a_recalculer),
+        "orphelins": len(orphelins),
+        "sous_projets": len(sous_projets),
+        "projets_globaux": len(projets)
+    }
+
+
+def rebuild_rollups(db: Session) -> Dict[str, int]:
+    """Reconstruction complète des trois tables (sans commit)"""
+    for model in (models.RollupSousProjetFpack, models.RollupSousProjet, models.RollupProjetGlobal):
+        db.execute(delete(model.__table__))
+    return refresh_rollups(db)
+
+
+# ========== TÂCHE DE FOND ==========
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_refresher(session):
+    if session.info.pop(STALE_KEY, False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _clear_on_rollback(session, previous_transaction):
+    session.info.pop(STALE_KEY, None)
+
+
+def refresh_pending_rollups(session_factory: Callable[[], Session]) -> Optional[Dict[str, int]]:
+    """
+    Un passage de rafraîchissement dans sa propre transaction. Un conflit avec le
+    rafraîchissement d'un autre processus (même ligne insérée deux fois) annule le passage :
+    les lignes restent stale et sont reprises au passage suivant.
+    """
+    with session_factory() as db:
+        try:
+            resultat = refresh_rollups(db)
+            db.commit()
+            return resultat
+        except IntegrityError:
+            db.rollback()
+            return None
+
+
+def _refresh_loop(session_factory: Callable[[], Session], interval: float):
+    while not _stop.is_set():
+        try:
+            refresh_pending_rollups(session_factory)
+        except Exception:
+            logger.exception("Échec du rafraîchissement des totaux matérialisés")
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def start_rollup_refresher(session_factory: Callable[[], Session], interval: float = ROLLUP_REFRESH_INTERVAL):
+    """Démarre le rafraîchissement des totaux en tâche de fond (démarrage de l'application)"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_refresh_loop, args=(session_factory, interval), name="rollups-refresh", daemon=True)
+    _thread.start()
+
+
+def stop_rollup_refresher():
+    global _thread
+    _stop.set()
+    _wakeup.set()
+    if _thread is not None:
+        _thread.join(timeout=10)
+        _thread = None
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException #type: ignore
 from sqlalchemy.orm import Session #type: ignore
 from App.database import SessionLocal
 from App import models, schemas
+from App.pricing import refresh_equipement_costs
 from sqlalchemy.orm import selectinload #type: ignore
 
 
@@ -90,6 +91,7 @@ def create_or_update_equipement_produit(equipement_produit: schemas.EquipementPr
     else:
         ep = models.Equipement_Produit(**equipement_produit.dict())
     db.add(ep)
+    refresh_equipement_costs(db, [equipement_produit.equipement_id])
 
     db.commit()
     db.refresh(ep)
@@ -101,16 +103,22 @@ def delete_equipement_produit(id: int, db: Session = Depends(get_db)):
     db_equipement_produit = db.query(models.Equipement_Produit).get(id)
     if not db_equipement_produit:
         raise HTTPException(status_code=404, detail="Equipement de produit non trouvé")
+    equipement_id = db_equipement_produit.equipement_id
     db.delete(db_equipement_produit)
+    refresh_equipement_costs(db, [equipement_id])
     db.commit()
     return {"ok": True}
 
 @router.delete("/equipementproduit/clear/{equipement_id}")
 def clear_equipement_produits(equipement_id: int, db: Session = Depends(get_db)):
     db.query(models.Equipement_Produit).filter(models.Equipement_Produit.equipement_id == equipement_id).delete()
+    refresh_equipement_costs(db, [equipement_id])
     db.commit()
     return {"ok": True}
 
-
-
-
+@router.post("/equipement_costs/rebuild")
+def rebuild_equipement_costs(db: Session = Depends(get_db)):
+    """Reconstruit entièrement la table des coûts d'équipements par client"""
+    refresh_equipement_costs(db)
+    db.commit()
+    return {"ok": True, "rows": db.query(models.EquipementCost).count()}
@@ -1,25 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException # type: ignore
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query # type: ignore
 from fastapi.responses import StreamingResponse# type: ignore
+from starlette.background import BackgroundTask # type: ignore
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool # type: ignore
 from sqlalchemy.orm import Session # type: ignore
-from typing import Dict, Any, List
+from typing import Dict, List, Optional
 import io
-from datetime import datetime
-
-# Imports pour PDF
-from reportlab.lib import colors # type: ignore
-from reportlab.lib.pagesizes import A4 # type: ignore
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer # type: ignore
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle # type: ignore
-from reportlab.lib.units import cm # type: ignore
-from reportlab.lib.enums import TA_CENTER # type: ignore
-
-# Imports pour Excel
-import openpyxl # type: ignore
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side # type: ignore
-from openpyxl.utils import get_column_letter # type: ignore
+import os
+from config import INVOICE_SPOOL_THRESHOLD, INVOICE_SPOOL_DIR
 
 from App.database import SessionLocal
-from App import models
+from App import models, schemas
+from App.pricing import PricingEngine
+from App.invoice_render import render_pdf_spooled, render_excel_spooled, render_excel_workbook_spooled, iter_spool_file, remove_spool_file, ZipStream, zip_entry_name
+from App.workers import RenderSlot, render_in_pool, render_many_in_pool
+from App.invoice_cache import get_cached_facture, document_etag, get_cached_document, put_cached_document, etag_matches
 
 router = APIRouter()
 
@@ -30,345 +24,13 @@ def get_db():
     finally:
         db.close()
 
-def get_item_label(item_type: str, ref_id: int, db: Session) -> str:
-    """Utilitaire pour récupérer le label d'un item selon son type"""
-    if item_type == "produit":
-        produit = db.query(models.Produit).filter_by(id=ref_id).first()
-        return produit.nom if produit else f"(produit {ref_id})"
-    elif item_type == "equipement":
-        eq = db.query(models.Equipements).filter_by(id=ref_id).first()
-        return eq.nom if eq else f"(équipement {ref_id})"
-    elif item_type == "robot":
-        robot = db.query(models.Robots).filter_by(id=ref_id).first()
-        return f"{robot.nom} ({robot.reference})" if robot else f"(robot {ref_id})"
-    return f"{item_type} {ref_id}"
-
-def get_fpack_config(fpack_id: int, db: Session) -> List[Dict]:
-    """Récupère la configuration des colonnes d'un FPack"""
-    columns = db.query(models.FPackConfigColumn)\
-        .filter_by(fpack_id=fpack_id)\
-        .order_by(models.FPackConfigColumn.ordre)\
-        .all()
-    
-    result = []
-    for col in columns:
-        entry = {
-            "id": col.id,
-            "fpack_id": col.fpack_id,
-            "type": col.type,
-            "ref_id": col.ref_id,
-            "ordre": col.ordre
-        }
-        
-        if col.type == "produit":
-            produit = db.query(models.Produit).filter_by(id=col.ref_id).first()
-            entry["display_name"] = produit.nom if produit else f"(produit {col.ref_id})"
-        
-        elif col.type == "equipement":
-            eq = db.query(models.Equipements).filter_by(id=col.ref_id).first()
-            entry["display_name"] = eq.nom if eq else f"(équipement {col.ref_id})"
-        
-        elif col.type == "group":
-            groupe = db.query(models.Groupes).filter_by(id=col.ref_id).first()
-            entry["display_name"] = groupe.nom if groupe else f"(groupe {col.ref_id})"
-            
-            if col.ref_id:
-                items = db.query(models.GroupeItem).filter_by(group_id=col.ref_id).all()
-                entry["group_items"] = [
-                    {
-                        "id": item.id,
-                        "group_id": item.group_id,
-                        "type": item.type,
-                        "ref_id": item.ref_id,
-                        "label": get_item_label(item.type, item.ref_id, db),
-                        "statut": item.statut
-                    }
-                    for item in items
-                ]
-            else:
-                entry["group_items"] = []
-        else:
-            entry["display_name"] = f"{col.type} {col.ref_id}"
-        
-        result.append(entry)
-    
-    return result
-
-def calculate_equipement_price(equipement_id: int, client_id: int, db: Session) -> Dict[str, float]:
-    """Calcule le prix d'un équipement basé sur ses produits composants"""
-    equipement_produits = db.query(models.Equipement_Produit)\
-        .filter_by(equipement_id=equipement_id)\
-        .all()
-    
-    total_prix_produit = 0.0
-    total_prix_transport = 0.0
-    
-    for ep in equipement_produits:
-        prix = db.query(models.Prix).filter(
-            models.Prix.produit_id == ep.produit_id,
-            models.Prix.client_id == client_id
-        ).first()
-        
-        if prix:
-            prix_unitaire = float(prix.prix_produit) if prix.prix_produit else 0.0
-            prix_transport = float(prix.prix_transport) if prix.prix_transport else 0.0
-            
-            quantite = ep.quantite if ep.quantite else 1
-            total_prix_produit += prix_unitaire * quantite
-            total_prix_transport += prix_transport * quantite
-    
-    return {
-        "prix_produit": total_prix_produit,
-        "prix_transport": total_prix_transport
-    }
-
 def get_sous_projet_fpack_facture(sous_projet_fpack_id: int, db: Session):
     """
     Récupère les données de facture pour un sous_projet_fpack donné
     incluant produits seuls, équipements seuls et sélections dans les groupes
     Les items identiques sont regroupés avec quantité cumulée
     """
-    sous_projet_fpack = db.query(models.SousProjetFpack).filter(
-        models.SousProjetFpack.id == sous_projet_fpack_id
-    ).first()
-    
-    if not sous_projet_fpack:
-        raise HTTPException(status_code=404, detail="Sous-projet FPack non trouvé")
-    
-    sous_projet = db.query(models.SousProjet).filter(
-        models.SousProjet.id == sous_projet_fpack.sous_projet_id
-    ).first()
-    
-
-    projet_global = None
-    if sous_projet:
-        projet_global = db.query(models.ProjetGlobal).filter(
-            models.ProjetGlobal.id == sous_projet.id_global
-        ).first()
-    
-    client = None
-    if projet_global:
-        client = db.query(models.Client).filter(
-            models.Client.id == projet_global.client
-        ).first()
-    
-    if not client:
-        raise HTTPException(status_code=404, detail="Client non trouvé")
-    
-    fpack = db.query(models.FPack).filter(
-        models.FPack.id == sous_projet_fpack.fpack_id
-    ).first()
-    
-    fpack_config = get_fpack_config(sous_projet_fpack.fpack_id, db)
-    
-    items_grouped = {}
-    
-    total_produit = 0
-    total_transport = 0
-    
-    for config_item in fpack_config:
-        if config_item["type"] == "produit":
-            produit = db.query(models.Produit).filter(
-                models.Produit.id == config_item["ref_id"]
-            ).first()
-            
-            if produit:
-                key = ("produit", produit.id)
-                
-                prix = db.query(models.Prix).filter(
-                    models.Prix.produit_id == produit.id,
-                    models.Prix.client_id == client.id
-                ).first()
-                
-                prix_unitaire = float(prix.prix_produit) if prix and prix.prix_produit else 0.0
-                prix_transport = float(prix.prix_transport) if prix and prix.prix_transport else 0.0
-                commentaire = prix.commentaire if prix else None
-                
-                if key in items_grouped:
-                    items_grouped[key]["qte"] += 1
-                else:
-                    items_grouped[key] = {
-                        "type": "produit",
-                        "produit_id": produit.id,
-                        "nom": produit.nom,
-                        "qte": 1,
-                        "prix_unitaire": prix_unitaire,
-                        "prix_transport": prix_transport,
-                        "commentaire": commentaire,
-                        "total_ligne": 0.0  
-                    }
-        
-        elif config_item["type"] == "equipement":
-            equipement = db.query(models.Equipements).filter(
-                models.Equipements.id == config_item["ref_id"]
-            ).first()
-            
-            if equipement:
-                key = ("equipement", equipement.id)
-                
-                prix_calc = calculate_equipement_price(equipement.id, client.id, db)
-                
-                prix_unitaire = prix_calc["prix_produit"]
-                prix_transport = prix_calc["prix_transport"]
-                
-                if key in items_grouped:
-                    items_grouped[key]["qte"] += 1
-                else:
-                    items_grouped[key] = {
-                        "type": "equipement",
-                        "produit_id": equipement.id,
-                        "nom": equipement.nom,
-                        "qte": 1,
-                        "prix_unitaire": prix_unitaire,
-                        "prix_transport": prix_transport,
-                        "commentaire": "Somme des prix des produits internes",
-                        "total_ligne": 0.0  # Sera calculé à la fin
-                    }
-    
-    selections = db.query(models.ProjetSelection).filter(
-        models.ProjetSelection.sous_projet_fpack_id == sous_projet_fpack_id
-    ).all()
-    
-    for selection in selections:
-        if selection.type_item == 'produit':
-            produit = db.query(models.Produit).filter(
-                models.Produit.id == selection.ref_id
-            ).first()
-            
-            if produit:
-                key = ("produit", produit.id)
-                
-                prix = db.query(models.Prix).filter(
-                    models.Prix.produit_id == produit.id,
-                    models.Prix.client_id == client.id
-                ).first()
-                
-                prix_unitaire = float(prix.prix_produit) if prix and prix.prix_produit else 0.0
-                prix_transport = float(prix.prix_transport) if prix and prix.prix_transport else 0.0
-                commentaire = prix.commentaire if prix else None
-                
-                if key in items_grouped:
-                    items_grouped[key]["qte"] += 1
-                else:
-                    items_grouped[key] = {
-                        "type": "produit",
-                        "produit_id": produit.id,
-                        "nom": produit.nom,
-                        "qte": 1,
-                        "prix_unitaire": prix_unitaire,
-                        "prix_transport": prix_transport,
-                        "commentaire": commentaire,
-                        "total_ligne": 0.0  
-                    }
-        
-        elif selection.type_item == 'robot':
-            robot = db.query(models.Robots).filter(
-                models.Robots.id == selection.ref_id
-            ).first()
-            
-            if robot:
-                key = ("robot", robot.id)
-                
-                prix_robot = db.query(models.PrixRobot).filter(
-                    models.PrixRobot.id == robot.id
-                ).first()
-                
-                prix_unitaire = float(prix_robot.prix_robot) if prix_robot and prix_robot.prix_robot else 0.0
-                prix_transport = float(prix_robot.prix_transport) if prix_robot and prix_robot.prix_transport else 0.0
-                commentaire = prix_robot.commentaire if prix_robot else None
-                
-                if key in items_grouped:
-                    items_grouped[key]["qte"] += 1
-                else:
-                    items_grouped[key] = {
-                        "type": "robot",
-                        "produit_id": robot.id,
-                        "nom": f"{robot.nom} ({robot.reference})",
-                        "qte": 1,
-                        "prix_unitaire": prix_unitaire,
-                        "prix_transport": prix_transport,
-                        "commentaire": commentaire,
-                        "total_ligne": 0.0  
-                    }
-        
-        elif selection.type_item == 'equipement':
-            equipement = db.query(models.Equipements).filter(
-                models.Equipements.id == selection.ref_id
-            ).first()
-            
-            if equipement:
-                key = ("equipement", equipement.id)
-                
-                prix_calc = calculate_equipement_price(equipement.id, client.id, db)
-                
-                prix_unitaire = prix_calc["prix_produit"]
-                prix_transport = prix_calc["prix_transport"]
-                
-                if key in items_grouped:
-                    items_grouped[key]["qte"] += 1
-                else:
-                    items_grouped[key] = {
-                        "type": "equipement",
-                        "produit_id": equipement.id,
-                        "nom": equipement.nom,
-                        "qte": 1,
-                        "prix_unitaire": prix_unitaire,
-                        "prix_transport": prix_transport,
-                        "commentaire": "Somme des prix des produits internes",
-                        "total_ligne": 0.0  # Sera calculé à la fin
-                    }
-    
-    lines = []
-    nb_produits = 0
-    nb_robots = 0
-    nb_equipements = 0
-    
-    for item in items_grouped.values():
-        item["total_ligne"] = (item["prix_unitaire"] + item["prix_transport"]) * item["qte"]
-        lines.append(item)
-        
-        total_produit += item["prix_unitaire"] * item["qte"]
-        total_transport += item["prix_transport"] * item["qte"]
-        
-        if item["type"] == "produit":
-            nb_produits += item["qte"]
-        elif item["type"] == "robot":
-            nb_robots += item["qte"]
-        elif item["type"] == "equipement":
-            nb_equipements += item["qte"]
-    
-    return {
-        "sous_projet_fpack_id": sous_projet_fpack_id,
-        "sous_projet_id": sous_projet_fpack.sous_projet_id,
-        "nom_sous_projet": sous_projet.nom if sous_projet else "Sous-projet inconnu",
-        "projet_global": {
-            "id": projet_global.id if projet_global else None,
-            "nom": projet_global.projet if projet_global else "Projet inconnu"
-        },
-        "client_id": client.id,
-        "client_nom": client.nom,
-        "fpack": {
-            "id": fpack.id if fpack else None,
-            "nom": fpack.nom if fpack else "FPack inconnu",
-            "abbr": fpack.fpack_abbr if fpack else "",
-            "FPack_number": sous_projet_fpack.FPack_number,
-            "Robot_Location_Code": sous_projet_fpack.Robot_Location_Code
-        },
-        "currency": "EUR",
-        "lines": lines,
-        "totaux": {
-            "produit": total_produit,
-            "transport": total_transport,
-            "global": total_produit + total_transport
-        },
-        "resume": {
-            "nb_lignes": len(lines),
-            "nb_produits": nb_produits,
-            "nb_robots": nb_robots,
-            "nb_equipements": nb_equipements
-        }
-    }
-    
+    return PricingEngine(db).facture_sous_projet_fpack(sous_projet_fpack_id)
     
 def get_sous_projet_facture(sous_projet_id: int, db: Session):
     """
@@ -376,622 +38,327 @@ def get_sous_projet_facture(sous_projet_id: int, db: Session):
     incluant tous les sous_projet_fpack avec leurs configurations complètes
     Les items identiques sont regroupés avec quantité cumulée
     """
+    return PricingEngine(db).facture_sous_projet(sous_projet_id)
 
-    sous_projet = db.query(models.SousProjet).filter(
-        models.SousProjet.id == sous_projet_id
-    ).first()
-    
-    if not sous_projet:
-        raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
-    
-    projet_global = db.query(models.ProjetGlobal).filter(
-        models.ProjetGlobal.id == sous_projet.id_global
-    ).first()
-    
-    client = None
-    if projet_global:
-        client = db.query(models.Client).filter(
-            models.Client.id == projet_global.client
-        ).first()
-    
-    if not client:
-        raise HTTPException(status_code=404, detail="Client non trouvé")
-    
-    sous_projets_fpack = db.query(models.SousProjetFpack).filter(
-        models.SousProjetFpack.sous_projet_id == sous_projet_id
-    ).all()
-    
-    items_grouped = {}
-    total_produit = 0
-    total_transport = 0
-    
-    for spf in sous_projets_fpack:
-        fpack_config = get_fpack_config(spf.fpack_id, db)
+PDF_MEDIA_TYPE = "application/pdf"
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-        for config_item in fpack_config:
-            if config_item["type"] == "produit":
-                produit = db.query(models.Produit).filter(
-                    models.Produit.id == config_item["ref_id"]
-                ).first()
-                
-                if produit:
-                    key = ("produit", produit.id)
-                    
-                    prix = db.query(models.Prix).filter(
-                        models.Prix.produit_id == produit.id,
-                        models.Prix.client_id == client.id
-                    ).first()
-                    
-                    prix_unitaire = float(prix.prix_produit) if prix and prix.prix_produit else 0.0
-                    prix_transport = float(prix.prix_transport) if prix and prix.prix_transport else 0.0
-                    commentaire = prix.commentaire if prix else None
-                    
-                    if key in items_grouped:
-                        items_grouped[key]["qte"] += 1
-                        items_grouped[key]["total_ligne"] = (items_grouped[key]["prix_unitaire"] + 
-                                                           items_grouped[key]["prix_transport"]) * items_grouped[key]["qte"]
-                    else:
-                        items_grouped[key] = {
-                            "type": "produit",
-                            "produit_id": produit.id,
-                            "nom": produit.nom,
-                            "qte": 1,
-                            "prix_unitaire": prix_unitaire,
-                            "prix_transport": prix_transport,
-                            "commentaire": commentaire,
-                            "total_ligne": prix_unitaire + prix_transport
-                        }
-            
-            elif config_item["type"] == "equipement":
-                equipement = db.query(models.Equipements).filter(
-                    models.Equipements.id == config_item["ref_id"]
-                ).first()
-                
-                if equipement:
-                    key = ("equipement", equipement.id)
-                    
-                    prix_calc = calculate_equipement_price(equipement.id, client.id, db)
-                    
-                    prix_unitaire = prix_calc["prix_produit"] 
-                    prix_transport = prix_calc["prix_transport"]
-                    
-                    if key in items_grouped:
-                        items_grouped[key]["qte"] += 1
-                        items_grouped[key]["total_ligne"] = (items_grouped[key]["prix_unitaire"] + 
-                                                           items_grouped[key]["prix_transport"]) * items_grouped[key]["qte"]
-                    else:
-                        items_grouped[key] = {
-                            "type": "equipement",
-                            "produit_id": equipement.id,
-                            "nom": equipement.nom,
-                            "qte": 1,
-                            "prix_unitaire": prix_unitaire,
-                            "prix_transport": prix_transport,
-                            "commentaire": "Somme des prix des produits internes",
-                            "total_ligne": prix_unitaire + prix_transport
-                        }
-        
-        selections = db.query(models.ProjetSelection).filter(
-            models.ProjetSelection.sous_projet_fpack_id == spf.id
-        ).all()
-        
-        for selection in selections:
-            if selection.type_item == 'produit':
-                produit = db.query(models.Produit).filter(
-                    models.Produit.id == selection.ref_id
-                ).first()
-                
-                if produit:
-                    key = ("produit", produit.id)
-                    
-                    prix = db.query(models.Prix).filter(
-                        models.Prix.produit_id == produit.id,
-                        models.Prix.client_id == client.id
-                    ).first()
-                    
-                    prix_unitaire = float(prix.prix_produit) if prix and prix.prix_produit else 0.0
-                    prix_transport = float(prix.prix_transport) if prix and prix.prix_transport else 0.0
-                    commentaire = prix.commentaire if prix else None
-                    
-                    if key in items_grouped:
-                        items_grouped[key]["qte"] += 1
-                        items_grouped[key]["total_ligne"] = (items_grouped[key]["prix_unitaire"] + 
-                                                           items_grouped[key]["prix_transport"]) * items_grouped[key]["qte"]
-                    else:
-                        items_grouped[key] = {
-                            "type": "produit",
-                            "produit_id": produit.id,
-                            "nom": produit.nom,
-                            "qte": 1,
-                            "prix_unitaire": prix_unitaire,
-                            "prix_transport": prix_transport,
-                            "commentaire": commentaire,
-                            "total_ligne": prix_unitaire + prix_transport
-                        }
-            
-            elif selection.type_item == 'robot':
-                robot = db.query(models.Robots).filter(
-                    models.Robots.id == selection.ref_id
-                ).first()
-                
-                if robot:
-                    key = ("robot", robot.id)
-                    
-                    prix_robot = db.query(models.PrixRobot).filter(
-                        models.PrixRobot.id == robot.id
-                    ).first()
-                    
-                    prix_unitaire = float(prix_robot.prix_robot) if prix_robot and prix_robot.prix_robot else 0.0
-                    prix_transport = float(prix_robot.prix_transport) if prix_robot and prix_robot.prix_transport else 0.0
-                    commentaire = prix_robot.commentaire if prix_robot else None
-                    
-                    if key in items_grouped:
-                        items_grouped[key]["qte"] += 1
-                        items_grouped[key]["total_ligne"] = (items_grouped[key]["prix_unitaire"] + 
-                                                           items_grouped[key]["prix_transport"]) * items_grouped[key]["qte"]
-                    else:
-                        items_grouped[key] = {
-                            "type": "robot",
-                            "produit_id": robot.id,
-                            "nom": f"{robot.nom} ({robot.reference})",
-                            "qte": 1,
-                            "prix_unitaire": prix_unitaire,
-                            "prix_transport": prix_transport,
-                            "commentaire": commentaire,
-                            "total_ligne": prix_unitaire + prix_transport
-                        }
-            
-            elif selection.type_item == 'equipement':
-                equipement = db.query(models.Equipements).filter(
-                    models.Equipements.id == selection.ref_id
-                ).first()
-                
-                if equipement:
-                    key = ("equipement", equipement.id)
-                    
-                    prix_calc = calculate_equipement_price(equipement.id, client.id, db)
-                    
-                    prix_unitaire = prix_calc["prix_produit"]
-                    prix_transport = prix_calc["prix_transport"]
-                    
-                    if key in items_grouped:
-                        items_grouped[key]["qte"] += 1
-                        items_grouped[key]["total_ligne"] = (items_grouped[key]["prix_unitaire"] + 
-                                                           items_grouped[key]["prix_transport"]) * items_grouped[key]["qte"]
-                    else:
-                        items_grouped[key] = {
-                            "type": "equipement",
-                            "produit_id": equipement.id,
-                            "nom": equipement.nom,
-                            "qte": 1,
-                            "prix_unitaire": prix_unitaire,
-                            "prix_transport": prix_transport,
-                            "commentaire": "Somme des prix des produits internes",
-                            "total_ligne": prix_unitaire + prix_transport
-                        }
-    
-    lines = []
-    nb_produits = 0
-    nb_robots = 0
-    nb_equipements = 0
-    
-    for item in items_grouped.values():
-        lines.append(item)
-        
-        total_produit += item["prix_unitaire"] * item["qte"]
-        total_transport += item["prix_transport"] * item["qte"]
-        if item["type"] == "produit":
-            nb_produits += item["qte"]
-        elif item["type"] == "robot":
-            nb_robots += item["qte"]
-        elif item["type"] == "equipement":
-            nb_equipements += item["qte"]
-    
-    return {
-        "sous_projet_id": sous_projet_id,
-        "nom_sous_projet": sous_projet.nom,
-        "projet_global": {
-            "id": projet_global.id if projet_global else None,
-            "nom": projet_global.projet if projet_global else "Projet inconnu"
-        },
-        "client_id": client.id,
-        "client_nom": client.nom,
-        "currency": "EUR",
-        "lines": lines,
-        "totaux": {
-            "produit": total_produit,
-            "transport": total_transport,
-            "global": total_produit + total_transport
-        },
-        "resume": {
-            "nb_lignes": len(lines),
-            "nb_produits": nb_produits,
-            "nb_robots": nb_robots,
-            "nb_equipements": nb_equipements
-        }
-    }
+# Formats d'export : fonction de rendu et extension
+EXPORT_FORMATS = {
+    "pdf": (render_pdf_spooled, "pdf"),
+    "excel": (render_excel_spooled, "xlsx")
+}
 
-def generate_pdf_invoice(facture_data: Dict[str, Any]) -> io.BytesIO:
-    """Génère une facture PDF esthétique"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, 
-                           topMargin=2*cm, bottomMargin=2*cm)
-    max_char = 20
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=colors.HexColor('#2563eb'),
-        alignment=TA_CENTER
-    )
-    
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=colors.HexColor('#1e3a8a')
-    )
-    
-    story = []
-    
-    story.append(Paragraph("FACTURE", title_style))
-    story.append(Spacer(1, 20))
-    
-    info_data = [
-        ["Projet Global:", facture_data["projet_global"]["nom"]],
-        ["Sous-projet:", facture_data.get("nom_sous_projet", "N/A")],
-        ["Client:", facture_data.get("client_nom", "N/A")]
-    ]
-    
-    if "fpack" in facture_data:
-        info_data.extend([
-            ["FPack:", f"{facture_data['fpack']['nom']} ({facture_data['fpack']['abbr']})"],
-            ["Numéro FPack:", facture_data["fpack"]["FPack_number"] or "N/A"],
-            ["Code Robot:", facture_data["fpack"]["Robot_Location_Code"] or "N/A"]
-        ])
-    
-    info_data.extend([
-        ["Date:", datetime.now().strftime("%d/%m/%Y")],
-        ["Devise:", facture_data["currency"]]
-    ])
-    
-    info_table = Table(info_data, colWidths=[4*cm, 8*cm])
-    info_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1e3a8a')),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f8fafc')]),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
-    ]))
-    
-    story.append(info_table)
-    story.append(Spacer(1, 30))
-    
-    story.append(Paragraph("Détail des éléments", header_style))
-    story.append(Spacer(1, 10))
-    
-    table_data = [["Élément", "Qté", "Prix €", "Transport €", "Total €", "Commentaire"]]
-    
-    for line in facture_data["lines"]:
-        raw_comment = line["commentaire"] if line["commentaire"] else ("aucun prix" if line["prix_unitaire"] == 0 else "-")
-        if raw_comment and len(str(raw_comment)) > max_char:
-            comment = str(raw_comment)[:max_char] + "..."
-        else:
-            comment = raw_comment
-        table_data.append([
-            line["nom"],
-            str(line["qte"]),
-            f"{line['prix_unitaire']:.2f}",
-            f"{line['prix_transport']:.2f}",
-            f"{line['total_ligne']:.2f}",
-            comment
-        ])
-    
-    table_data.append([
-        "TOTAL",
-        "",
-        f"{facture_data['totaux']['produit']:.2f}",
-        f"{facture_data['totaux']['transport']:.2f}",
-        f"{facture_data['totaux']['global']:.2f} €",
-        ""
-    ])
-    
-    col_widths = [6*cm, 1.5*cm, 2*cm, 2*cm, 2.5*cm, 4*cm]
-    products_table = Table(table_data, colWidths=col_widths)
-    
-    table_style = [
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3b82f6')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        
-        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -2), 9),
-        ('ALIGN', (1, 1), (4, -2), 'RIGHT'), 
-        ('ALIGN', (0, 1), (0, -2), 'LEFT'),  
-        ('ALIGN', (5, 1), (5, -2), 'LEFT'),   
-        
-        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#059669')),
-        ('TEXTCOLOR', (0, -1), (-1, -1), colors.whitesmoke),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 11),
-        ('ALIGN', (0, -1), (-1, -1), 'CENTER'),
-        
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f8fafc')]),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]
-    
-    for i, line in enumerate(facture_data["lines"], 1):
-        if line["prix_unitaire"] == 0:
-            table_style.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor('#fef2f2')))
-            table_style.append(('TEXTCOLOR', (0, i), (-1, i), colors.HexColor('#991b1b')))
-    
-    products_table.setStyle(TableStyle(table_style))
-    story.append(products_table)
-    
-    story.append(Spacer(1, 30))
-    story.append(Paragraph("Résumé", header_style))
-    
-    resume_data = [
-        ["Nombre de lignes:", str(facture_data["resume"]["nb_lignes"])],
-        ["Nombre de produits:", str(facture_data["resume"]["nb_produits"])],
-        ["Nombre de robots:", str(facture_data["resume"]["nb_robots"])],
-        ["Nombre d'équipements:", str(facture_data["resume"]["nb_equipements"])]
-    ]
-    
-    resume_table = Table(resume_data, colWidths=[5*cm, 2*cm])
-    resume_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
-    ]))
-    
-    story.append(resume_table)
-    
-    story.append(Spacer(1, 40))
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.HexColor('#64748b'),
-        alignment=TA_CENTER
-    )
-    story.append(Paragraph(f"Facture générée le {datetime.now().strftime('%d/%m/%Y à %H:%M')}", footer_style))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+def get_facture_projet_global_data(projet_global_id: int, db: Session):
+    """Récupère les données de la facture consolidée d'un projet global"""
+    return PricingEngine(db).facture_projet_global(projet_global_id)
 
-def generate_excel_invoice(facture_data: Dict[str, Any]) -> io.BytesIO:
-    """Génère une facture Excel esthétique"""
-    buffer = io.BytesIO()
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Facture"
-    
-    title_font = Font(name='Segoe UI', size=18, bold=True, color='2563EB')
-    header_font = Font(name='Segoe UI', size=12, bold=True, color='1E3A8A')
-    normal_font = Font(name='Segoe UI', size=10)
-    bold_font = Font(name='Segoe UI', size=10, bold=True)
-    
-    blue_fill = PatternFill(start_color='3B82F6', end_color='3B82F6', fill_type='solid')
-    light_blue_fill = PatternFill(start_color='F1F5F9', end_color='F1F5F9', fill_type='solid')
-    green_fill = PatternFill(start_color='059669', end_color='059669', fill_type='solid')
-    red_fill = PatternFill(start_color='FEF2F2', end_color='FEF2F2', fill_type='solid')
-    
-    thin_border = Border(
-        left=Side(style='thin', color='E2E8F0'),
-        right=Side(style='thin', color='E2E8F0'),
-        top=Side(style='thin', color='E2E8F0'),
-        bottom=Side(style='thin', color='E2E8F0')
-    )
-    
-    ws.merge_cells('A1:F1')
-    ws['A1'] = 'FACTURE'
-    ws['A1'].font = title_font
-    ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
-    ws.row_dimensions[1].height = 30
-    
-    row = 3
-    info_data = [
-        ("Projet Global:", facture_data["projet_global"]["nom"]),
-        ("Sous-projet:", facture_data.get("nom_sous_projet", "N/A")),
-        ("Client:", facture_data.get("client_nom", "N/A"))
-    ]
-    
-    if "fpack" in facture_data:
-        info_data.extend([
-            ("FPack:", f"{facture_data['fpack']['nom']} ({facture_data['fpack']['abbr']})"),
-            ("Numéro FPack:", facture_data["fpack"]["FPack_number"] or "N/A"),
-            ("Code Robot:", facture_data["fpack"]["Robot_Location_Code"] or "N/A")
-        ])
-    
-    info_data.extend([
-        ("Date:", datetime.now().strftime("%d/%m/%Y")),
-        ("Devise:", facture_data["currency"])
-    ])
-    
-    for label, value in info_data:
-        ws[f'A{row}'] = label
-        ws[f'B{row}'] = value
-        ws[f'A{row}'].font = bold_font
-        ws[f'A{row}'].fill = light_blue_fill
-        ws[f'B{row}'].font = normal_font
-        ws[f'A{row}'].border = thin_border
-        ws[f'B{row}'].border = thin_border
-        row += 1
-    
-    row += 2
+# Portée de chaque facture, pour l'empreinte des lignes dont elle dépend (cache)
+FACTURE_SCOPES = {
+    get_sous_projet_fpack_facture: "sous_projet_fpack",
+    get_sous_projet_facture: "sous_projet",
+    get_facture_projet_global_data: "projet_global"
+}
 
-    headers = ["Élément", "Qté", "Prix unitaire €", "Transport unitaire €", "Total €", "Commentaire"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col, value=header)
-        cell.font = Font(name='Segoe UI', size=10, bold=True, color='FFFFFF')
-        cell.fill = blue_fill
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-    
-    row += 1
-    
-    for line in facture_data["lines"]:
-        values = [
-            line["nom"],
-            line["qte"],
-            line["prix_unitaire"],
-            line["prix_transport"], 
-            line["total_ligne"],
-            line["commentaire"] if line["commentaire"] else 
-            (" Aucun prix" if line["prix_unitaire"] == 0 else "-")
-        ]
-        
-        for col, value in enumerate(values, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.font = normal_font
-            cell.border = thin_border
-            
-            if col in [2, 3, 4, 5] and isinstance(value, (int, float)):
-                cell.alignment = Alignment(horizontal='right')
-            
-            if line["prix_unitaire"] == 0:
-                cell.fill = red_fill
-                cell.font = Font(name='Segoe UI', size=10, color='991B1B')
-        
-        row += 1
-    
-    total_values = [
-        "TOTAL",
-        "",
-        facture_data["totaux"]["produit"],
-        facture_data["totaux"]["transport"],
-        f"{facture_data['totaux']['global']} € TTC",
-        ""
-    ]
-    
-    for col, value in enumerate(total_values, 1):
-        cell = ws.cell(row=row, column=col, value=value)
-        cell.font = Font(name='Segoe UI', size=11, bold=True, color='FFFFFF')
-        cell.fill = green_fill
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-    
-    column_widths = [50, 8, 12, 12, 15, 25]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(i)].width = width
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
-    row += 3
-    ws[f'A{row}'] = "RÉSUMÉ"
-    ws[f'A{row}'].font = header_font
-    row += 1
-    
-    resume_data = [
-        ("Nombre de lignes:", facture_data["resume"]["nb_lignes"]),
-        ("Nombre de produits:", facture_data["resume"]["nb_produits"]),
-        ("Nombre de robots:", facture_data["resume"]["nb_robots"]),
-        ("Nombre d'équipements:", facture_data["resume"]["nb_equipements"])
-    ]
-    
-    for label, value in resume_data:
-        ws[f'A{row}'] = label
-        ws[f'B{row}'] = value
-        ws[f'A{row}'].font = bold_font
-        ws[f'B{row}'].font = normal_font
-        ws[f'A{row}'].border = thin_border
-        ws[f'B{row}'].border = thin_border
-        row += 1
+def facture_json_response(load_facture, object_id: int, request: Request, response: Response, db: Session):
+    """Réponse JSON d'une facture avec ETag (304 si le client a déjà cette version)"""
+    facture_data, fingerprint = get_cached_facture(load_facture, object_id, db, FACTURE_SCOPES[load_facture])
+    etag = f'"{fingerprint}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return facture_data
+
+async def export_facture(load_facture, object_id: int, request: Request, db: Session, render_fn, media_type: str, filename: str):
+    """
+    Export commun des factures : les requêtes SQL (synchrones) tournent dans le threadpool,
+    le rendu PDF/Excel dans le pool de processus, la boucle d'événements reste libre.
+    Les gros documents restent sur disque et sont streamés par morceaux.
+    """
+    facture_data, fingerprint = await run_in_threadpool(get_cached_facture, load_facture, object_id, db, FACTURE_SCOPES[load_facture])
+    etag = document_etag(fingerprint, filename.rsplit(".", 1)[-1])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "ETag": etag,
+        "Cache-Control": "no-cache"
+    }
     
-    row += 2
-    ws[f'A{row}'] = f"Facture générée le {datetime.now().strftime('%d/%m/%Y à %H:%M')}"
-    ws[f'A{row}'].font = Font(name='Segoe UI', size=8, color='64748B')
+    rendered = get_cached_document(etag)
+    if rendered is None:
+        rendered = await render_in_pool(render_fn, facture_data, INVOICE_SPOOL_THRESHOLD, INVOICE_SPOOL_DIR)
+        if isinstance(rendered, bytes):
+            put_cached_document(etag, rendered)
     
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return document_response(rendered, media_type, headers)
+
+def document_response(rendered, media_type: str, headers: Dict[str, str]) -> StreamingResponse:
+    """Document rendu en mémoire (bytes) ou sur disque (chemin, supprimé après l'envoi)"""
+    if isinstance(rendered, bytes):
+        return StreamingResponse(io.BytesIO(rendered), media_type=media_type, headers=headers)
+    
+    headers["Content-Length"] = str(os.path.getsize(rendered))
+    return StreamingResponse(
+        iter_spool_file(rendered),
+        media_type=media_type,
+        headers=headers,
+        # Client déconnecté avant la fin : le fichier est tout de même supprimé
+        background=BackgroundTask(remove_spool_file, rendered)
+    )
 
 @router.get("/sous_projet_fpack/{sous_projet_fpack_id}/facture-pdf")
-async def export_facture_pdf(sous_projet_fpack_id: int, db: Session = Depends(get_db)):
+async def export_facture_pdf(sous_projet_fpack_id: int, request: Request, db: Session = Depends(get_db)):
     """Exporte la facture d'un sous-projet FPack en PDF"""
     try:
-        facture_data = get_sous_projet_fpack_facture(sous_projet_fpack_id, db)
-        pdf_buffer = generate_pdf_invoice(facture_data)
-        
-        return StreamingResponse(
-            io.BytesIO(pdf_buffer.read()),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=facture-projet-{sous_projet_fpack_id}.pdf"
-            }
+        return await export_facture(
+            get_sous_projet_fpack_facture, sous_projet_fpack_id, request, db,
+            render_pdf_spooled, PDF_MEDIA_TYPE, f"facture-projet-{sous_projet_fpack_id}.pdf"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du PDF: {str(e)}")
 
 @router.get("/sous_projet_fpack/{sous_projet_fpack_id}/facture-excel")
-async def export_facture_excel(sous_projet_fpack_id: int, db: Session = Depends(get_db)):
+async def export_facture_excel(sous_projet_fpack_id: int, request: Request, db: Session = Depends(get_db)):
     """Exporte la facture d'un sous-projet FPack en Excel"""
     try:
-        facture_data = get_sous_projet_fpack_facture(sous_projet_fpack_id, db)
-        excel_buffer = generate_excel_invoice(facture_data)
-        
-        return StreamingResponse(
-            io.BytesIO(excel_buffer.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename=facture-projet-{sous_projet_fpack_id}.xlsx"
-            }
+        return await export_facture(
+            get_sous_projet_fpack_facture, sous_projet_fpack_id, request, db,
+            render_excel_spooled, EXCEL_MEDIA_TYPE, f"facture-projet-{sous_projet_fpack_id}.xlsx"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération d'Excel: {str(e)}")
 
 @router.get("/sous_projets/{sous_projet_id}/facture-pdf")
-async def export_sous_projet_facture_pdf(sous_projet_id: int, db: Session = Depends(get_db)):
+async def export_sous_projet_facture_pdf(sous_projet_id: int, request: Request, db: Session = Depends(get_db)):
     """Exporte la facture d'un sous-projet en PDF"""
     try:
-        facture_data = get_sous_projet_facture(sous_projet_id, db)
-        pdf_buffer = generate_pdf_invoice(facture_data)
-        
-        return StreamingResponse(
-            io.BytesIO(pdf_buffer.read()),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=facture-sous-projet-{sous_projet_id}.pdf"
-            }
+        return await export_facture(
+            get_sous_projet_facture, sous_projet_id, request, db,
+            render_pdf_spooled, PDF_MEDIA_TYPE, f"facture-sous-projet-{sous_projet_id}.pdf"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du PDF: {str(e)}")
 
 @router.get("/sous_projets/{sous_projet_id}/facture-excel")
-async def export_sous_projet_facture_excel(sous_projet_id: int, db: Session = Depends(get_db)):
+async def export_sous_projet_facture_excel(sous_projet_id: int, request: Request, db: Session = Depends(get_db)):
     """Exporte la facture d'un sous-projet en Excel"""
     try:
-        facture_data = get_sous_projet_facture(sous_projet_id, db)
-        excel_buffer = generate_excel_invoice(facture_data)
-        
-        return StreamingResponse(
-            io.BytesIO(excel_buffer.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename=facture-sous-projet-{sous_projet_id}.xlsx"
-            }
+        return await export_facture(
+            get_sous_projet_facture, sous_projet_id, request, db,
+            render_excel_spooled, EXCEL_MEDIA_TYPE, f"facture-sous-projet-{sous_projet_id}.xlsx"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération d'Excel: {str(e)}")
 
 
 @router.get("/sous_projet_fpack/{sous_projet_fpack_id}/facture")
-async def get_facture_sous_projet_fpack(sous_projet_fpack_id: int, db: Session = Depends(get_db)):
+def get_facture_sous_projet_fpack(sous_projet_fpack_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """Récupère les données de facture d'un sous-projet FPack"""
-    return get_sous_projet_fpack_facture(sous_projet_fpack_id, db)
+    return facture_json_response(get_sous_projet_fpack_facture, sous_projet_fpack_id, request, response, db)
 
 @router.get("/sous_projets/{sous_projet_id}/facture")
-async def get_facture_sous_projet(sous_projet_id: int, db: Session = Depends(get_db)):
+def get_facture_sous_projet(sous_projet_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """Récupère les données de facture d'un sous-projet"""
-    return get_sous_projet_facture(sous_projet_id, db)
\ No newline at end of file
+    return facture_json_response(get_sous_projet_facture, sous_projet_id, request, response, db)
+
+@router.get("/projets_globaux/{projet_global_id}/facture")
+def get_facture_projet_global(projet_global_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Récupère la facture consolidée d'un projet global (sous-totaux par sous-projet et total général)"""
+    return facture_json_response(get_facture_projet_global_data, projet_global_id, request, response, db)
+
+@router.get("/projets_globaux/{projet_global_id}/facture-pdf")
+async def export_projet_global_facture_pdf(projet_global_id: int, request: Request, db: Session = Depends(get_db)):
+    """Exporte la facture consolidée d'un projet global en PDF"""
+    try:
+        return await export_facture(
+            get_facture_projet_global_data, projet_global_id, request, db,
+            render_pdf_spooled, PDF_MEDIA_TYPE, f"facture-projet-global-{projet_global_id}.pdf"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du PDF: {str(e)}")
+
+@router.get("/projets_globaux/{projet_global_id}/facture-excel")
+async def export_projet_global_facture_excel(projet_global_id: int, request: Request, db: Session = Depends(get_db)):
+    """Exporte la facture consolidée d'un projet global en Excel"""
+    try:
+        return await export_facture(
+            get_facture_projet_global_data, projet_global_id, request, db,
+            render_excel_spooled, EXCEL_MEDIA_TYPE, f"facture-projet-global-{projet_global_id}.xlsx"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération d'Excel: {str(e)}")
+
+def get_factures_instances_projet_global(projet_global_id: int, db: Session) -> List[Dict]:
+    """Factures de toutes les instances F-Pack d'un projet global, chargées en lot"""
+    projet = db.query(models.ProjetGlobal).filter(models.ProjetGlobal.id == projet_global_id).first()
+    if not projet:
+        raise HTTPException(status_code=404, detail="Projet global non trouvé")
+    
+    ids = [spf_id for (spf_id,) in db.query(models.SousProjetFpack.id).join(
+        models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+    ).filter(
+        models.SousProjet.id_global == projet_global_id
+    ).order_by(models.SousProjet.id, models.SousProjetFpack.id).all()]
+    
+    if not ids:
+        raise HTTPException(status_code=404, detail="Aucun F-Pack dans ce projet global")
+    
+    engine = PricingEngine(db).load(ids)
+    return [engine.facture_sous_projet_fpack(spf_id) for spf_id in ids]
+
+def discard_rendered(rendered):
+    if isinstance(rendered, str):
+        remove_spool_file(rendered)
+
+async def stream_factures_zip(jobs, slot: RenderSlot):
+    """
+    Rend les factures en parallèle et écrit chaque document dans l'archive dès qu'il est prêt.
+    La compression et la lecture des fichiers temporaires sont faites dans le pool de threads,
+    pas dans la boucle d'événements
+    """
+    archive = ZipStream()
+    try:
+        async for name, rendered in render_many_in_pool(jobs, on_abandoned=discard_rendered):
+            if isinstance(rendered, bytes):
+                yield await run_in_threadpool(archive.add_bytes, name, rendered)
+                continue
+            entree = archive.add_file(name, rendered)
+            try:
+                async for chunk in iterate_in_threadpool(entree):
+                    if chunk:
+                        yield chunk
+            finally:
+                entree.close()
+                remove_spool_file(rendered)
+        yield await run_in_threadpool(archive.close)
+    finally:
+        slot.release()
+
+@router.get("/projets_globaux/{projet_global_id}/factures.zip")
+async def export_projet_global_factures_zip(projet_global_id: int, formats: str = "pdf", db: Session = Depends(get_db)):
+    """
+    Exporte dans une archive ZIP la facture de chaque instance F-Pack d'un projet global.
+    formats : "pdf", "excel" ou "pdf,excel". Les documents sont rendus en parallèle
+    et l'archive est streamée au fur et à mesure.
+    """
+    requested = list(dict.fromkeys(f.strip().lower() for f in formats.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in EXPORT_FORMATS]
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format(s) non supporté(s) : {', '.join(unknown) or formats}. Formats acceptés : {', '.join(EXPORT_FORMATS)}"
+        )
+    
+    factures = await run_in_threadpool(get_factures_instances_projet_global, projet_global_id, db)
+    
+    jobs = []
+    for facture in factures:
+        dossier = f"{facture['sous_projet_id']} - {facture['nom_sous_projet']}"
+        nom = facture["fpack"]["FPack_number"] or facture["fpack"]["abbr"] or facture["fpack"]["nom"]
+        for fmt in requested:
+            render_fn, extension = EXPORT_FORMATS[fmt]
+            name = zip_entry_name(dossier, f"facture-{nom}-{facture['sous_projet_fpack_id']}.{extension}")
+            jobs.append((name, render_fn, (facture, INVOICE_SPOOL_THRESHOLD, INVOICE_SPOOL_DIR)))
+    
+    # Une seule place réservée pour toute l'archive, libérée à la fin du streaming ; si le
+    # générateur ne démarre jamais (client déconnecté avant l'envoi), par la tâche de fond
+    slot = RenderSlot()
+    try:
+        return StreamingResponse(
+            stream_factures_zip(jobs, slot),
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f"attachment; filename=factures-projet-global-{projet_global_id}.zip"
+            },
+            background=BackgroundTask(slot.release)
+        )
+    except BaseException:
+        slot.release()
+        raise
+
+@router.get("/projets_globaux/{projet_global_id}/factures.xlsx")
+async def export_projet_global_factures_classeur(projet_global_id: int, db: Session = Depends(get_db)):
+    """
+    Exporte les factures de toutes les instances F-Pack d'un projet global dans un seul
+    classeur Excel, une feuille par instance (nommée d'après le numéro F-Pack).
+    """
+    factures = await run_in_threadpool(get_factures_instances_projet_global, projet_global_id, db)
+    feuilles = [
+        (facture["fpack"]["FPack_number"] or facture["fpack"]["abbr"] or f"F-Pack {facture['sous_projet_fpack_id']}", facture)
+        for facture in factures
+    ]
+    
+    try:
+        rendered = await render_in_pool(render_excel_workbook_spooled, feuilles, INVOICE_SPOOL_THRESHOLD, INVOICE_SPOOL_DIR)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération d'Excel: {str(e)}")
+    
+    return document_response(rendered, EXCEL_MEDIA_TYPE, {
+        "Content-Disposition": f"attachment; filename=factures-projet-global-{projet_global_id}.xlsx"
+    })
+
+FACTURE_BATCH_MAX_IDS = 5000
+
+@router.post("/factures/batch")
+def get_factures_batch(
+    payload: schemas.FactureBatchRequest,
+    fields: str = Query(None, description="'totaux' pour ne renvoyer que les totaux"),
+    db: Session = Depends(get_db)
+):
+    """
+    Factures d'une liste d'instances F-Pack, chargées en lot (nombre fixe de requêtes
+    quel que soit le nombre d'ids). Les ids introuvables sont listés dans "erreurs".
+    """
+    if fields not in (None, "totaux"):
+        raise HTTPException(status_code=400, detail="Valeur de fields non supportée (seule valeur acceptée : totaux)")
+    ids = list(dict.fromkeys(payload.ids))
+    if len(ids) > FACTURE_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Trop d'ids demandés (maximum {FACTURE_BATCH_MAX_IDS})")
+    
+    engine = PricingEngine(db).load(ids)
+    factures = []
+    erreurs = []
+    for spf_id in ids:
+        try:
+            facture = engine.facture_sous_projet_fpack(spf_id)
+        except HTTPException as e:
+            erreurs.append({"sous_projet_fpack_id": spf_id, "detail": e.detail})
+            continue
+        if fields == "totaux":
+            facture = {
+                "sous_projet_fpack_id": spf_id,
+                "totaux": facture["totaux"],
+                "resume": facture["resume"]
+            }
+        factures.append(facture)
+    
+    return {"factures": factures, "erreurs": erreurs}
+
+@router.get("/sous_projets/{sous_projet_id}/quote-comparison")
+def get_quote_comparison(
+    sous_projet_id: int,
+    client_ids: Optional[List[int]] = Query(None, description="Clients à comparer (tous par défaut)"),
+    db: Session = Depends(get_db)
+):
+    """Compare le coût d'un sous-projet selon la grille tarifaire de chaque client"""
+    return PricingEngine(db).quote_comparison(sous_projet_id, client_ids)
@@ -0,0 +1,246 @@
+import asyncio
+import io
+from datetime import datetime
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query # type: ignore
+from fastapi.responses import StreamingResponse # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App.database import SessionLocal
+from App import models
+from App.pricing import PricingEngine
+from App.invoice_render import render_pdf_bytes, render_excel_bytes
+from App.workers import render_in_pool
+
+router = APIRouter()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+DOCUMENT_FORMATS = {
+    "pdf": ("application/pdf", "pdf"),
+    "excel": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx")
+}
+
+
+def save_facture_emise(facture_data: Dict[str, Any], date_emission: datetime, documents: Dict[str, bytes], db: Session) -> models.FactureEmise:
+    """Enregistre l'en-tête, les lignes et les documents d'une facture émise"""
+    facture = models.FactureEmise(
+        date_emission=date_emission,
+        sous_projet_fpack_id=facture_data["sous_projet_fpack_id"],
+        sous_projet_id=facture_data["sous_projet_id"],
+        nom_sous_projet=facture_data["nom_sous_projet"],
+        projet_global_id=facture_data["projet_global"]["id"],
+        projet_global_nom=facture_data["projet_global"]["nom"],
+        client_id=facture_data["client_id"],
+        client_nom=facture_data["client_nom"],
+        fpack_id=facture_data["fpack"]["id"],
+        fpack_nom=facture_data["fpack"]["nom"],
+        fpack_abbr=facture_data["fpack"]["abbr"],
+        FPack_number=facture_data["fpack"]["FPack_number"],
+        Robot_Location_Code=facture_data["fpack"]["Robot_Location_Code"],
+        currency=facture_data["currency"],
+        total_produit=facture_data["totaux"]["produit"],
+        total_transport=facture_data["totaux"]["transport"],
+        total_global=facture_data["totaux"]["global"]
+    )
+    facture.lignes = [
+        models.FactureEmiseLigne(
+            position=position,
+            type=line["type"],
+            ref_id=line["produit_id"],
+            nom=line["nom"],
+            qte=line["qte"],
+            prix_unitaire=line["prix_unitaire"],
+            prix_transport=line["prix_transport"],
+            total_ligne=line["total_ligne"],
+            commentaire=line["commentaire"]
+        )
+        for position, line in enumerate(facture_data["lines"])
+    ]
+    facture.documents = [
+        models.FactureEmiseDocument(format=fmt, contenu=contenu)
+        for fmt, contenu in documents.items()
+    ]
+
+    db.add(facture)
+    db.flush()
+    facture.numero = f"FAC-{date_emission.year}-{facture.id:06d}"
+    db.commit()
+    db.refresh(facture)
+    return facture
+
+
+def facture_emise_summary(facture: models.FactureEmise) -> Dict[str, Any]:
+    return {
+        "id": facture.id,
+        "numero": facture.numero,
+        "date_emission": facture.date_emission,
+        "sous_projet_fpack_id": facture.sous_projet_fpack_id,
+        "sous_projet_id": facture.sous_projet_id,
+        "nom_sous_projet": facture.nom_sous_projet,
+        "projet_global_id": facture.projet_global_id,
+        "projet_global_nom": facture.projet_global_nom,
+        "client_id": facture.client_id,
+        "client_nom": facture.client_nom,
+        "fpack_nom": facture.fpack_nom,
+        "FPack_number": facture.FPack_number,
+        "currency": facture.currency,
+        "totaux": {
+            "produit": facture.total_produit,
+            "transport": facture.total_transport,
+            "global": facture.total_global
+        }
+    }
+
+
+def get_facture_emise_or_404(facture_id: int, db: Session) -> models.FactureEmise:
+    facture = db.query(models.FactureEmise).filter(models.FactureEmise.id == facture_id).first()
+    if not facture:
+        raise HTTPException(status_code=404, detail="Facture émise non trouvée")
+    return facture
+
+
+@router.post("/sous_projet_fpack/{sous_projet_fpack_id}/facture/emettre")
+async def emettre_facture(sous_projet_fpack_id: int, db: Session = Depends(get_db)):
+    """
+    Émet la facture d'une instance F-Pack : lignes, totaux et documents PDF/Excel
+    sont figés et ne seront plus recalculés à partir des prix courants.
+    """
+    facture_data = await run_in_threadpool(
+        lambda: PricingEngine(db).facture_sous_projet_fpack(sous_projet_fpack_id)
+    )
+    date_emission = datetime.now()
+
+    try:
+        pdf, excel = await asyncio.gather(
+            render_in_pool(render_pdf_bytes, facture_data),
+            render_in_pool(render_excel_bytes, facture_data)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération des documents: {str(e)}")
+
+    facture = await run_in_threadpool(
+        save_facture_emise, facture_data, date_emission, {"pdf": pdf, "excel": excel}, db
+    )
+    return facture_emise_summary(facture)
+
+
+@router.get("/factures_emises")
+def list_factures_emises(
+    sous_projet_fpack_id: Optional[int] = None,
+    projet_global_id: Optional[int] = None,
+    client_id: Optional[int] = None,
+    cursor: Optional[int] = Query(None, description="id de la dernière facture de la page précédente"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """Liste paginée des factures émises, des plus récentes aux plus anciennes"""
+    query = db.query(models.FactureEmise)
+    if sous_projet_fpack_id is not None:
+        query = query.filter(models.FactureEmise.sous_projet_fpack_id == sous_projet_fpack_id)
+    if projet_global_id is not None:
+        query = query.filter(models.FactureEmise.projet_global_id == projet_global_id)
+    if client_id is not None:
+        query = query.filter(models.FactureEmise.client_id == client_id)
+    if cursor is not None:
+        query = query.filter(models.FactureEmise.id < cursor)
+
+    factures = query.order_by(models.FactureEmise.id.desc()).limit(limit + 1).all()
+    has_more = len(factures) > limit
+    factures = factures[:limit]
+
+    return {
+        "items": [facture_emise_summary(f) for f in factures],
+        "next_cursor": factures[-1].id if has_more else None
+    }
+
+
+@router.get("/factures_emises/{facture_id}")
+def get_facture_emise(facture_id: int, db: Session = Depends(get_db)):
+    """Facture émise, au format de la facture calculée, lue telle qu'elle a été figée"""
+    facture = get_facture_emise_or_404(facture_id, db)
+    lignes = db.query(models.FactureEmiseLigne)\
+        .filter(models.FactureEmiseLigne.facture_id == facture_id)\
+        .order_by(models.FactureEmiseLigne.position)\
+        .all()
+
+    lines = [
+        {
+            "type": ligne.type,
+            "produit_id": ligne.ref_id,
+            "nom": ligne.nom,
+            "qte": ligne.qte,
+            "prix_unitaire": ligne.prix_unitaire,
+            "prix_transport": ligne.prix_transport,
+            "commentaire": ligne.commentaire,
+            "total_ligne": ligne.total_ligne
+        }
+        for ligne in lignes
+    ]
+    summary = PricingEngine.summarize(lines)
+
+    return {
+        "facture_emise": {
+            "id": facture.id,
+            "numero": facture.numero,
+            "date_emission": facture.date_emission
+        },
+        "sous_projet_fpack_id": facture.sous_projet_fpack_id,
+        "sous_projet_id": facture.sous_projet_id,
+        "nom_sous_projet": facture.nom_sous_projet,
+        "projet_global": {
+            "id": facture.projet_global_id,
+            "nom": facture.projet_global_nom
+        },
+        "client_id": facture.client_id,
+        "client_nom": facture.client_nom,
+        "fpack": {
+            "id": facture.fpack_id,
+            "nom": facture.fpack_nom,
+            "abbr": facture.fpack_abbr,
+            "FPack_number": facture.FPack_number,
+            "Robot_Location_Code": facture.Robot_Location_Code
+        },
+        "currency": facture.currency,
+        "lines": lines,
+        "totaux": {
+            "produit": facture.total_produit,
+            "transport": facture.total_transport,
+            "global": facture.total_global
+        },
+        "resume": summary["resume"]
+    }
+
+
+@router.get("/factures_emises/{facture_id}/facture-{document_format}")
+def download_facture_emise(facture_id: int, document_format: str, db: Session = Depends(get_db)):
+    """Télécharge le document PDF ou Excel enregistré lors de l'émission"""
+    if document_format not in DOCUMENT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Format inconnu : {document_format}")
+
+    document = db.query(models.FactureEmiseDocument).filter(
+        models.FactureEmiseDocument.facture_id == facture_id,
+        models.FactureEmiseDocument.format == document_format
+    ).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document de facture émise non trouvé")
+
+    numero = db.query(models.FactureEmise.numero).filter(models.FactureEmise.id == facture_id).scalar()
+    media_type, extension = DOCUMENT_FORMATS[document_format]
+    return StreamingResponse(
+        io.BytesIO(document.contenu),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={numero or facture_id}.{extension}",
+            # Une facture émise ne change plus
+            "ETag": f'"facture-emise-{facture_id}-{document_format}"',
+            "Cache-Control": "private, max-age=31536000, immutable"
+        }
+    )
@@ -1,6 +1,8 @@
 from App import models
 from App.database import SessionLocal
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends #type: ignore
+from App.completeness import counters_complete, sous_projet_counters
+from App.pagination import keyset_page
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query #type: ignore
 from sqlalchemy.orm import Session # type: ignore
 from typing import List, Dict, Any, Optional, Tuple
 import pandas as pd # type: ignore
@@ -852,11 +854,28 @@ def validate_fpack_configurations(fpack_configurations: List[Dict]) -> None:
                 )
 
 @router.get("/import/sous-projets")
-async def get_available_sous_projets(db: Session = Depends(get_db)):
-    """Récupère la liste des sous-projets avec jointure optimisée"""
+async def get_available_sous_projets(
+    client_id: Optional[int] = None,
+    nom: Optional[str] = Query(None, description="Début du nom du sous-projet"),
+    complet: Optional[bool] = None,
+    after: Optional[int] = Query(None, description="id du dernier sous-projet de la page précédente"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Taille de page ; sans limite, liste complète"),
+    db: Session = Depends(get_db)
+):
+    """Récupère la liste des sous-projets avec jointure optimisée, paginée par curseur avec limit"""
     try:
-        # Requête optimisée avec jointure
-        sous_projets = db.query(models.SousProjet).join(models.SousProjet.global_rel, isouter=True).all()
+        query = db.query(models.SousProjet, models.ProjetGlobal.id, models.ProjetGlobal.projet).outerjoin(
+            models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global
+        )
+        if client_id:
+            query = query.filter(models.ProjetGlobal.client == client_id)
+        if nom:
+            query = query.filter(models.SousProjet.nom.startswith(nom, autoescape=True))
+        if complet is not None:
+            condition = counters_complete(*sous_projet_counters(models.SousProjet.id))
+            query = query.filter(condition if complet else ~condition)
+        
+        rows, has_more = keyset_page(query, models.SousProjet.id, after, limit)
         
         return {
             "success": True,
@@ -864,10 +883,11 @@ async def get_available_sous_projets(db: Session = Depends(get_db)):
                 {
                     "id": sp.id,
                     "nom": sp.nom,
-                    "projet_global": sp.global_rel.projet if sp.global_rel else "N/A"
+                    "projet_global": projet_global if projet_global_id is not None else "N/A"
                 }
-                for sp in sous_projets
-            ]
+                for sp, projet_global_id, projet_global in rows
+            ],
+            "next_cursor": rows[-1][0].id if has_more else None
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur : {str(e)}")
@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException # type: ignore
 from sqlalchemy.orm import Session # type: ignore
 from App.database import SessionLocal
 from App import models, schemas
+from App.pricing import refresh_costs_for_produits
+from App.price_coverage import price_coverage_projet_global, price_coverage_client, price_coverage_all_projets
 
 router = APIRouter()
 
@@ -30,6 +32,7 @@ def create_prix(prix: schemas.PrixCreate, db: Session = Depends(get_db)):
 
     db_prix = models.Prix(**prix.dict())
     db.add(db_prix)
+    refresh_costs_for_produits(db, [prix.produit_id], [prix.client_id])
     db.commit()
     db.refresh(db_prix)
     return db_prix
@@ -44,6 +47,7 @@ def update_prix(produit_id: int, client_id: int, prix: schemas.PrixCreate, db: S
         raise HTTPException(status_code=404, detail="Prix non trouvé")
     for key, value in prix.model_dump().items():
         setattr(db_prix, key, value)
+    refresh_costs_for_produits(db, {produit_id, prix.produit_id}, {client_id, prix.client_id})
     db.commit()
     db.refresh(db_prix)
     return db_prix
@@ -57,6 +61,7 @@ def delete_prix(produit_id: int, client_id: int, db: Session = Depends(get_db)):
     if not db_prix:
         raise HTTPException(status_code=404, detail="Prix non trouvé")
     db.delete(db_prix)
+    refresh_costs_for_produits(db, [produit_id], [client_id])
     db.commit()
     return {"ok": True}
 
@@ -75,6 +80,48 @@ def get_prix(produit_id: int, client_id: int, db: Session = Depends(get_db)):
 @router.delete("/prix/{produit_id}")
 def delete_all_prix_for_produit(produit_id: int, db: Session = Depends(get_db)):
     deleted = db.query(models.Prix).filter(models.Prix.produit_id == produit_id).delete(synchronize_session=False)
+    refresh_costs_for_produits(db, [produit_id])
     db.commit()
     return {"deleted": deleted}
 
+
+# COUVERTURE TARIFAIRE
+
+@router.get("/projets_globaux/{projet_global_id}/price-coverage")
+def get_price_coverage_projet_global(projet_global_id: int, db: Session = Depends(get_db)):
+    """Produits, robots, composants d'équipements et équipements vides utilisés par le projet sans prix pour son client"""
+    projet = db.query(models.ProjetGlobal).filter(models.ProjetGlobal.id == projet_global_id).first()
+    if not projet:
+        raise HTTPException(status_code=404, detail="Projet global non trouvé")
+    return {
+        "projet_global_id": projet.id,
+        "client_id": projet.client,
+        **price_coverage_projet_global(db, projet_global_id)
+    }
+
+@router.get("/clients/{client_id}/price-coverage")
+def get_price_coverage_client(client_id: int, db: Session = Depends(get_db)):
+    """Items atteignables depuis les F-Packs du client (colonnes et options de groupes) sans prix"""
+    client = db.query(models.Client).filter(models.Client.id == client_id).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client non trouvé")
+    return {
+        "client_id": client.id,
+        **price_coverage_client(db, client_id)
+    }
+
+@router.get("/price-coverage/projets_globaux")
+def get_price_coverage_all_projets(db: Session = Depends(get_db)):
+    """Projets globaux ayant des prix manquants (contrôle de tous les projets en quatre requêtes)"""
+    rapports = price_coverage_all_projets(db)
+    projets = db.query(models.ProjetGlobal.id, models.ProjetGlobal.projet, models.ProjetGlobal.client)\
+        .filter(models.ProjetGlobal.id.in_(list(rapports)))\
+        .order_by(models.ProjetGlobal.id)\
+        .all() if rapports else []
+    return {
+        "nb_projets_incomplets": len(projets),
+        "projets": [
+            {"projet_global_id": pid, "projet": nom, "client_id": client_id, **rapports[pid]}
+            for pid, nom, client_id in projets
+        ]
+    }
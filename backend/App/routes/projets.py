@@ -1,10 +1,19 @@
 
-from fastapi import APIRouter, Depends, HTTPException # type: ignore
+from fastapi import APIRouter, Depends, HTTPException, Query # type: ignore
 from sqlalchemy.orm import Session, joinedload # type: ignore
-from sqlalchemy import func # type: ignore
+from sqlalchemy import func, insert, select, update, case # type: ignore
 from App.database import SessionLocal
 from App import models, schemas
-from typing import List, Optional
+from App.completeness import counters_complete, instance_incomplete, projet_global_complet, sous_projet_counters
+from App.configuration_solver import ConfigurationSolver
+from App.pagination import keyset_page
+from App.pricing import chunked
+from App.selections import ITEM_MODELS, remplacement_par_sous_projet, remplacer_item, selections_with_labels, upsert_selections, validate_selections
+from App.write_tracking import mark_changed
+from App.invoice_cache import data_generation
+from config import STATS_CACHE_TTL
+from typing import Any, Dict, List, Optional, Union
+import time
 from collections import defaultdict
 
 router = APIRouter()
@@ -18,12 +27,51 @@ def get_db():
 
 # ========== PROJETS GLOBAUX ==========
 
+def instance_complete(nb_selections: int, nb_groupes_attendus: int) -> bool:
+    return nb_selections >= nb_groupes_attendus if nb_groupes_attendus > 0 else False
+
+def sous_projets_details_query(db: Session, complet: Optional[bool] = None):
+    """
+    (SousProjet, nom du projet global, nom du client, nb_selections, nb_groupes_attendus) en une requête,
+    à partir des compteurs stockés sur les instances (sous-requêtes corrélées, indexées par sous-projet)
+    """
+    nb_selections, nb_groupes_attendus = sous_projet_counters(models.SousProjet.id)
+    query = db.query(
+        models.SousProjet,
+        models.ProjetGlobal.projet,
+        models.Client.nom,
+        nb_selections,
+        nb_groupes_attendus
+    ).outerjoin(
+        models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global
+    ).outerjoin(
+        models.Client, models.Client.id == models.ProjetGlobal.client
+    )
+    if complet is not None:
+        condition = counters_complete(nb_selections, nb_groupes_attendus)
+        query = query.filter(condition if complet else ~condition)
+    return query
 
-@router.get("/projets_globaux/stats", response_model=schemas.ProjetStats)
-def get_projets_stats(db: Session = Depends(get_db)):
-    """Statistiques sur les projets globaux"""
+def sous_projet_details(row) -> dict:
+    sp, projet_global_nom, client_nom, nb_selections, nb_groupes_attendus = row
+    return {
+        "id": sp.id,
+        "nom": sp.nom,
+        "id_global": sp.id_global,
+        "client_nom": client_nom,
+        "projet_global_nom": projet_global_nom,
+        "complet": instance_complete(nb_selections, nb_groupes_attendus),
+        "nb_selections": nb_selections,
+        "nb_groupes_attendus": nb_groupes_attendus,
+    }
+
+
+# Statistiques : (génération des données, expiration, valeur) ; une écriture validée
+# par l'application invalide le cache, la durée couvre les écritures faites hors application
+_stats_cache: Dict[str, Any] = {}
+
+def compute_projets_stats(db: Session) -> schemas.ProjetStats:
     nb_projets_globaux = db.query(models.ProjetGlobal).count()
-    nb_sous_projets = db.query(models.SousProjet).count()
     
     projets_par_client_raw = db.query(
         models.Client.nom,
@@ -33,54 +81,60 @@ def get_projets_stats(db: Session = Depends(get_db)):
     ).group_by(models.Client.nom).all()
     projets_par_client = [schemas.ProjetParClient(client=nom, count=count) for nom, count in projets_par_client_raw]
     
-    sous_projets_complets = 0
-    sous_projets_incomplets = 0
-
-    sous_projets = db.query(models.SousProjet).all()
-    for sp in sous_projets:
-        sp_fpacks = db.query(models.SousProjetFpack).filter_by(sous_projet_id=sp.id).all()
-        
-        if not sp_fpacks:
-            sous_projets_incomplets += 1
-            continue
-        
-        sous_projet_complet = True
-        
-        for sp_fpack in sp_fpacks:
-            nb_selections = db.query(models.ProjetSelection).filter_by(
-                sous_projet_fpack_id=sp_fpack.id
-            ).count()
-            
-            nb_groupes_attendus = db.query(models.FPackConfigColumn).filter(
-                models.FPackConfigColumn.fpack_id == sp_fpack.fpack_id,
-                models.FPackConfigColumn.type == "group"
-            ).count()
-            
-            # Vérifier si ce fpack est complet
-            if nb_groupes_attendus == 0 or nb_selections < nb_groupes_attendus:
-                sous_projet_complet = False
-                break
-        
-        if sous_projet_complet:
-            sous_projets_complets += 1
-        else:
-            sous_projets_incomplets += 1
+    # Un sous-projet est complet s'il a au moins une instance et que chacune a des groupes
+    # attendus, tous sélectionnés : classification sur les compteurs stockés, en une requête
+    nb_incompletes = case((instance_incomplete(models.SousProjetFpack), 1), else_=0)
+    par_sous_projet = select(
+        models.SousProjet.id.label("id"),
+        func.count(models.SousProjetFpack.id).label("nb_fpacks"),
+        func.coalesce(func.sum(nb_incompletes), 0).label("nb_incompletes")
+    ).outerjoin(
+        models.SousProjetFpack, models.SousProjetFpack.sous_projet_id == models.SousProjet.id
+    ).group_by(models.SousProjet.id).subquery()
+    
+    nb_sous_projets, sous_projets_complets = db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(case(
+            ((par_sous_projet.c.nb_fpacks > 0) & (par_sous_projet.c.nb_incompletes == 0), 1),
+            else_=0
+        )), 0)
+    ).select_from(par_sous_projet)).one()
 
     return schemas.ProjetStats(
         nb_projets_globaux=nb_projets_globaux,
         nb_sous_projets=nb_sous_projets,
         projets_par_client=projets_par_client,
         sous_projets_complets=sous_projets_complets,
-        sous_projets_incomplets=sous_projets_incomplets
+        sous_projets_incomplets=nb_sous_projets - sous_projets_complets
     )
 
+@router.get("/projets_globaux/stats", response_model=schemas.ProjetStats)
+def get_projets_stats(db: Session = Depends(get_db)):
+    """Statistiques sur les projets globaux"""
+    generation = data_generation()
+    cached = _stats_cache.get("stats")
+    if cached is not None and cached[0] == generation and cached[1] > time.monotonic():
+        return cached[2]
+    
+    stats = compute_projets_stats(db)
+    if STATS_CACHE_TTL > 0:
+        _stats_cache["stats"] = (generation, time.monotonic() + STATS_CACHE_TTL, stats)
+    return stats
+
 
-@router.get("/projets_globaux", response_model=List[schemas.ProjetGlobalReadWithSousProjets])
+@router.get("/projets_globaux", response_model=Union[List[schemas.ProjetGlobalReadWithSousProjets], schemas.ProjetGlobalPage])
 def list_projets_globaux(
     client_id: Optional[int] = None,
+    nom: Optional[str] = Query(None, description="Début du nom du projet"),
+    complet: Optional[bool] = None,
+    after: Optional[int] = Query(None, description="id du dernier projet de la page précédente"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Taille de page ; sans limite, liste complète"),
     db: Session = Depends(get_db)
 ):
-    """Liste tous les projets globaux avec leurs sous-projets"""
+    """
+    Liste les projets globaux avec leurs sous-projets. Avec limit, renvoie une page
+    {items, next_cursor} ; la page suivante s'obtient avec after=next_cursor.
+    """
     query = db.query(models.ProjetGlobal).options(
         joinedload(models.ProjetGlobal.projets).joinedload(models.SousProjet.fpacks).joinedload(models.SousProjetFpack.fpack),
         joinedload(models.ProjetGlobal.client_rel)
@@ -89,7 +143,14 @@ def list_projets_globaux(
     if client_id:
         query = query.filter(models.ProjetGlobal.client == client_id)
     
-    projets = query.all()
+    if nom:
+        query = query.filter(models.ProjetGlobal.projet.startswith(nom, autoescape=True))
+    
+    if complet is not None:
+        condition = projet_global_complet(models.ProjetGlobal.id)
+        query = query.filter(condition if complet else ~condition)
+    
+    projets, has_more = keyset_page(query, models.ProjetGlobal.id, after, limit)
     
     result = []
     for projet in projets:
@@ -104,13 +165,8 @@ def list_projets_globaux(
                 
                 for sp_fpack in sp_fpacks:
                     fpack_nom = sp_fpack.fpack.nom if sp_fpack.fpack else None
-                    nb_selections_fpack = db.query(models.ProjetSelection).filter(
-                        models.ProjetSelection.sous_projet_fpack_id == sp_fpack.id
-                    ).count()
-                    nb_groupes_attendus_fpack = db.query(models.FPackConfigColumn).filter(
-                        models.FPackConfigColumn.fpack_id == sp_fpack.fpack_id,
-                        models.FPackConfigColumn.type == "group"
-                    ).count()
+                    nb_selections_fpack = sp_fpack.nb_selections
+                    nb_groupes_attendus_fpack = sp_fpack.nb_groupes_attendus
 
                     total_selections += nb_selections_fpack
                     total_groupes_attendus += nb_groupes_attendus_fpack
@@ -127,10 +183,10 @@ def list_projets_globaux(
                         "tracking": sp_fpack.tracking,
                         "nb_selections": nb_selections_fpack,
                         "nb_groupes_attendus": nb_groupes_attendus_fpack,
-                        "complet": nb_selections_fpack >= nb_groupes_attendus_fpack if nb_groupes_attendus_fpack > 0 else False
+                        "complet": instance_complete(nb_selections_fpack, nb_groupes_attendus_fpack)
                     })
                 
-                complet = all(fpack["complet"] for fpack in fpacks_array) if fpacks_array else False
+                est_complet = all(fpack["complet"] for fpack in fpacks_array) if fpacks_array else False
                 
                 sous_projets_details.append({
                     "id": sp.id,
@@ -138,7 +194,7 @@ def list_projets_globaux(
                     "id_global": sp.id_global,
                     "client_nom": projet.client_rel.nom if projet.client_rel else None,
                     "projet_global_nom": projet.projet,
-                    "complet": complet,
+                    "complet": est_complet,
                     "nb_selections": total_selections,
                     "nb_groupes_attendus": total_groupes_attendus,
                     "fpacks": fpacks_array,  
@@ -164,45 +220,26 @@ def list_projets_globaux(
             "client_nom": projet.client_rel.nom if projet.client_rel else None
         })
     
-    return result
+    if limit is None:
+        return result
+    return {"items": result, "next_cursor": projets[-1].id if has_more else None}
 
 @router.get("/projets_globaux/{id}", response_model=schemas.ProjetGlobalReadWithSousProjets)
 def get_projet_global(id: int, db: Session = Depends(get_db)):
     """Récupère un projet global par son ID avec ses sous-projets"""
     projet = db.query(models.ProjetGlobal).options(
-        joinedload(models.ProjetGlobal.projets),
         joinedload(models.ProjetGlobal.client_rel)
     ).get(id)
     
     if not projet:
         raise HTTPException(status_code=404, detail="Projet global non trouvé")
     
-    sous_projets_details = []
-    for sp in projet.projets:
-        sp_fpack = db.query(models.SousProjetFpack).filter_by(sous_projet_id=sp.id).first()
-        
-        nb_selections = db.query(models.ProjetSelection).join(
-            models.SousProjetFpack, 
-            models.ProjetSelection.sous_projet_fpack_id == models.SousProjetFpack.id
-        ).filter(models.SousProjetFpack.sous_projet_id == sp.id).count()
-        
-        nb_groupes_attendus = 0
-        if sp_fpack:
-            nb_groupes_attendus = db.query(models.FPackConfigColumn).filter(
-                models.FPackConfigColumn.fpack_id == sp_fpack.fpack_id,
-                models.FPackConfigColumn.type == "group"
-            ).count()
-        
-        sous_projets_details.append({
-            "id": sp.id,
-            "nom": sp.nom,
-            "id_global": sp.id_global,
-            "client_nom": projet.client_rel.nom if projet.client_rel else None,
-            "projet_global_nom": projet.projet,
-            "complet": nb_selections >= nb_groupes_attendus if nb_groupes_attendus > 0 else False,
-            "nb_selections": nb_selections,
-            "nb_groupes_attendus": nb_groupes_attendus,
-        })
+    sous_projets_details = [
+        sous_projet_details(row)
+        for row in sous_projets_details_query(db).filter(
+            models.SousProjet.id_global == id
+        ).order_by(models.SousProjet.id).all()
+    ]
     
     return {
         "id": projet.id,
@@ -364,14 +401,21 @@ def delete_sous_projet_cascade_bulk(sous_projet_id: int, db: Session):
 
 # ========== SOUS-PROJETS ==========
 
-@router.get("/sous_projets", response_model=List[schemas.SousProjetReadWithDetails])
+@router.get("/sous_projets", response_model=Union[List[schemas.SousProjetReadWithDetails], schemas.SousProjetPage])
 def list_sous_projets(
     projet_global_id: Optional[int] = None,
     client_id: Optional[int] = None,
+    nom: Optional[str] = Query(None, description="Début du nom du sous-projet"),
+    complet: Optional[bool] = None,
+    after: Optional[int] = Query(None, description="id du dernier sous-projet de la page précédente"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Taille de page ; sans limite, liste complète"),
     db: Session = Depends(get_db)
 ):
-    """Liste tous les sous-projets avec filtres optionnels"""
-    query = db.query(models.SousProjet).join(models.ProjetGlobal)
+    """
+    Liste les sous-projets avec filtres optionnels. Avec limit, renvoie une page
+    {items, next_cursor} ; la page suivante s'obtient avec after=next_cursor.
+    """
+    query = sous_projets_details_query(db, complet)
     
     if projet_global_id:
         query = query.filter(models.SousProjet.id_global == projet_global_id)
@@ -379,79 +423,33 @@ def list_sous_projets(
     if client_id:
         query = query.filter(models.ProjetGlobal.client == client_id)
     
-    sous_projets = query.all()
+    if nom:
+        query = query.filter(models.SousProjet.nom.startswith(nom, autoescape=True))
     
-    result = []
-    for sp in sous_projets:
-        projet_global = db.query(models.ProjetGlobal).get(sp.id_global)
-        client = db.query(models.Client).get(projet_global.client) if projet_global else None
-        
-        sp_fpack = db.query(models.SousProjetFpack).filter_by(sous_projet_id=sp.id).first()
-        
-        nb_selections = db.query(models.ProjetSelection).join(
-            models.SousProjetFpack, 
-            models.ProjetSelection.sous_projet_fpack_id == models.SousProjetFpack.id
-        ).filter(models.SousProjetFpack.sous_projet_id == sp.id).count()
-        
-        nb_groupes_attendus = 0
-        if sp_fpack:
-            nb_groupes_attendus = db.query(models.FPackConfigColumn).filter(
-                models.FPackConfigColumn.fpack_id == sp_fpack.fpack_id,
-                models.FPackConfigColumn.type == "group"
-            ).count()
-        
-        result.append({
-            "id": sp.id,
-            "nom": sp.nom,
-            "id_global": sp.id_global,
-            "client_nom": client.nom if client else None,
-            "projet_global_nom": projet_global.projet if projet_global else None,
-            "complet": nb_selections >= nb_groupes_attendus if nb_groupes_attendus > 0 else False,
-            "nb_selections": nb_selections,
-            "nb_groupes_attendus": nb_groupes_attendus,
-        })
-    
-    return result
+    rows, has_more = keyset_page(query, models.SousProjet.id, after, limit)
+    items = [sous_projet_details(row) for row in rows]
+    if limit is None:
+        return items
+    return {"items": items, "next_cursor": rows[-1][0].id if has_more else None}
 
 @router.get("/projets_globaux/{projet_id}/sous_projets", response_model=List[schemas.SousProjetReadWithDetails])
 def list_sous_projets_by_projet(projet_id: int, db: Session = Depends(get_db)):
     """Liste tous les sous-projets d'un projet global"""
-    return list_sous_projets(projet_global_id=projet_id, db=db)
+    return [
+        sous_projet_details(row)
+        for row in sous_projets_details_query(db).filter(
+            models.SousProjet.id_global == projet_id
+        ).order_by(models.SousProjet.id).all()
+    ]
 
 @router.get("/sous_projets/{id}", response_model=schemas.SousProjetReadWithDetails)
 def get_sous_projet(id: int, db: Session = Depends(get_db)):
     """Récupère un sous-projet par son ID"""
-    sp = db.query(models.SousProjet).get(id)
-    if not sp:
+    row = sous_projets_details_query(db).filter(models.SousProjet.id == id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
     
-    projet_global = db.query(models.ProjetGlobal).get(sp.id_global)
-    client = db.query(models.Client).get(projet_global.client) if projet_global else None
-    
-    sp_fpack = db.query(models.SousProjetFpack).filter_by(sous_projet_id=sp.id).first()
-    
-    nb_selections = db.query(models.ProjetSelection).join(
-        models.SousProjetFpack, 
-        models.ProjetSelection.sous_projet_fpack_id == models.SousProjetFpack.id
-    ).filter(models.SousProjetFpack.sous_projet_id == sp.id).count()
-    
-    nb_groupes_attendus = 0
-    if sp_fpack:
-        nb_groupes_attendus = db.query(models.FPackConfigColumn).filter(
-            models.FPackConfigColumn.fpack_id == sp_fpack.fpack_id,
-            models.FPackConfigColumn.type == "group"
-        ).count()
-    
-    return {
-        "id": sp.id,
-        "nom": sp.nom,
-        "id_global": sp.id_global,
-        "client_nom": client.nom if client else None,
-        "projet_global_nom": projet_global.projet if projet_global else None,
-        "complet": nb_selections >= nb_groupes_attendus if nb_groupes_attendus > 0 else False,
-        "nb_selections": nb_selections,
-        "nb_groupes_attendus": nb_groupes_attendus,
-    }
+    return sous_projet_details(row)
 
 @router.post("/sous_projets", response_model=schemas.SousProjetRead)
 def create_sous_projet(sous_projet: schemas.SousProjetCreate, db: Session = Depends(get_db)):
@@ -466,6 +464,89 @@ def create_sous_projet(sous_projet: schemas.SousProjetCreate, db: Session = Depe
     db.refresh(db_sous_projet)
     return db_sous_projet
 
+def insert_instances(db: Session, rows: List[dict]) -> List[int]:
+    """Insère des instances F-Pack en une instruction multi-lignes ; ids renvoyés dans l'ordre des lignes"""
+    if not rows:
+        return []
+    instances = models.SousProjetFpack.__table__
+    return db.execute(
+        insert(instances).returning(instances.c.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+
+def clone_sous_projet_bulk(source: models.SousProjet, id_global: int, nom: str, db: Session) -> dict:
+    """
+    Copie un sous-projet, ses instances F-Pack (compteurs compris) et leurs sélections,
+    sans commit : une insertion multi-lignes pour les instances puis des insertions
+    multi-lignes pour les sélections
+    """
+    instances = models.SousProjetFpack.__table__
+    selections = models.ProjetSelection.__table__
+    
+    copie = models.SousProjet(nom=nom, id_global=id_global)
+    db.add(copie)
+    db.flush()
+    
+    colonnes = [c for c in instances.c if c.name not in ("id", "sous_projet_id")]
+    sources = db.execute(
+        select(instances.c.id, *colonnes)
+        .where(instances.c.sous_projet_id == source.id)
+        .order_by(instances.c.id)
+    ).all()
+    
+    nouveaux = insert_instances(
+        db, [{"sous_projet_id": copie.id, **{c.name: row._mapping[c.name] for c in colonnes}} for row in sources]
+    )
+    nouveaux_ids = {row.id: nouveau for row, nouveau in zip(sources, nouveaux)}
+    
+    nb_selections = 0
+    for chunk in chunked(list(nouveaux_ids)):
+        lignes = [
+            {
+                "sous_projet_fpack_id": nouveaux_ids[spf_id],
+                "groupe_id": groupe_id,
+                "type_item": type_item,
+                "ref_id": ref_id
+            }
+            for spf_id, groupe_id, type_item, ref_id in db.execute(
+                select(selections.c.sous_projet_fpack_id, selections.c.groupe_id, selections.c.type_item, selections.c.ref_id)
+                .where(selections.c.sous_projet_fpack_id.in_(chunk))
+            ).all()
+        ]
+        if lignes:
+            db.execute(insert(selections), lignes)
+            nb_selections += len(lignes)
+    
+    return {
+        "id": copie.id,
+        "nom": copie.nom,
+        "id_global": copie.id_global,
+        "nb_fpacks_copies": len(nouveaux_ids),
+        "nb_selections_copiees": nb_selections
+    }
+
+@router.post("/sous_projets/{id}/clone")
+def clone_sous_projet(id: int, options: Optional[schemas.SousProjetClone] = None, db: Session = Depends(get_db)):
+    """Copie un sous-projet avec ses F-Packs et leurs sélections, éventuellement dans un autre projet global"""
+    source = db.query(models.SousProjet).get(id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
+    
+    options = options or schemas.SousProjetClone()
+    id_global = options.id_global if options.id_global is not None else source.id_global
+    if options.id_global is not None and not db.query(models.ProjetGlobal.id).filter(models.ProjetGlobal.id == id_global).first():
+        raise HTTPException(status_code=400, detail="Projet global non trouvé")
+    
+    resultat = clone_sous_projet_bulk(source, id_global, options.nom or f"{source.nom} (copie)", db)
+    
+    db.commit()
+    
+    return {
+        "ok": True,
+        **resultat,
+        "message": f"Sous-projet copié avec {resultat['nb_fpacks_copies']} FPack(s) et {resultat['nb_selections_copiees']} sélection(s)"
+    }
+
 @router.put("/sous_projets/{id}", response_model=schemas.SousProjetRead)
 def update_sous_projet(id: int, sous_projet: schemas.SousProjetCreate, db: Session = Depends(get_db)):
     """Met à jour un sous-projet"""
@@ -535,6 +616,48 @@ def add_fpack_to_sous_projet(
     db.refresh(db_association)
     return db_association
 
+@router.post("/sous_projets/{sous_projet_id}/fpacks:bulk")
+def add_fpacks_to_sous_projet_bulk(
+    sous_projet_id: int,
+    data: schemas.SousProjetFpackBulkCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Crée en une fois plusieurs instances d'un template F-Pack (une par ligne), avec
+    éventuellement les mêmes sélections de groupes pour toutes ; renvoie les ids créés
+    """
+    if not db.query(models.SousProjet.id).filter(models.SousProjet.id == sous_projet_id).first():
+        raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
+    
+    if not db.query(models.FPack.id).filter(models.FPack.id == data.fpack_id).first():
+        raise HTTPException(status_code=400, detail="FPack non trouvé")
+    
+    validate_selections(db, data.selections)
+    
+    ids = insert_instances(db, [
+        {"sous_projet_id": sous_projet_id, "fpack_id": data.fpack_id, **row.dict()}
+        for row in data.instances
+    ])
+    
+    selections = [
+        {"sous_projet_fpack_id": spf_id, **selection.dict()}
+        for spf_id in ids
+        for selection in data.selections
+    ]
+    if selections:
+        db.execute(insert(models.ProjetSelection.__table__), selections)
+    
+    # Instances insérées hors flush : compteurs de complétude calculés au commit
+    mark_changed(db, "sous_projet_fpack", ids)
+    db.commit()
+    
+    return {
+        "ok": True,
+        "ids": ids,
+        "nb_selections": len(selections),
+        "message": f"{len(ids)} FPack(s) créé(s) avec {len(selections)} sélection(s)"
+    }
+
 @router.put("/sous_projets/{sous_projet_id}/fpacks/{fpack_id}", response_model=schemas.SousProjetFpackRead)
 def update_fpack_association(
     sous_projet_id: int,
@@ -602,32 +725,7 @@ def get_selections_by_fpack(sous_projet_id: int, fpack_id: int, db: Session = De
         sous_projet_fpack_id=association.id
     ).all()
     
-    result = []
-    for sel in selections:
-        groupe = db.query(models.Groupes).get(sel.groupe_id)
-        groupe_nom = groupe.nom if groupe else None
-        
-        item_nom = None
-        if sel.type_item == "produit":
-            produit = db.query(models.Produit).get(sel.ref_id)
-            item_nom = produit.nom if produit else None
-        elif sel.type_item == "equipement":
-            equipement = db.query(models.Equipements).get(sel.ref_id)
-            item_nom = equipement.nom if equipement else None
-        elif sel.type_item == "robot":
-            robot = db.query(models.Robots).get(sel.ref_id)
-            item_nom = robot.nom if robot else None
-        
-        result.append({
-            "sous_projet_fpack_id": sel.sous_projet_fpack_id,
-            "groupe_id": sel.groupe_id,
-            "type_item": sel.type_item,
-            "ref_id": sel.ref_id,
-            "groupe_nom": groupe_nom,
-            "item_nom": item_nom
-        })
-    
-    return result
+    return selections_with_labels(db, selections)
 
 @router.post("/sous_projets/{sous_projet_id}/fpacks/{fpack_id}/selections", response_model=schemas.ProjetSelectionRead)
 def create_selection(
@@ -758,31 +856,7 @@ def get_selections_by_sous_projet_fpack_id(sous_projet_fpack_id: int, db: Sessio
         sous_projet_fpack_id=sous_projet_fpack_id
     ).all()
     
-    result = []
-    for sel in selections:
-        groupe = db.query(models.Groupes).get(sel.groupe_id)
-        groupe_nom = groupe.nom if groupe else None
-        item_nom = None
-        if sel.type_item == "produit":
-            produit = db.query(models.Produit).get(sel.ref_id)
-            item_nom = produit.nom if produit else None
-        elif sel.type_item == "equipement":
-            equipement = db.query(models.Equipements).get(sel.ref_id)
-            item_nom = equipement.nom if equipement else None
-        elif sel.type_item == "robot":
-            robot = db.query(models.Robots).get(sel.ref_id)
-            item_nom = robot.nom if robot else None
-        
-        result.append({
-            "sous_projet_fpack_id": sel.sous_projet_fpack_id,
-            "groupe_id": sel.groupe_id,
-            "type_item": sel.type_item,
-            "ref_id": sel.ref_id,
-            "groupe_nom": groupe_nom,
-            "item_nom": item_nom
-        })
-    
-    return result
+    return selections_with_labels(db, selections)
 
 @router.post("/sous_projet_fpack/{sous_projet_fpack_id}/selections", response_model=schemas.ProjetSelectionRead)
 def create_selection_by_sous_projet_fpack_id(
@@ -870,6 +944,26 @@ def update_selection_by_sous_projet_fpack_id(
     return selection
 
 
+@router.put("/sous_projet_fpack/{sous_projet_fpack_id}/selections:bulk", response_model=List[schemas.ProjetSelectionRead])
+def upsert_selections_by_sous_projet_fpack_id(
+    sous_projet_fpack_id: int,
+    selections: List[schemas.ProjetSelectionCreate],
+    db: Session = Depends(get_db)
+):
+    """
+    Enregistre en une fois le choix groupe -> item de plusieurs groupes (création ou
+    remplacement) ; les groupes absents de la liste ne sont pas modifiés
+    """
+    association = db.query(models.SousProjetFpack.id).filter(models.SousProjetFpack.id == sous_projet_fpack_id).first()
+    if not association:
+        raise HTTPException(status_code=404, detail="Association sous-projet/FPack non trouvée")
+    
+    validate_selections(db, selections)
+    rows = upsert_selections(db, sous_projet_fpack_id, selections)
+    db.commit()
+    return rows
+
+
 @router.delete("/sous_projet_fpack/{sous_projet_fpack_id}/selections/{groupe_id}")
 def delete_selection_by_sous_projet_fpack_id(sous_projet_fpack_id: int, groupe_id: int, db: Session = Depends(get_db)):
     """Supprime une sélection pour une association sous_projet_fpack"""
@@ -889,6 +983,124 @@ def delete_selection_by_sous_projet_fpack_id(sous_projet_fpack_id: int, groupe_i
     db.commit()
     return {"ok": True}
 
+@router.post("/selections/remplacer")
+def remplacer_item_selections(
+    remplacement: schemas.SelectionRemplacement,
+    appliquer: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Remplace un item par un autre dans les sélections d'un projet global, d'un client ou de
+    toute la base. Sans appliquer, renvoie seulement les sélections concernées par sous-projet.
+    Les sélections dont le groupe ne propose pas le nouvel item ne sont pas modifiées.
+    """
+    for type_item in (remplacement.type_item, remplacement.nouveau_type_item):
+        if type_item not in ITEM_MODELS:
+            raise HTTPException(status_code=400, detail=f"Type d'item invalide: {type_item}")
+    if (remplacement.type_item, remplacement.ref_id) == (remplacement.nouveau_type_item, remplacement.nouveau_ref_id):
+        raise HTTPException(status_code=400, detail="L'item de remplacement est identique à l'item remplacé")
+    
+    nouveau_model = ITEM_MODELS[remplacement.nouveau_type_item]
+    if not db.query(nouveau_model.id).filter(nouveau_model.id == remplacement.nouveau_ref_id).first():
+        raise HTTPException(status_code=400, detail=f"{remplacement.nouveau_type_item.capitalize()} non trouvé")
+    if remplacement.projet_global_id is not None and not db.query(models.ProjetGlobal.id).filter(models.ProjetGlobal.id == remplacement.projet_global_id).first():
+        raise HTTPException(status_code=404, detail="Projet global non trouvé")
+    if remplacement.client_id is not None and not db.query(models.Client.id).filter(models.Client.id == remplacement.client_id).first():
+        raise HTTPException(status_code=404, detail="Client non trouvé")
+    
+    sous_projets = remplacement_par_sous_projet(db, remplacement)
+    resultat = {
+        "applique": appliquer,
+        "nb_remplacables": sum(sp["nb_remplacables"] for sp in sous_projets),
+        "nb_hors_groupe": sum(sp["nb_hors_groupe"] for sp in sous_projets),
+        "sous_projets": sous_projets
+    }
+    
+    if appliquer:
+        resultat["nb_remplacees"] = remplacer_item(db, remplacement)
+        db.commit()
+    
+    return resultat
+
+
+@router.post("/sous_projet_fpack/{sous_projet_fpack_id}/optimize")
+def optimize_sous_projet_fpack(
+    sous_projet_fpack_id: int,
+    appliquer: bool = False,
+    inclure_sans_prix: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Propose pour chaque groupe non sélectionné l'option la moins chère pour le client,
+    en respectant les incompatibilités produits et les compatibilités robot/produit.
+    appliquer=true enregistre les sélections proposées.
+    """
+    resultat = ConfigurationSolver(db, sous_projet_fpack_id, inclure_sans_prix).solve()
+    
+    if appliquer and resultat["selections"]:
+        db.add_all(
+            models.ProjetSelection(
+                sous_projet_fpack_id=sous_projet_fpack_id,
+                groupe_id=selection["groupe_id"],
+                type_item=selection["type_item"],
+                ref_id=selection["ref_id"]
+            )
+            for selection in resultat["selections"]
+        )
+        db.commit()
+    
+    resultat["applique"] = appliquer
+    return resultat
+
+
+@router.patch("/sous_projet_fpack:bulk")
+def patch_sous_projet_fpacks_bulk(patch: schemas.SousProjetFpackBulkPatch, db: Session = Depends(get_db)):
+    """
+    Modifie les mêmes champs sur toutes les instances du filtre (ids, sous-projet et/ou
+    projet global), en UPDATE ... WHERE sans charger les instances ; renvoie le nombre modifié.
+    404 si des ids demandés n'existent pas (aucune instance n'est alors modifiée)
+    """
+    filtre = patch.filtre
+    champs = patch.champs.dict(exclude_none=True)
+    if not champs:
+        raise HTTPException(status_code=400, detail="Aucun champ à modifier")
+    if filtre.ids is None and filtre.sous_projet_id is None and filtre.projet_global_id is None:
+        raise HTTPException(status_code=400, detail="Filtre requis : ids, sous_projet_id ou projet_global_id")
+    
+    instances = models.SousProjetFpack.__table__
+    conditions = []
+    if filtre.sous_projet_id is not None:
+        conditions.append(instances.c.sous_projet_id == filtre.sous_projet_id)
+    if filtre.projet_global_id is not None:
+        conditions.append(instances.c.sous_projet_id.in_(
+            select(models.SousProjet.id).where(models.SousProjet.id_global == filtre.projet_global_id)
+        ))
+    
+    if filtre.ids is None:
+        ids = [spf_id for (spf_id,) in db.execute(select(instances.c.id).where(*conditions))]
+    else:
+        demandes = sorted(set(filtre.ids))
+        existants = set()
+        for chunk in chunked(demandes):
+            existants.update(spf_id for (spf_id,) in db.execute(select(instances.c.id).where(instances.c.id.in_(chunk))))
+        manquants = [spf_id for spf_id in demandes if spf_id not in existants]
+        if manquants:
+            raise HTTPException(status_code=404, detail=f"Instances F-Pack non trouvées: {manquants}")
+        ids = demandes
+        if conditions:
+            ids = [
+                spf_id
+                for chunk in chunked(demandes)
+                for (spf_id,) in db.execute(select(instances.c.id).where(instances.c.id.in_(chunk), *conditions))
+            ]
+    
+    statement = update(instances).values(**champs)
+    for chunk in chunked(ids):
+        db.execute(statement.where(instances.c.id.in_(chunk)))
+    db.commit()
+    
+    return {"ok": True, "nb_modifies": len(ids)}
+
 @router.delete("/sous_projet_fpack/{fpack_association_id}")
 def remove_fpack_association(fpack_association_id: int, db: Session = Depends(get_db)):
     """Supprime une association sous-projet/FPack par son ID et toutes ses sélections en cascade (optimisé)"""
@@ -929,167 +1141,3 @@ def delete_fpack_association_cascade_bulk(association_id: int, db: Session):
     ).delete(synchronize_session=False)
     
     return nb_selections
-
-@router.get("/sous_projet_fpack/{sous_projet_fpack_id}/facture")
-def get_sous_projet_fpack_facture(sous_projet_fpack_id: int, db: Session = Depends(get_db)):
-    """Génère la facture d'une association sous_projet_fpack spécifique"""
-    
-    sp_fpack = db.query(models.SousProjetFpack).get(sous_projet_fpack_id)
-    if not sp_fpack:
-        raise HTTPException(status_code=404, detail="Association sous-projet/FPack non trouvée")
-    
-    sous_projet = db.query(models.SousProjet).get(sp_fpack.sous_projet_id)
-    if not sous_projet:
-        raise HTTPException(status_code=404, detail="Sous-projet non trouvé")
-    
-    projet_global = db.query(models.ProjetGlobal).get(sous_projet.id_global)
-    client_id = projet_global.client if projet_global else None
-    
-    if not client_id:
-        raise HTTPException(status_code=400, detail="Client non trouvé pour ce projet")
-    
-    fpack = db.query(models.FPack).get(sp_fpack.fpack_id)
-    
-    config_cols = db.query(models.FPackConfigColumn)\
-        .filter_by(fpack_id=sp_fpack.fpack_id)\
-        .order_by(models.FPackConfigColumn.ordre)\
-        .all()
-    
-    sels = db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=sous_projet_fpack_id).all()
-    sel_map = {s.groupe_id: {"type": s.type_item, "ref_id": s.ref_id} for s in sels}
-
-    eq_prods = db.query(models.Equipement_Produit).all()
-    eq_map = {}
-    for ep in eq_prods:
-        eq_map.setdefault(ep.equipement_id, []).append((ep.produit_id, ep.quantite))
-
-    produit_counts = defaultdict(int)
-    robot_counts = defaultdict(int)
-
-    for col in config_cols:
-        if col.type == "produit":
-            produit_counts[col.ref_id] += 1
-        elif col.type == "equipement":
-            for pid, qte in eq_map.get(col.ref_id, []):
-                produit_counts[pid] += qte
-        elif col.type == "group":
-            chosen = sel_map.get(col.ref_id)
-            if not chosen:
-                continue
-                
-            if chosen["type"] == "produit":
-                produit_counts[chosen["ref_id"]] += 1
-            elif chosen["type"] == "equipement":
-                for pid, qte in eq_map.get(chosen["ref_id"], []):
-                    produit_counts[pid] += qte
-            elif chosen["type"] == "robot":
-                robot_counts[chosen["ref_id"]] += 1
-
-    all_produit_ids = list(produit_counts.keys())
-    
-    prix_rows = db.query(models.Prix)\
-        .filter(
-            models.Prix.client_id == client_id,
-            models.Prix.produit_id.in_(all_produit_ids)
-        ).all() if all_produit_ids else []
-    
-    prix_map = {p.produit_id: p for p in prix_rows}
-    
-    prix_robot_rows = db.query(models.PrixRobot)\
-        .join(models.Robots, models.Robots.id == models.PrixRobot.id).filter(
-            models.Robots.client == client_id,
-            models.PrixRobot.id.in_(robot_counts.keys())
-        ).all() if robot_counts else []
-    
-    prix_robot_map = {p.id: p for p in prix_robot_rows}
-
-    produits_rows = db.query(models.Produit).filter(models.Produit.id.in_(all_produit_ids)).all() if all_produit_ids else []
-    produit_nom_map = {p.id: p.nom for p in produits_rows}
-
-    robot_rows = db.query(models.Robots).filter(models.Robots.id.in_(robot_counts.keys())).all() if robot_counts else []
-    robot_nom_map = {r.id: r.nom for r in robot_rows}
-
-    # Construction des lignes
-    lines = []
-    total_produit = 0.00
-    total_transport = 0.00
-
-    # Lignes produits
-    for pid in sorted(all_produit_ids):
-        qte = produit_counts[pid]
-        p_rec = prix_map.get(pid)
-        prix_prod = float(p_rec.prix_produit) if p_rec else 0.0
-        prix_tr = float(p_rec.prix_transport) if p_rec else 0.0
-        commentaire = p_rec.commentaire if p_rec else None
-
-        total_ligne = qte * (prix_prod + prix_tr)
-        total_produit += qte * prix_prod
-        total_transport += qte * prix_tr
-
-        lines.append({
-            "type": "produit",
-            "produit_id": pid,
-            "nom": produit_nom_map.get(pid, f"Produit {pid}"),
-            "qte": qte,
-            "prix_unitaire": prix_prod,
-            "prix_transport": prix_tr,
-            "commentaire": commentaire,
-            "total_ligne": total_ligne
-        })
-
-    # Lignes robots
-    for rid in sorted(robot_counts.keys()):
-        qte = robot_counts[rid]
-        pr = prix_robot_map.get(rid)
-        prix_rob = float(pr.prix_robot) if pr else 0.0
-        prix_tr = float(pr.prix_transport) if pr else 0.0
-        commentaire = pr.commentaire if pr else None
-
-        total_ligne = qte * (prix_rob + prix_tr)
-        total_produit += qte * prix_rob
-        total_transport += qte * prix_tr
-
-        lines.append({
-            "type": "robot",
-            "produit_id": rid,
-            "nom": robot_nom_map.get(rid, f"Robot {rid}"),
-            "qte": qte,
-            "prix_unitaire": prix_rob,
-            "prix_transport": prix_tr,
-            "commentaire": commentaire,
-            "total_ligne": total_ligne
-        })
-
-    return {
-        "sous_projet_fpack_id": sous_projet_fpack_id,
-        "sous_projet_id": sous_projet.id,
-        "nom_sous_projet": sous_projet.nom,
-        "projet_global": {
-            "id": projet_global.id,
-            "nom": projet_global.projet,
-        } if projet_global else None,
-        "client_id": client_id,
-        "fpack": {
-            "id": fpack.id,
-            "nom": fpack.nom,
-            "abbr": fpack.fpack_abbr,
-            "FPack_number": sp_fpack.FPack_number,
-            "Robot_Location_Code": sp_fpack.Robot_Location_Code,
-            "contractor": sp_fpack.contractor,
-            "required_delivery_time": sp_fpack.required_delivery_time,
-            "delivery_site": sp_fpack.delivery_site,
-            "tracking": sp_fpack.tracking
-        } if fpack else None,
-        "currency": "EUR",
-        "lines": lines,
-        "totaux": {
-            "produit": round(total_produit, 2),
-            "transport": round(total_transport, 2),
-            "global": round(total_produit + total_transport, 2)
-        },
-        "resume": {
-            "nb_lignes": len(lines),
-            "nb_produits": len([l for l in lines if l["type"] == "produit"]),
-            "nb_robots": len([l for l in lines if l["type"] == "robot"])
-        }
-    }
\ No newline at end of file
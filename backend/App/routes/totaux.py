@@ -0,0 +1,116 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException # type: ignore
+from sqlalchemy.exc import SQLAlchemyError # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App.database import SessionLocal
+from App import models
+from App.rollups import rebuild_rollups
+
+router = APIRouter()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def totaux(rollup) -> dict:
+    return {
+        "produit": rollup.total_produit or 0,
+        "transport": rollup.total_transport or 0,
+        "global": rollup.total_global or 0
+    }
+
+
+@router.get("/totaux/projets_globaux")
+def list_totaux_projets_globaux(client_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Totaux de tous les projets globaux, lus dans la table matérialisée en une requête
+    (rafraîchie en tâche de fond, voir App.rollups)
+    """
+    rollup = models.RollupProjetGlobal
+    query = db.query(
+        models.ProjetGlobal.id,
+        models.ProjetGlobal.projet,
+        models.ProjetGlobal.client,
+        models.Client.nom,
+        rollup.nb_sous_projets,
+        rollup.nb_fpacks,
+        rollup.total_produit,
+        rollup.total_transport,
+        rollup.total_global,
+        rollup.nb_lignes_sans_prix,
+        rollup.updated_at
+    ).outerjoin(
+        models.Client, models.Client.id == models.ProjetGlobal.client
+    ).outerjoin(
+        rollup, rollup.projet_global_id == models.ProjetGlobal.id
+    )
+    if client_id is not None:
+        query = query.filter(models.ProjetGlobal.client == client_id)
+
+    return [
+        {
+            "projet_global_id": row.id,
+            "projet": row.projet,
+            "client_id": row.client,
+            "client_nom": row.nom,
+            "nb_sous_projets": row.nb_sous_projets or 0,
+            "nb_fpacks": row.nb_fpacks or 0,
+            "currency": "EUR",
+            "totaux": totaux(row),
+            "nb_lignes_sans_prix": row.nb_lignes_sans_prix or 0,
+            "calcule_le": row.updated_at
+        }
+        for row in query.order_by(models.ProjetGlobal.id).all()
+    ]
+
+
+@router.get("/totaux/projets_globaux/{projet_global_id}/sous_projets")
+def list_totaux_sous_projets(projet_global_id: int, db: Session = Depends(get_db)):
+    """Totaux des sous-projets d'un projet global"""
+    if not db.query(models.ProjetGlobal.id).filter(models.ProjetGlobal.id == projet_global_id).first():
+        raise HTTPException(status_code=404, detail="Projet global non trouvé")
+
+    rollup = models.RollupSousProjet
+    rows = db.query(
+        models.SousProjet.id,
+        models.SousProjet.nom,
+        rollup.nb_fpacks,
+        rollup.total_produit,
+        rollup.total_transport,
+        rollup.total_global,
+        rollup.nb_lignes_sans_prix,
+        rollup.updated_at
+    ).outerjoin(
+        rollup, rollup.sous_projet_id == models.SousProjet.id
+    ).filter(
+        models.SousProjet.id_global == projet_global_id
+    ).order_by(models.SousProjet.id).all()
+
+    return [
+        {
+            "sous_projet_id": row.id,
+            "nom": row.nom,
+            "nb_fpacks": row.nb_fpacks or 0,
+            "currency": "EUR",
+            "totaux": totaux(row),
+            "nb_lignes_sans_prix": row.nb_lignes_sans_prix or 0,
+            "calcule_le": row.updated_at
+        }
+        for row in rows
+    ]
+
+
+@router.post("/totaux/reconstruire")
+def reconstruire_totaux(db: Session = Depends(get_db)):
+    """Reconstruit entièrement les totaux matérialisés (après une modification hors application)"""
+    try:
+        resultat = rebuild_rollups(db)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la reconstruction des totaux: {str(e)}")
+    return {"ok": True, **resultat}
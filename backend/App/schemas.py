@@ -246,6 +246,11 @@ class SousProjetRead(SousProjetBase):
     class Config:
         from_attributes = True
         
+class SousProjetClone(BaseModel):
+    """Options de copie d'un sous-projet (par défaut : même projet global, nom suffixé)"""
+    id_global: Optional[int] = None
+    nom: Optional[str] = None
+
 class SousProjetReadExtended(SousProjetRead):
     complet: bool
 
@@ -262,6 +267,23 @@ class SousProjetFpackBase(BaseModel):
 class SousProjetFpackCreate(SousProjetFpackBase):
     pass
 
+class SousProjetFpackFiltre(BaseModel):
+    """Instances visées par une modification en lot (critères combinés)"""
+    ids: Optional[List[int]] = None
+    sous_projet_id: Optional[int] = None
+    projet_global_id: Optional[int] = None
+
+class SousProjetFpackChamps(BaseModel):
+    """Champs à modifier (seuls les champs renseignés sont mis à jour)"""
+    contractor: Optional[str] = None
+    required_delivery_time: Optional[str] = None
+    delivery_site: Optional[str] = None
+    tracking: Optional[str] = None
+
+class SousProjetFpackBulkPatch(BaseModel):
+    filtre: SousProjetFpackFiltre
+    champs: SousProjetFpackChamps
+
 class SousProjetFpackRead(SousProjetFpackBase):
     id: int
     sous_projet_id: int
@@ -285,6 +307,34 @@ class ProjetSelectionRead(ProjetSelectionBase):
     class Config:
         from_attributes = True
 
+class SelectionRemplacement(BaseModel):
+    """Remplacement de l'item (type_item, ref_id) par (nouveau_type_item, nouveau_ref_id) dans les sélections"""
+    type_item: str
+    ref_id: int
+    nouveau_type_item: str
+    nouveau_ref_id: int
+    projet_global_id: Optional[int] = None
+    client_id: Optional[int] = None
+
+class SousProjetFpackBulkRow(BaseModel):
+    """Une instance à créer en lot (le template est commun au lot)"""
+    FPack_number: Optional[str] = None
+    Robot_Location_Code: Optional[str] = None
+    contractor: str = "N/A"
+    required_delivery_time: str = "N/A"
+    delivery_site: str = "N/A"
+    tracking: str = "N/A"
+
+class SousProjetFpackBulkCreate(BaseModel):
+    """Création en lot d'instances d'un même template, avec des sélections communes optionnelles"""
+    fpack_id: int
+    instances: List[SousProjetFpackBulkRow]
+    selections: List[ProjetSelectionCreate] = []
+
+# FACTURES
+class FactureBatchRequest(BaseModel):
+    ids: List[int]
+
 class SousProjetReadWithDetails(SousProjetRead):
     """Schema pour afficher un projet avec ses détails complets"""
     client_nom: Optional[str] = None
@@ -300,6 +350,16 @@ class ProjetGlobalReadWithSousProjets(ProjetGlobalRead):
     sous_projets: List[SousProjetReadWithDetails] = []
     client_nom: Optional[str] = None
 
+class ProjetGlobalPage(BaseModel):
+    """Page de projets globaux (pagination par curseur : id du dernier élément)"""
+    items: List[ProjetGlobalReadWithSousProjets] = []
+    next_cursor: Optional[int] = None
+
+class SousProjetPage(BaseModel):
+    """Page de sous-projets (pagination par curseur : id du dernier élément)"""
+    items: List[SousProjetReadWithDetails] = []
+    next_cursor: Optional[int] = None
+
 class ProjetSelectionReadWithDetails(ProjetSelectionRead):
     """Schema pour afficher une sélection avec ses détails"""
     groupe_nom: Optional[str] = None
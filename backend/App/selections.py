@@ -0,0 +1,220 @@
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException # type: ignore
+from sqlalchemy import bindparam, case, exists, func, insert, select, update # type: ignore
+from sqlalchemy.dialects import postgresql, sqlite # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models, schemas
+from App.pricing import chunked
+from App.write_tracking import mark_changed
+
+# Sélections d'une instance F-Pack traitées en lot :
+# - lecture : libellés des groupes et items résolus en une requête par type d'entité ;
+# - écriture : validation de toutes les références en une requête par type d'entité,
+#   puis upsert ensembliste ;
+# - remplacement d'un item par un autre dans toutes les sélections d'un périmètre,
+#   en un UPDATE ensembliste limité aux groupes qui proposent le nouvel item.
+
+ITEM_MODELS = {
+    "produit": models.Produit,
+    "equipement": models.Equipements,
+    "robot": models.Robots,
+}
+
+ITEM_LABELS = {
+    "produit": "Produits",
+    "equipement": "Équipements",
+    "robot": "Robots",
+}
+
+
+def resolve_labels(db: Session, keys: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], Optional[str]]:
+    """
+    Carte d'identité (type, id) -> nom, chargée en une requête IN (...) par type
+    ("group" pour les groupes, sinon type d'item) ; None si l'entité n'existe pas
+    """
+    ids_par_type: Dict[str, set] = defaultdict(set)
+    for type_item, ref_id in keys:
+        ids_par_type[type_item].add(ref_id)
+
+    labels: Dict[Tuple[str, int], Optional[str]] = {}
+    for type_item, ids in ids_par_type.items():
+        model = models.Groupes if type_item == "group" else ITEM_MODELS.get(type_item)
+        if model is None:
+            continue
+        for chunk in chunked(ids):
+            labels.update(
+                ((type_item, id_), nom)
+                for id_, nom in db.query(model.id, model.nom).filter(model.id.in_(chunk)).all()
+            )
+    return labels
+
+
+def selections_with_labels(db: Session, selections: List[models.ProjetSelection]) -> List[Dict[str, Any]]:
+    """Sélections avec les noms de leur groupe et de leur item"""
+    labels = resolve_labels(
+        db,
+        [("group", sel.groupe_id) for sel in selections] + [(sel.type_item, sel.ref_id) for sel in selections]
+    )
+    return [
+        {
+            "sous_projet_fpack_id": sel.sous_projet_fpack_id,
+            "groupe_id": sel.groupe_id,
+            "type_item": sel.type_item,
+            "ref_id": sel.ref_id,
+            "groupe_nom": labels.get(("group", sel.groupe_id)),
+            "item_nom": labels.get((sel.type_item, sel.ref_id))
+        }
+        for sel in selections
+    ]
+
+
+def _missing_ids(db: Session, model, ids) -> List[int]:
+    found = set()
+    for chunk in chunked(set(ids)):
+        found.update(i for (i,) in db.query(model.id).filter(model.id.in_(chunk)).all())
+    return sorted(set(ids) - found)
+
+
+def validate_selections(db: Session, selections: List[schemas.ProjetSelectionCreate]) -> None:
+    """Vérifie groupes et items de toutes les sélections (400 à la première erreur de lot)"""
+    doublons = sorted(g for g, n in Counter(s.groupe_id for s in selections).items() if n > 1)
+    if doublons:
+        raise HTTPException(status_code=400, detail=f"Groupes sélectionnés plusieurs fois: {doublons}")
+
+    types_invalides = sorted({s.type_item for s in selections} - set(ITEM_MODELS))
+    if types_invalides:
+        raise HTTPException(status_code=400, detail=f"Type d'item invalide: {', '.join(types_invalides)}")
+
+    manquants = _missing_ids(db, models.Groupes, [s.groupe_id for s in selections])
+    if manquants:
+        raise HTTPException(status_code=400, detail=f"Groupes non trouvés: {manquants}")
+
+    for type_item, model in ITEM_MODELS.items():
+        manquants = _missing_ids(db, model, [s.ref_id for s in selections if s.type_item == type_item])
+        if manquants:
+            raise HTTPException(status_code=400, detail=f"{ITEM_LABELS[type_item]} non trouvés: {manquants}")
+
+
+def upsert_selections(db: Session, sous_projet_fpack_id: int, selections: List[schemas.ProjetSelectionCreate]) -> List[Dict[str, Any]]:
+    """
+    Crée ou remplace (sans commit) la sélection de chaque groupe donné ; les autres groupes
+    de l'instance ne changent pas. PostgreSQL/SQLite : INSERT ... ON CONFLICT DO UPDATE ;
+    autres bases (SQL Server) : UPDATE des groupes existants puis INSERT des autres.
+    """
+    table = models.ProjetSelection.__table__
+    rows = [
+        {
+            "sous_projet_fpack_id": sous_projet_fpack_id,
+            "groupe_id": s.groupe_id,
+            "type_item": s.type_item,
+            "ref_id": s.ref_id
+        }
+        for s in selections
+    ]
+    if not rows:
+        return rows
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.sous_projet_fpack_id, table.c.groupe_id],
+            set_={"type_item": statement.excluded.type_item, "ref_id": statement.excluded.ref_id}
+        ), rows)
+    else:
+        existants = set()
+        for chunk in chunked([row["groupe_id"] for row in rows]):
+            existants.update(g for (g,) in db.execute(
+                select(table.c.groupe_id).where(
+                    table.c.sous_projet_fpack_id == sous_projet_fpack_id,
+                    table.c.groupe_id.in_(chunk)
+                )
+            ).all())
+        updates = [
+            {"b_groupe_id": row["groupe_id"], "type_item": row["type_item"], "ref_id": row["ref_id"]}
+            for row in rows if row["groupe_id"] in existants
+        ]
+        inserts = [row for row in rows if row["groupe_id"] not in existants]
+        if updates:
+            db.execute(
+                update(table)
+                .where(table.c.sous_projet_fpack_id == sous_projet_fpack_id, table.c.groupe_id == bindparam("b_groupe_id"))
+                .values(type_item=bindparam("type_item"), ref_id=bindparam("ref_id")),
+                updates
+            )
+        if inserts:
+            db.execute(insert(table), inserts)
+
+    mark_changed(db, "sous_projet_fpack", [sous_projet_fpack_id])
+    return rows
+
+
+# ========== REMPLACEMENT D'ITEM ==========
+
+def _remplacement_conditions(remplacement: schemas.SelectionRemplacement) -> list:
+    """Sélections de l'ancien item dans le périmètre (projet global, client ou toute la base)"""
+    selection = models.ProjetSelection
+    conditions = [selection.type_item == remplacement.type_item, selection.ref_id == remplacement.ref_id]
+    if remplacement.projet_global_id is not None or remplacement.client_id is not None:
+        instances = select(models.SousProjetFpack.id).join(
+            models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+        )
+        if remplacement.projet_global_id is not None:
+            instances = instances.where(models.SousProjet.id_global == remplacement.projet_global_id)
+        if remplacement.client_id is not None:
+            instances = instances.join(
+                models.ProjetGlobal, models.ProjetGlobal.id == models.SousProjet.id_global
+            ).where(models.ProjetGlobal.client == remplacement.client_id)
+        conditions.append(selection.sous_projet_fpack_id.in_(instances))
+    return conditions
+
+
+def _nouvel_item_dans_groupe(remplacement: schemas.SelectionRemplacement):
+    """Condition SQL : le groupe de la sélection propose le nouvel item"""
+    return exists().where(
+        models.GroupeItem.group_id == models.ProjetSelection.groupe_id,
+        models.GroupeItem.type == remplacement.nouveau_type_item,
+        models.GroupeItem.ref_id == remplacement.nouveau_ref_id
+    )
+
+
+def remplacement_par_sous_projet(db: Session, remplacement: schemas.SelectionRemplacement) -> List[Dict[str, Any]]:
+    """Sélections concernées par sous-projet : remplaçables et hors groupe (le groupe ne propose pas le nouvel item)"""
+    remplacables = func.sum(case((_nouvel_item_dans_groupe(remplacement), 1), else_=0))
+    rows = db.query(
+        models.SousProjet.id,
+        models.SousProjet.nom,
+        models.SousProjet.id_global,
+        func.count(),
+        remplacables
+    ).select_from(models.ProjetSelection).join(
+        models.SousProjetFpack, models.SousProjetFpack.id == models.ProjetSelection.sous_projet_fpack_id
+    ).join(
+        models.SousProjet, models.SousProjet.id == models.SousProjetFpack.sous_projet_id
+    ).filter(
+        *_remplacement_conditions(remplacement)
+    ).group_by(
+        models.SousProjet.id, models.SousProjet.nom, models.SousProjet.id_global
+    ).order_by(models.SousProjet.id).all()
+
+    return [
+        {
+            "sous_projet_id": sous_projet_id,
+            "sous_projet_nom": nom,
+            "projet_global_id": id_global,
+            "nb_remplacables": int(nb_remplacables or 0),
+            "nb_hors_groupe": nb_selections - int(nb_remplacables or 0)
+        }
+        for sous_projet_id, nom, id_global, nb_selections, nb_remplacables in rows
+    ]
+
+
+def remplacer_item(db: Session, remplacement: schemas.SelectionRemplacement) -> int:
+    """Remplace l'item (sans commit) dans les sélections dont le groupe propose le nouvel item ; renvoie le nombre modifié"""
+    return db.execute(
+        update(models.ProjetSelection)
+        .where(*_remplacement_conditions(remplacement), _nouvel_item_dans_groupe(remplacement))
+        .values(type_item=remplacement.nouveau_type_item, ref_id=remplacement.nouveau_ref_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Hashable, Iterable, Optional, Tuple
+from fastapi import HTTPException # type: ignore
+from config import INVOICE_WORKERS, INVOICE_QUEUE_LIMIT
+
+# Pool de processus borné pour le rendu CPU (reportlab / openpyxl).
+# Au plus INVOICE_WORKERS rendus en parallèle et INVOICE_QUEUE_LIMIT en attente :
+# au-delà, la requête est refusée (503) plutôt que de saturer la mémoire.
+# INVOICE_WORKERS = 0 désactive les processus : le rendu se fait alors dans des threads.
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(INVOICE_WORKERS, 1) + INVOICE_QUEUE_LIMIT)
+
+
+def get_render_pool() -> Executor:
+    """Crée le pool de rendu à la première utilisation"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if INVOICE_WORKERS > 0:
+                _pool = ProcessPoolExecutor(max_workers=INVOICE_WORKERS)
+            else:
+                _pool = ThreadPoolExecutor(thread_name_prefix="invoice-render")
+        return _pool
+
+
+def shutdown_render_pool():
+    """Arrête le pool de processus (arrêt de l'application)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def reserve_render_slot():
+    """Réserve une place dans la file de rendu, 503 si elle est pleine"""
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="Trop de documents en cours de génération, veuillez réessayer dans quelques instants"
+        )
+
+
+def release_render_slot():
+    _slots.release()
+
+
+class RenderSlot:
+    """
+    Place réservée dans la file de rendu pour une réponse streamée : release() peut être
+    appelé depuis plusieurs chemins (fin du streaming, tâche de fond, erreur), la place
+    n'est libérée qu'une fois
+    """
+
+    def __init__(self):
+        reserve_render_slot()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        release_render_slot()
+
+
+def _submit(render_fn: Callable[..., Any], *args) -> Future:
+    return get_render_pool().submit(render_fn, *args)
+
+
+async def render_in_pool(render_fn: Callable[..., Any], *args) -> Any:
+    """Exécute une fonction de rendu (picklable, sans accès base) dans le pool de processus"""
+    reserve_render_slot()
+    try:
+        return await asyncio.wrap_future(_submit(render_fn, *args))
+    finally:
+        release_render_slot()
+
+
+async def render_many_in_pool(
+    jobs: Iterable[Tuple[Hashable, Callable[..., Any], tuple]],
+    on_abandoned: Optional[Callable[[Any], None]] = None
+) -> AsyncIterator[Tuple[Hashable, Any]]:
+    """
+    Rend une série de documents (clé, fonction, arguments) dans le pool, au plus
+    INVOICE_WORKERS à la fois, et les renvoie dans l'ordre où ils se terminent.
+    La place dans la file est réservée par l'appelant (RenderSlot).
+    on_abandoned reçoit le résultat des rendus terminés après un arrêt anticipé
+    (client déconnecté, erreur), par exemple pour supprimer un fichier temporaire.
+    """
+    concurrency = max(INVOICE_WORKERS, 1)
+    jobs = iter(jobs)
+    pending = {}
+    try:
+        while True:
+            while len(pending) < concurrency:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                key, render_fn, args = job
+                future = _submit(render_fn, *args)
+                pending[asyncio.wrap_future(future)] = (key, future)
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in done:
+                key, _ = pending.pop(waiter)
+                yield key, waiter.result()
+    finally:
+        for waiter, (_, future) in pending.items():
+            # Un rendu déjà démarré ne peut pas être annulé : son résultat est confié à on_abandoned
+            if not future.cancel() and on_abandoned is not None:
+                future.add_done_callback(
+                    lambda f: on_abandoned(f.result()) if not f.cancelled() and f.exception() is None else None
+                )
@@ -0,0 +1,167 @@
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+from sqlalchemy import event, inspect, select # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from App import models
+from App.pricing import chunked
+
+# Suivi des écritures dont dépendent les données dérivées (totaux matérialisés,
+# compteurs de complétude). Les identifiants touchés sont collectés par portée pendant
+# la transaction, puis passés au commit aux fonctions enregistrées avec on_commit,
+# qui mettent à jour les données dérivées dans la même transaction.
+#
+# - Flush ORM : objets nouveaux, supprimés ou modifiés (historique des attributs).
+# - UPDATE/DELETE ensemblistes : les clés touchées sont relues avec le même filtre.
+# - INSERT ensemblistes : clés lues dans les paramètres ; à défaut, portée ALL (tout).
+#   Les insertions d'instances, sous-projets et projets ne sont pas suivies :
+#   l'appelant renseigne lui-même leurs compteurs, les totaux sont calculés d'office.
+# - Suppressions en cascade (ON DELETE CASCADE, faites par la base) : les clés des lignes
+#   suivies qui vont disparaître sont relues avant la suppression du parent.
+
+PENDING_KEY = "write_tracking_pending"
+ALL = "*"
+
+# Entité -> (portée, attribut clé, attributs qui changent les données dérivées ; None = tous)
+WATCHED = {
+    models.ProjetSelection: ("sous_projet_fpack", "sous_projet_fpack_id", None),
+    models.SousProjetFpack: ("sous_projet_fpack", "id", ("sous_projet_id", "fpack_id")),
+    models.FPackConfigColumn: ("fpack", "fpack_id", None),
+    models.Prix: ("produit", "produit_id", ("prix_produit", "prix_transport")),
+    models.PrixRobot: ("robot", "id", ("prix_robot", "prix_transport")),
+    models.Equipement_Produit: ("equipement", "equipement_id", None),
+    models.SousProjet: ("sous_projet", "id", ("id_global",)),
+    models.ProjetGlobal: ("projet_global", "id", ("client",)),
+}
+
+# Entité parente -> (entité suivie, attribut référençant le parent) supprimée en cascade par la base
+CASCADES = {
+    models.Groupes: ((models.ProjetSelection, "groupe_id"),),
+    models.FPack: ((models.FPackConfigColumn, "fpack_id"),),
+    models.Produit: ((models.Prix, "produit_id"), (models.Equipement_Produit, "produit_id")),
+    models.Robots: ((models.PrixRobot, "id"),),
+    models.Equipements: ((models.Equipement_Produit, "equipement_id"),),
+    models.Client: ((models.Prix, "client_id"),),
+}
+
+_commit_hooks: List[Callable[[Session, Dict[str, Set[Any]]], None]] = []
+
+
+def on_commit(hook: Callable[[Session, Dict[str, Set[Any]]], None]):
+    """Enregistre une fonction (db, portées touchées) appelée avant chaque commit avec écritures suivies"""
+    _commit_hooks.append(hook)
+    return hook
+
+
+def _pending(session: Session) -> Dict[str, Set[Any]]:
+    return session.info.setdefault(PENDING_KEY, defaultdict(set))
+
+
+def mark_changed(db: Session, scope: str, ids: Iterable[Any]):
+    """
+    Signale explicitement des écritures (prises en compte au prochain commit), pour les
+    écritures ensemblistes dont les lignes touchées ne sont pas connues (INSERT ... SELECT).
+    scope : "sous_projet_fpack", "fpack", "produit", "equipement", "robot", "sous_projet" ou "projet_global"
+    """
+    _pending(db)[scope].update(ids)
+
+
+def _track_cascades(session: Session, parent, parent_ids):
+    """Clés des lignes suivies supprimées en cascade avec les parents (liste d'ids ou sous-requête)"""
+    for child, foreign_key in CASCADES[parent]:
+        scope, key, _ = WATCHED[child]
+        query = select(getattr(child, key)).distinct().where(getattr(child, foreign_key).in_(parent_ids))
+        _pending(session)[scope].update(i for (i,) in session.execute(query).all() if i is not None)
+
+
+@event.listens_for(Session, "before_flush")
+def _track_cascade_deletes(session, flush_context, instances):
+    # Avant le flush : les lignes en cascade existent encore
+    deleted = defaultdict(set)
+    for obj in session.deleted:
+        if type(obj) in CASCADES:
+            deleted[type(obj)].add(obj.id)
+    for parent, ids in deleted.items():
+        for chunk in chunked(ids):
+            _track_cascades(session, parent, chunk)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    dirty = session.dirty
+    for obj in list(session.new) + list(dirty) + list(session.deleted):
+        watched = WATCHED.get(type(obj))
+        if watched is None:
+            continue
+        scope, key, relevant = watched
+        state = inspect(obj)
+        if obj in dirty and relevant is not None:
+            if not any(state.attrs[attr].history.has_changes() for attr in relevant):
+                continue
+        history = state.attrs[key].history
+        ids = set(history.added or ()) | set(history.deleted or ()) | set(history.unchanged or ())
+        _pending(session)[scope].update(i for i in ids if i is not None)
+
+
+def _updated_columns(statement) -> Optional[Set[str]]:
+    """Colonnes modifiées par un UPDATE ensembliste (None si inconnues)"""
+    values = getattr(statement, "_values", None) or dict(getattr(statement, "_ordered_values", None) or ())
+    if not values:
+        return None
+    return {getattr(column, "key", column) for column in values}
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    session = orm_execute_state.session
+    statement = orm_execute_state.statement
+    if mapper is not None and orm_execute_state.is_delete and mapper.class_ in CASCADES:
+        parent_ids = select(mapper.class_.id)
+        if statement.whereclause is not None:
+            parent_ids = parent_ids.where(statement.whereclause)
+        _track_cascades(session, mapper.class_, parent_ids)
+    watched = WATCHED.get(mapper.class_) if mapper is not None else None
+    if watched is None:
+        return
+    scope, key, relevant = watched
+
+    if orm_execute_state.is_insert:
+        if mapper.class_ in (models.SousProjetFpack, models.SousProjet, models.ProjetGlobal):
+            return
+        params = orm_execute_state.parameters
+        rows = params if isinstance(params, list) else [params] if isinstance(params, dict) else []
+        if rows and all(key in row for row in rows):
+            _pending(session)[scope].update(row[key] for row in rows)
+        else:
+            _pending(session)[ALL].add(True)
+        return
+
+    if orm_execute_state.is_update and relevant is not None:
+        columns = _updated_columns(statement)
+        if columns is not None and not columns & set(relevant):
+            return
+
+    # Lignes touchées relues avec le même filtre, avant l'exécution
+    key_column = getattr(mapper.class_, key)
+    query = select(key_column).distinct()
+    if statement.whereclause is not None:
+        query = query.where(statement.whereclause)
+    _pending(session)[scope].update(i for (i,) in session.execute(query).all() if i is not None)
+
+
+@event.listens_for(Session, "before_commit")
+def _run_commit_hooks(session):
+    # Le flush du commit a lieu après cet événement : on le fait ici pour voir les écritures en attente
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        for hook in _commit_hooks:
+            hook(session, pending)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _clear_on_rollback(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
@@ -6,7 +6,7 @@ a = Analysis(
     pathex=['.'],
     binaries=[],
     datas=[('config.py', '.'), ('App', 'App')],
-    hiddenimports=['pyodbc', 'fastapi', 'fastapi.middleware.cors', 'sqlalchemy', 'sqlalchemy.orm', 'sqlalchemy.ext.declarative', 'pydantic', 'dotenv', 'urllib.parse', 'openpyxl', 'fs', 'reportlab', 'multipart', 'reportlab.lib', 'reportlab.lib.pagesizes', 'pandas', 'reportlab.platypus', 'config'],
+    hiddenimports=['pyodbc', 'fastapi', 'fastapi.middleware.cors', 'sqlalchemy', 'sqlalchemy.orm', 'sqlalchemy.ext.declarative', 'pydantic', 'dotenv', 'urllib.parse', 'openpyxl', 'fs', 'reportlab', 'multipart', 'reportlab.lib', 'reportlab.lib.pagesizes', 'pandas', 'numpy', 'reportlab.platypus', 'config'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,142 @@
+"""
+Benchmark du moteur de tarification (App.pricing) : nombre de requêtes SQL et latence
+des factures sur un jeu de données généré, à plusieurs tailles de projet.
+
+La base utilisée est une base SQLite en mémoire (schéma dbo attaché) : aucune base
+réelle n'est touchée. Le nombre de requêtes doit rester constant quand le nombre
+d'instances F-Pack augmente.
+
+    python benchmark_pricing.py
+    python benchmark_pricing.py --instances 10 100 500 --repeat 5
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, event # type: ignore
+from sqlalchemy.orm import sessionmaker # type: ignore
+from sqlalchemy.pool import StaticPool # type: ignore
+
+from App import models
+from App.pricing import PricingEngine, ensure_equipement_costs
+
+
+def create_memory_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, "connect")
+    def attach_dbo(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS dbo")
+
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+def seed(db, instances_par_sous_projet: int, nb_produits: int = 500, nb_colonnes: int = 60, nb_selections: int = 15):
+    """Catalogue, prix, nomenclatures, templates et un projet global de 4 sous-projets"""
+    rnd = random.Random(42)
+    db.add(models.Client(id=1, nom="Client bench"))
+    db.add(models.Fournisseur(id=1, nom="Fournisseur bench"))
+    db.add_all(models.Produit(id=i, reference=f"REF{i}", nom=f"Produit {i}", fournisseur_id=1) for i in range(1, nb_produits + 1))
+    db.add_all(models.Equipements(id=i, reference=f"EQ{i}", nom=f"Equipement {i}") for i in range(1, 51))
+    db.add_all(
+        models.Robots(id=i, reference=f"RB{i}", nom=f"Robot {i}", generation="R-30iB", client=1, payload=10, range=1000)
+        for i in range(1, 21)
+    )
+    db.add_all(models.Groupes(id=i, nom=f"Groupe {i}") for i in range(1, 41))
+    db.flush()
+
+    db.add_all(
+        models.Prix(produit_id=i, client_id=1, prix_produit=rnd.randint(1, 900), prix_transport=rnd.randint(0, 60))
+        for i in range(1, nb_produits + 1) if rnd.random() < 0.9
+    )
+    db.add_all(models.PrixRobot(id=i, reference=f"RB{i}", prix_robot=15000.0, prix_transport=500.0) for i in range(1, 21))
+    for equipement_id in range(1, 51):
+        for produit_id in rnd.sample(range(1, nb_produits + 1), 5):
+            db.add(models.Equipement_Produit(equipement_id=equipement_id, produit_id=produit_id, quantite=rnd.randint(1, 4)))
+
+    for fpack_id in (1, 2):
+        db.add(models.FPack(id=fpack_id, nom=f"F-Pack {fpack_id}", client=1, fpack_abbr=f"FP{fpack_id}"))
+        db.flush()
+        for ordre in range(nb_colonnes):
+            type_col = rnd.choice(["produit", "equipement", "group"])
+            ref_id = rnd.randint(1, {"produit": nb_produits, "equipement": 50, "group": 40}[type_col])
+            db.add(models.FPackConfigColumn(fpack_id=fpack_id, ordre=ordre, type=type_col, ref_id=ref_id))
+
+    db.add(models.ProjetGlobal(id=1, projet="Projet bench", client=1))
+    db.flush()
+    spf_id = 0
+    for sous_projet_id in range(1, 5):
+        db.add(models.SousProjet(id=sous_projet_id, nom=f"Sous-projet {sous_projet_id}", id_global=1))
+        db.flush()
+        for _ in range(instances_par_sous_projet):
+            spf_id += 1
+            db.add(models.SousProjetFpack(
+                id=spf_id, sous_projet_id=sous_projet_id, fpack_id=1 + sous_projet_id % 2,
+                FPack_number=f"N{spf_id}", Robot_Location_Code=f"L{spf_id}"
+            ))
+            for groupe_id in rnd.sample(range(1, 41), nb_selections):
+                type_item = rnd.choice(["produit", "equipement", "robot"])
+                ref_id = rnd.randint(1, {"produit": nb_produits, "equipement": 50, "robot": 20}[type_item])
+                db.add(models.ProjetSelection(sous_projet_fpack_id=spf_id, groupe_id=groupe_id, type_item=type_item, ref_id=ref_id))
+    db.commit()
+    ensure_equipement_costs(db)
+    return spf_id
+
+
+def measure(engine, SessionLocal, scenario, repeat: int):
+    """Exécute un scénario (fonction db -> résultat) et renvoie (requêtes, latence médiane en ms)"""
+    compteur = {"requetes": 0}
+
+    def compter(*args, **kwargs):
+        compteur["requetes"] += 1
+
+    event.listen(engine, "before_cursor_execute", compter)
+    durees = []
+    requetes = 0
+    try:
+        for _ in range(repeat):
+            with SessionLocal() as db:
+                compteur["requetes"] = 0
+                debut = time.perf_counter()
+                scenario(db)
+                durees.append((time.perf_counter() - debut) * 1000)
+                requetes = compteur["requetes"]
+    finally:
+        event.remove(engine, "before_cursor_execute", compter)
+    return requetes, statistics.median(durees)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, nargs="+", default=[5, 50, 250],
+                        help="nombre d'instances F-Pack par sous-projet (4 sous-projets)")
+    parser.add_argument("--repeat", type=int, default=3, help="nombre d'exécutions par mesure")
+    args = parser.parse_args()
+
+    print(f"{'Scénario':<32}{'Instances':>10}{'Requêtes':>10}{'Médiane (ms)':>14}")
+    for instances in args.instances:
+        engine = create_memory_engine()
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        with SessionLocal() as db:
+            nb_instances = seed(db, instances)
+
+        def facture_lot(db, nb=nb_instances):
+            pricing = PricingEngine(db).load(range(1, nb + 1))
+            return [pricing.facture_sous_projet_fpack(i) for i in range(1, nb + 1)]
+
+        scenarios = [
+            ("facture instance F-Pack", lambda db: PricingEngine(db).facture_sous_projet_fpack(1)),
+            ("facture sous-projet", lambda db: PricingEngine(db).facture_sous_projet(1)),
+            ("facture projet global", lambda db: PricingEngine(db).facture_projet_global(1)),
+            ("lot de toutes les instances", facture_lot),
+        ]
+        for nom, scenario in scenarios:
+            requetes, mediane = measure(engine, SessionLocal, scenario, args.repeat)
+            print(f"{nom:<32}{nb_instances:>10}{requetes:>10}{mediane:>14.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
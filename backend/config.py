@@ -12,6 +12,22 @@ DB_NAME = os.getenv("DB_NAME", "ma_base")
 
 USE_SQL_SERVER = os.getenv("USE_SQL_SERVER", "false").lower() == "true"
 
+# Rendu des factures (PDF/Excel) : taille du pool de processus et nombre de rendus en attente
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", min(4, os.cpu_count() or 1)))
+INVOICE_QUEUE_LIMIT = int(os.getenv("INVOICE_QUEUE_LIMIT", "16"))
+# Au-delà de ce seuil (octets) le document rendu reste sur disque et est streamé par morceaux
+INVOICE_SPOOL_THRESHOLD = int(os.getenv("INVOICE_SPOOL_THRESHOLD", str(5 * 1024 * 1024)))
+INVOICE_SPOOL_DIR = os.getenv("INVOICE_SPOOL_DIR") or None
+# Taille maximale (octets) du cache des factures et documents rendus
+INVOICE_CACHE_MAX_BYTES = int(os.getenv("INVOICE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Durée (secondes) de validité des factures en cache : borne le délai de prise en compte des
+# écritures que l'empreinte des factures ne voit pas (SQL direct, noms du catalogue), 0 pour désactiver le cache
+INVOICE_CACHE_TTL = float(os.getenv("INVOICE_CACHE_TTL", "30"))
+# Délai maximal (secondes) entre deux rafraîchissements des totaux matérialisés en tâche de fond
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "5"))
+# Durée (secondes) de mise en cache des statistiques des projets, 0 pour désactiver
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+
 if USE_SQL_SERVER:
     DATABASE_URL = (
         f"mssql+pyodbc://{DB_USER}:{DB_PASSWORD}@{DB_HOST},{DB_PORT}/{DB_NAME}"
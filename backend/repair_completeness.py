@@ -0,0 +1,34 @@
+"""
+Reconstruit les compteurs de complétude des instances F-Pack (nb_selections,
+nb_groupes_attendus de FPM_sous_projet_fpack) sur la base configurée (DATABASE_URL),
+après une modification faite directement en base.
+
+    python repair_completeness.py
+    python repair_completeness.py --fpack 3 7
+    python repair_completeness.py --instance 12 15
+"""
+import argparse
+
+from App.database import engine, SessionLocal
+from App.completeness import add_counter_columns, refresh_completeness_counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fpack", type=int, nargs="+", help="Templates F-Pack dont les instances sont à recalculer (toutes par défaut)")
+    parser.add_argument("--instance", type=int, nargs="+", help="Instances (sous_projet_fpack) à recalculer")
+    args = parser.parse_args()
+
+    # Colonnes tout juste ajoutées : toutes les instances sont à remplir
+    colonnes_ajoutees = add_counter_columns(engine)
+    with SessionLocal() as db:
+        if (args.fpack or args.instance) and not colonnes_ajoutees:
+            refresh_completeness_counters(db, args.instance or (), args.fpack or ())
+        else:
+            refresh_completeness_counters(db)
+        db.commit()
+    print("Compteurs de complétude reconstruits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Tests sur une base SQLite en mémoire (schéma dbo attaché, clés étrangères actives) :
+App.database est remplacé avant l'import des modules de l'application, aucune base
+réelle n'est touchée.
+
+    cd backend && python -m pytest -q
+"""
+import os
+import random
+import sys
+import types
+
+import pytest # type: ignore
+from sqlalchemy import create_engine, delete, event, func, update # type: ignore
+from sqlalchemy.orm import sessionmaker # type: ignore
+from sqlalchemy.pool import StaticPool # type: ignore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+@event.listens_for(engine, "connect")
+def _connect(dbapi_connection, connection_record):
+    dbapi_connection.execute("ATTACH DATABASE ':memory:' AS dbo")
+    dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+
+database = types.ModuleType("App.database")
+database.engine = engine
+database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+sys.modules["App.database"] = database
+
+import App # noqa: E402
+App.database = database
+
+from App import models # noqa: E402
+import App.completeness # noqa: E402,F401  (compteurs recalculés au commit)
+import App.rollups # noqa: E402,F401  (totaux invalidés au commit)
+from App.invoice_cache import invoice_cache # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def schema():
+    """Schéma vide pour chaque test"""
+    models.Base.metadata.create_all(engine)
+    invoice_cache.clear()
+    yield
+    models.Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    yield session
+    session.rollback()
+    session.close()
+
+
+def seed(db, nb_instances: int = 3, nb_colonnes: int = 30, nb_selections: int = 8, graine: int = 1):
+    """
+    Deux clients, catalogue (produits, équipements, robots, groupes et leurs options),
+    deux templates et deux projets globaux : PG1 (sous-projets 1 et 2, F-Pack 1) et
+    PG2 (sous-projet 3, F-Pack 2), nb_instances instances par sous-projet.
+    """
+    rnd = random.Random(graine)
+    db.add_all([models.Client(id=1, nom="Client 1"), models.Client(id=2, nom="Client 2")])
+    db.add(models.Fournisseur(id=1, nom="Fournisseur"))
+    db.add_all(models.Produit(id=i, reference=f"REF{i}", nom=f"Produit {i}", fournisseur_id=1) for i in range(1, 61))
+    db.add_all(models.Equipements(id=i, reference=f"EQ{i}", nom=f"Equipement {i}") for i in range(1, 11))
+    db.add_all(
+        models.Robots(id=i, reference=f"RB{i}", nom=f"Robot {i}", generation="R-30iB", client=1, payload=10, range=1000)
+        for i in range(1, 7)
+    )
+    db.add_all(models.Groupes(id=i, nom=f"Groupe {i}") for i in range(1, 21))
+    db.flush()
+
+    for produit_id in range(1, 61):
+        for client_id in (1, 2):
+            if rnd.random() < 0.8:
+                db.add(models.Prix(
+                    produit_id=produit_id, client_id=client_id,
+                    prix_produit=rnd.randint(1, 500), prix_transport=rnd.randint(0, 50)
+                ))
+    db.add_all(
+        models.PrixRobot(id=i, reference=f"RB{i}", prix_robot=1000.0 * i, prix_transport=10.0)
+        for i in range(1, 7) if i % 2
+    )
+    for equipement_id in range(1, 11):
+        for produit_id in rnd.sample(range(1, 61), 3):
+            db.add(models.Equipement_Produit(equipement_id=equipement_id, produit_id=produit_id, quantite=rnd.randint(1, 3)))
+    for groupe_id in range(1, 21):
+        for _ in range(4):
+            type_item = rnd.choice(["produit", "equipement", "robot"])
+            db.add(models.GroupeItem(
+                group_id=groupe_id, type=type_item,
+                ref_id=rnd.randint(1, {"produit": 60, "equipement": 10, "robot": 6}[type_item])
+            ))
+
+    for fpack_id, client_id in ((1, 1), (2, 2)):
+        db.add(models.FPack(id=fpack_id, nom=f"F-Pack {fpack_id}", client=client_id, fpack_abbr=f"FP{fpack_id}"))
+        db.flush()
+        for ordre in range(nb_colonnes):
+            type_col = rnd.choice(["produit", "equipement", "group"])
+            ref_id = rnd.randint(1, {"produit": 60, "equipement": 10, "group": 20}[type_col])
+            db.add(models.FPackConfigColumn(fpack_id=fpack_id, ordre=ordre, type=type_col, ref_id=ref_id))
+
+    db.add_all([models.ProjetGlobal(id=1, projet="PG1", client=1), models.ProjetGlobal(id=2, projet="PG2", client=2)])
+    db.flush()
+    db.add_all([
+        models.SousProjet(id=1, nom="SP1", id_global=1),
+        models.SousProjet(id=2, nom="SP2", id_global=1),
+        models.SousProjet(id=3, nom="SP3", id_global=2),
+    ])
+    db.flush()
+    spf_id = 0
+    for sous_projet_id in (1, 2, 3):
+        for _ in range(nb_instances):
+            spf_id += 1
+            db.add(models.SousProjetFpack(
+                id=spf_id, sous_projet_id=sous_projet_id, fpack_id=1 if sous_projet_id < 3 else 2,
+                FPack_number=f"N{spf_id}", Robot_Location_Code=f"L{spf_id}"
+            ))
+            db.flush()
+            for groupe_id in rnd.sample(range(1, 21), nb_selections):
+                type_item = rnd.choice(["produit", "equipement", "robot"])
+                db.add(models.ProjetSelection(
+                    sous_projet_fpack_id=spf_id, groupe_id=groupe_id, type_item=type_item,
+                    ref_id=rnd.randint(1, {"produit": 60, "equipement": 10, "robot": 6}[type_item])
+                ))
+    db.commit()
+
+
+@pytest.fixture
+def seeded(db):
+    from App.pricing import ensure_equipement_costs
+    seed(db)
+    ensure_equipement_costs(db)
+    return db
+
+
+@pytest.fixture
+def client():
+    """Client HTTP sur une application réduite aux routes demandées"""
+    from fastapi import FastAPI # type: ignore
+    from fastapi.testclient import TestClient # type: ignore
+
+    def make(*route_modules):
+        app = FastAPI()
+        for module in route_modules:
+            app.include_router(module.router)
+        return TestClient(app)
+
+    return make
+
+
+# ========== ÉCRITURES SUIVIES ==========
+# Une écriture par chemin à couvrir (routes, ORM, requêtes ensemblistes, cascades de la base) :
+# les caches et valeurs dérivées (totaux matérialisés, compteurs de complétude) doivent
+# rester justes après chacune d'elles.
+
+def modifier_prix(db, http):
+    produit_id = db.query(models.Prix.produit_id).filter_by(client_id=1).first()[0]
+    r = http.put(f"/prix/{produit_id}/1", json={"produit_id": produit_id, "client_id": 1, "prix_produit": 9999, "prix_transport": 5})
+    assert r.status_code == 200
+
+
+def supprimer_prix(db, http):
+    produit_id = db.query(models.ProjetSelection.ref_id).filter_by(type_item="produit").first()[0]
+    assert http.delete(f"/prix/{produit_id}").status_code == 200
+
+
+def ajouter_composant(db, http):
+    r = http.post("/equipementproduit", json={"equipement_id": 2, "produit_id": 60, "quantite": 3})
+    assert r.status_code == 200
+
+
+def prix_robots_ensembliste(db, http):
+    db.execute(update(models.PrixRobot).values(prix_robot=models.PrixRobot.prix_robot * 2))
+    db.commit()
+
+
+def supprimer_robot(db, http):
+    assert http.delete("/robots/1").status_code == 200
+
+
+def update_selections_ensembliste(db, http):
+    db.query(models.ProjetSelection).filter(models.ProjetSelection.type_item == "produit")\
+        .update({models.ProjetSelection.ref_id: 1}, synchronize_session=False)
+    db.commit()
+
+
+def selections_bulk(db, http):
+    prises = {g for (g,) in db.query(models.ProjetSelection.groupe_id).filter_by(sous_projet_fpack_id=1)}
+    corps = [{"groupe_id": g, "type_item": "produit", "ref_id": g} for g in range(1, 21) if g not in prises][:4]
+    corps.append({"groupe_id": min(prises), "type_item": "robot", "ref_id": 1})
+    assert http.put("/sous_projet_fpack/1/selections:bulk", json=corps).status_code == 200
+
+
+def supprimer_selection(db, http):
+    groupe_id = db.query(models.ProjetSelection.groupe_id).filter_by(sous_projet_fpack_id=4).first()[0]
+    assert http.delete(f"/sous_projet_fpack/4/selections/{groupe_id}").status_code == 200
+
+
+def delete_selections_ensembliste(db, http):
+    db.execute(delete(models.ProjetSelection).where(models.ProjetSelection.sous_projet_fpack_id.in_([1, 5, 9])))
+    db.commit()
+
+
+def ajouter_colonne(db, http):
+    r = http.post("/fpack_config_columns", json={"fpack_id": 1, "ordre": 100, "type": "group", "ref_id": 20})
+    assert r.status_code == 200
+
+
+def colonnes_bulk(db, http):
+    corps = [{"fpack_id": 2, "ordre": 100 + o, "type": "group", "ref_id": o + 1} for o in range(4)]
+    assert http.post("/fpack_config_columns/bulk/2", json=corps).status_code == 200
+
+
+def vider_colonnes(db, http):
+    assert http.delete("/fpack_config_columns/clear/2").status_code == 200
+
+
+def supprimer_groupe(db, http):
+    # Sélections supprimées par la base (ON DELETE CASCADE)
+    db.delete(db.get(models.Groupes, 3))
+    db.commit()
+
+
+def supprimer_groupes_ensembliste(db, http):
+    db.query(models.Groupes).filter(models.Groupes.id.in_([1, 2, 4])).delete(synchronize_session=False)
+    db.commit()
+
+
+def cloner_sous_projet(db, http):
+    assert http.post("/sous_projets/1/clone", json={"id_global": 2, "nom": "copie"}).status_code == 200
+
+
+def fpacks_bulk(db, http):
+    corps = {
+        "fpack_id": 1,
+        "instances": [{"FPack_number": f"B{i}"} for i in range(4)],
+        "selections": [{"groupe_id": 1, "type_item": "produit", "ref_id": 1}, {"groupe_id": 2, "type_item": "produit", "ref_id": 2}]
+    }
+    assert http.post("/sous_projets/3/fpacks:bulk", json=corps).status_code == 200
+
+
+def remplacer_selections(db, http):
+    (ancien, _), = db.query(models.ProjetSelection.ref_id, func.count())\
+        .filter_by(type_item="produit").group_by(models.ProjetSelection.ref_id)\
+        .order_by(func.count().desc()).limit(1).all()
+    nouveau = 60 if ancien != 60 else 59
+    groupes = {g for (g,) in db.query(models.ProjetSelection.groupe_id).filter_by(type_item="produit", ref_id=ancien)}
+    db.add_all(models.GroupeItem(group_id=g, type="produit", ref_id=nouveau) for g in groupes)
+    db.commit()
+    corps = {"type_item": "produit", "ref_id": ancien, "nouveau_type_item": "produit", "nouveau_ref_id": nouveau}
+    r = http.post("/selections/remplacer?appliquer=true", json=corps)
+    assert r.status_code == 200 and r.json()["nb_remplacees"] > 0
+
+
+def changer_template(db, http):
+    db.get(models.SousProjetFpack, 1).fpack_id = 2
+    db.commit()
+
+
+def deplacer_sous_projet(db, http):
+    db.get(models.SousProjet, 2).id_global = 2
+    db.commit()
+
+
+def supprimer_projet(db, http):
+    assert http.delete("/projets_globaux/2").status_code == 200
+
+
+OPERATIONS = [
+    modifier_prix, supprimer_prix, ajouter_composant, prix_robots_ensembliste, supprimer_robot,
+    update_selections_ensembliste, selections_bulk, supprimer_selection, delete_selections_ensembliste,
+    ajouter_colonne, colonnes_bulk, vider_colonnes, supprimer_groupe, supprimer_groupes_ensembliste,
+    cloner_sous_projet, fpacks_bulk, remplacer_selections, changer_template, deplacer_sous_projet,
+    supprimer_projet,
+]
+
+
+@pytest.fixture(params=OPERATIONS, ids=lambda op: op.__name__)
+def ecriture(request, seeded, client):
+    """Applique une des écritures suivies à la base peuplée"""
+    from App.routes import equipements, fpack_config_columns, prix_produits, projets, robots
+    http = client(projets, prix_produits, equipements, robots, fpack_config_columns)
+    return lambda: request.param(seeded, http)
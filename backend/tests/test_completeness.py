@@ -0,0 +1,63 @@
+import sys
+
+import pytest # type: ignore
+from sqlalchemy import text # type: ignore
+
+from App import models
+from App.completeness import ensure_completeness_counters
+
+
+def compteurs(db):
+    db.expire_all()
+    return {i.id: (i.nb_selections, i.nb_groupes_attendus) for i in db.query(models.SousProjetFpack)}
+
+
+def attendus(db):
+    """Compteurs recomptés ligne à ligne"""
+    resultat = {}
+    for instance in db.query(models.SousProjetFpack):
+        nb_selections = db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=instance.id).count()
+        nb_groupes = db.query(models.FPackConfigColumn).filter_by(fpack_id=instance.fpack_id, type="group").count()
+        resultat[instance.id] = (nb_selections, nb_groupes)
+    return resultat
+
+
+def test_compteurs_apres_ecriture(seeded, ecriture):
+    assert compteurs(seeded) == attendus(seeded)
+
+    ecriture()
+
+    assert compteurs(seeded) == attendus(seeded)
+
+
+def test_reparation_au_demarrage(seeded):
+    db = seeded
+    # Écritures faites hors de l'application : les compteurs ne sont pas mis à jour
+    with db.get_bind().begin() as connection:
+        connection.execute(text('DELETE FROM dbo."FPM_projet_selection" WHERE sous_projet_fpack_id IN (1, 2)'))
+        connection.execute(text('DELETE FROM dbo."FPM_fpack_config_columns" WHERE fpack_id = 2 AND ordre < 10'))
+    assert compteurs(db) != attendus(db)
+
+    ensure_completeness_counters(db.get_bind())
+
+    assert compteurs(db) == attendus(db)
+
+
+@pytest.mark.parametrize("arguments, repares", [
+    (["--instance", "1"], {1}),
+    (["--fpack", "2"], {7, 8, 9}),
+    ([], {1, 2, 7, 8, 9}),
+])
+def test_script_de_reparation(seeded, monkeypatch, arguments, repares):
+    import repair_completeness
+    db = seeded
+    justes = attendus(db)
+    with db.get_bind().begin() as connection:
+        connection.execute(text('UPDATE dbo."FPM_sous_projet_fpack" SET nb_selections = 99 WHERE id IN (1, 2, 7, 8, 9)'))
+    monkeypatch.setattr(sys, "argv", ["repair_completeness.py", *arguments])
+
+    repair_completeness.main()
+
+    faux = {i for i, (nb_selections, _) in compteurs(db).items() if nb_selections == 99}
+    assert faux == {1, 2, 7, 8, 9} - repares
+    assert {i: c for i, c in compteurs(db).items() if i not in faux} == {i: c for i, c in justes.items() if i not in faux}
@@ -0,0 +1,99 @@
+import itertools
+import random
+
+import pytest # type: ignore
+
+import App.configuration_solver as configuration_solver
+from App import models
+from App.configuration_solver import ConfigurationSolver
+
+
+def seed_configuration(db, graine: int, nb_groupes: int = 6, nb_options: int = 3):
+    """Instance sans sélection d'un template à nb_groupes groupes de produits, avec incompatibilités"""
+    rnd = random.Random(graine)
+    nb_produits = nb_groupes * nb_options
+    db.add(models.Client(id=1, nom="Client"))
+    db.add(models.Fournisseur(id=1, nom="Fournisseur"))
+    db.add_all(models.Produit(id=i, reference=f"REF{i}", nom=f"Produit {i}", fournisseur_id=1) for i in range(1, nb_produits + 1))
+    db.add_all(models.Groupes(id=i, nom=f"Groupe {i}") for i in range(1, nb_groupes + 1))
+    db.add(models.FPack(id=1, nom="F-Pack", client=1, fpack_abbr="FP"))
+    db.add(models.ProjetGlobal(id=1, projet="PG", client=1))
+    db.flush()
+    db.add_all(
+        models.Prix(produit_id=i, client_id=1, prix_produit=rnd.randint(1, 100), prix_transport=rnd.randint(0, 10))
+        for i in range(1, nb_produits + 1)
+    )
+    for groupe_id in range(1, nb_groupes + 1):
+        db.add(models.FPackConfigColumn(fpack_id=1, ordre=groupe_id, type="group", ref_id=groupe_id))
+        for k in range(nb_options):
+            db.add(models.GroupeItem(group_id=groupe_id, type="produit", ref_id=(groupe_id - 1) * nb_options + k + 1))
+    paires = {tuple(sorted(rnd.sample(range(1, nb_produits + 1), 2))) for _ in range(nb_produits * 2)}
+    db.add_all(models.ProduitIncompatibilite(produit_id_1=a, produit_id_2=b) for a, b in paires)
+    db.add(models.SousProjet(id=1, nom="SP", id_global=1))
+    db.flush()
+    db.add(models.SousProjetFpack(id=1, sous_projet_id=1, fpack_id=1))
+    db.commit()
+
+
+def brute_force(solver: ConfigurationSolver):
+    """Meilleur (nombre de groupes remplis, -coût) sur toutes les combinaisons, groupes vides compris"""
+    solver._load()
+    domaines = []
+    for options in solver.options.values():
+        tarifees = [o for o in options if solver.cout(o) is not None and all(solver.compatibles(o, f) for f in solver.fixes)]
+        domaines.append(tarifees + [None])
+    meilleur = None
+    for combinaison in itertools.product(*domaines):
+        choisies = [o for o in combinaison if o is not None]
+        if not all(solver.compatibles(a, b) for a, b in itertools.combinations(choisies, 2)):
+            continue
+        score = (len(choisies), -sum(solver.cout(o) for o in choisies))
+        if meilleur is None or score > meilleur:
+            meilleur = score
+    return meilleur
+
+
+def check_feasible(db, resultat):
+    solver = ConfigurationSolver(db, 1)
+    solver._load()
+    choisies = [(s["type_item"], s["ref_id"]) for s in resultat["selections"]]
+    assert all(solver.compatibles(a, b) for a, b in itertools.combinations(choisies + solver.fixes, 2))
+    # Chaque groupe à remplir est soit choisi, soit signalé
+    groupes = {s["groupe_id"] for s in resultat["selections"]} | {g["groupe_id"] for g in resultat["groupes_sans_solution"]}
+    assert groupes == set(solver.options)
+
+
+@pytest.mark.parametrize("graine", range(8))
+def test_solution_optimale(db, graine):
+    seed_configuration(db, graine)
+    resultat = ConfigurationSolver(db, 1).solve()
+
+    nb_remplis, cout_negatif = brute_force(ConfigurationSolver(db, 1))
+    assert resultat["optimal"] is True
+    assert resultat["limite_atteinte"] is False
+    assert len(resultat["selections"]) == nb_remplis
+    assert resultat["cout_selections"] == pytest.approx(-cout_negatif)
+    check_feasible(db, resultat)
+
+
+@pytest.mark.parametrize("graine", range(4))
+def test_limite_de_noeuds_sans_groupe_perdu(db, monkeypatch, graine):
+    seed_configuration(db, graine, nb_groupes=8)
+    monkeypatch.setattr(configuration_solver, "MAX_NOEUDS", 1)
+
+    resultat = ConfigurationSolver(db, 1).solve()
+
+    assert resultat["limite_atteinte"] is True
+    assert resultat["optimal"] is False
+    check_feasible(db, resultat)
+
+
+def test_groupe_sans_option_tarifee(db):
+    seed_configuration(db, 0, nb_groupes=2)
+    db.query(models.Prix).filter(models.Prix.produit_id.in_([1, 2, 3])).update({models.Prix.prix_produit: 0, models.Prix.prix_transport: 0})
+    db.commit()
+
+    resultat = ConfigurationSolver(db, 1).solve()
+
+    assert [g["groupe_id"] for g in resultat["groupes_sans_solution"]] == [1]
+    assert ConfigurationSolver(db, 1, inclure_sans_prix=True).solve()["groupes_sans_solution"] == []
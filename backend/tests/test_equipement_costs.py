@@ -0,0 +1,96 @@
+import pytest # type: ignore
+
+from App import models
+from App.routes import equipements, prix_produits
+
+
+def couts(db):
+    db.expire_all()
+    return {
+        (c.equipement_id, c.client_id): (round(c.prix_produit, 6), round(c.prix_transport, 6))
+        for c in db.query(models.EquipementCost)
+    }
+
+
+def attendus(db):
+    """Coûts recalculés ligne à ligne depuis les nomenclatures et les prix"""
+    resultat = {}
+    for composant in db.query(models.Equipement_Produit):
+        quantite = composant.quantite or 1
+        for prix in db.query(models.Prix).filter_by(produit_id=composant.produit_id):
+            produit, transport = resultat.get((composant.equipement_id, prix.client_id), (0, 0))
+            resultat[(composant.equipement_id, prix.client_id)] = (
+                produit + float(prix.prix_produit) * quantite, transport + float(prix.prix_transport) * quantite
+            )
+    return {key: (round(p, 6), round(t, 6)) for key, (p, t) in resultat.items()}
+
+
+def composant(db):
+    """Un composant de nomenclature dont le produit a un prix pour le client 1"""
+    return db.query(models.Equipement_Produit).join(
+        models.Prix, models.Prix.produit_id == models.Equipement_Produit.produit_id
+    ).filter(models.Prix.client_id == 1).first()
+
+
+def creer_prix(db, http):
+    ligne = composant(db)
+    db.query(models.Prix).filter_by(produit_id=ligne.produit_id, client_id=2).delete()
+    db.commit()
+    r = http.post("/prix", json={"produit_id": ligne.produit_id, "client_id": 2, "prix_produit": 77, "prix_transport": 3})
+    assert r.status_code == 200
+
+
+def modifier_prix(db, http):
+    produit_id = composant(db).produit_id
+    r = http.put(f"/prix/{produit_id}/1", json={"produit_id": produit_id, "client_id": 1, "prix_produit": 9999, "prix_transport": 5})
+    assert r.status_code == 200
+
+
+def supprimer_prix_client(db, http):
+    assert http.delete(f"/prix/{composant(db).produit_id}/1").status_code == 200
+
+
+def supprimer_prix(db, http):
+    assert http.delete(f"/prix/{composant(db).produit_id}").status_code == 200
+
+
+def ajouter_composant(db, http):
+    r = http.post("/equipementproduit", json={"equipement_id": 2, "produit_id": composant(db).produit_id, "quantite": 4})
+    assert r.status_code == 200
+
+
+def modifier_quantite(db, http):
+    ligne = composant(db)
+    r = http.post("/equipementproduit", json={"equipement_id": ligne.equipement_id, "produit_id": ligne.produit_id, "quantite": 7})
+    assert r.status_code == 200
+
+
+def vider_nomenclature(db, http):
+    assert http.delete(f"/equipementproduit/clear/{composant(db).equipement_id}").status_code == 200
+
+
+@pytest.mark.parametrize("operation", [
+    creer_prix, modifier_prix, supprimer_prix_client, supprimer_prix,
+    ajouter_composant, modifier_quantite, vider_nomenclature,
+], ids=lambda op: op.__name__)
+def test_couts_apres_ecriture(seeded, client, operation):
+    db = seeded
+    http = client(prix_produits, equipements)
+    avant = couts(db)
+    assert avant == attendus(db)
+
+    operation(db, http)
+
+    assert couts(db) == attendus(db)
+    assert couts(db) != avant
+
+
+def test_reconstruction(seeded, client):
+    db = seeded
+    db.query(models.EquipementCost).delete()
+    db.commit()
+
+    r = client(equipements).post("/equipement_costs/rebuild")
+
+    assert r.status_code == 200 and r.json()["rows"] == len(attendus(db))
+    assert couts(db) == attendus(db)
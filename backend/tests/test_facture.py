@@ -0,0 +1,47 @@
+import asyncio
+import io
+import zipfile
+
+import pytest # type: ignore
+
+from App.invoice_render import ZipStream
+from App.routes import facture
+
+
+@pytest.fixture
+def hors_boucle(monkeypatch):
+    """Méthodes de ZipStream appelées depuis la boucle d'événements"""
+    appels = []
+
+    def surveiller(methode):
+        originale = getattr(ZipStream, methode)
+
+        def enveloppe(self, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                appels.append(methode)
+            except RuntimeError:
+                pass
+            return originale(self, *args, **kwargs)
+
+        monkeypatch.setattr(ZipStream, methode, enveloppe)
+
+    # add_file est un générateur : son corps (et ses appels à _take) s'exécute à chaque next
+    for methode in ("add_bytes", "_take", "close"):
+        surveiller(methode)
+    return appels
+
+
+@pytest.mark.parametrize("seuil", [10**9, 0])
+def test_archive_zip(seeded, client, hors_boucle, monkeypatch, seuil):
+    # Seuil nul : chaque document passe par un fichier temporaire (add_file)
+    monkeypatch.setattr(facture, "INVOICE_SPOOL_THRESHOLD", seuil)
+    r = client(facture).get("/projets_globaux/1/factures.zip?formats=pdf,excel")
+
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as archive:
+        assert archive.testzip() is None
+        noms = archive.namelist()
+    assert len(noms) == 12
+    assert sum(nom.endswith(".pdf") for nom in noms) == 6
+    assert hors_boucle == []
@@ -0,0 +1,44 @@
+from App import models
+from App.pricing import PricingEngine
+from App.routes import factures_emises, projets
+
+
+def sans_emission(facture):
+    return {cle: valeur for cle, valeur in facture.items() if cle != "facture_emise"}
+
+
+def test_emission_figee(seeded, client):
+    db = seeded
+    http = client(factures_emises, projets)
+    calculee = PricingEngine(db).facture_sous_projet_fpack(1)
+
+    emise = http.post("/sous_projet_fpack/1/facture/emettre").json()
+    assert emise["numero"].startswith("FAC-") and emise["totaux"] == calculee["totaux"]
+    figee = http.get(f"/factures_emises/{emise['id']}").json()
+    assert sans_emission(figee) == calculee
+    pdf = http.get(f"/factures_emises/{emise['id']}/facture-pdf")
+    assert pdf.status_code == 200 and pdf.content.startswith(b"%PDF")
+
+    # Prix, noms et instance modifiés ou supprimés après l'émission
+    produit_id = next(l["produit_id"] for l in calculee["lines"] if l["type"] == "produit" and l["prix_unitaire"] > 0)
+    db.get(models.Prix, (produit_id, 1)).prix_produit += 100
+    db.get(models.SousProjet, 1).nom = "Renommé"
+    db.commit()
+    assert PricingEngine(db).facture_sous_projet_fpack(1)["totaux"] != calculee["totaux"]
+    assert http.delete("/sous_projet_fpack/1").status_code == 200
+
+    apres = http.get(f"/factures_emises/{emise['id']}").json()
+    assert sans_emission(apres) == {**calculee, "sous_projet_fpack_id": None}
+    assert http.get(f"/factures_emises/{emise['id']}/facture-pdf").content == pdf.content
+
+
+def test_liste_et_formats(seeded, client):
+    http = client(factures_emises)
+    ids = [http.post(f"/sous_projet_fpack/{i}/facture/emettre").json()["id"] for i in (1, 2, 7)]
+
+    page = http.get("/factures_emises", params={"projet_global_id": 1, "limit": 1}).json()
+    suivante = http.get("/factures_emises", params={"projet_global_id": 1, "cursor": page["next_cursor"]}).json()
+    assert [f["id"] for f in page["items"] + suivante["items"]] == [ids[1], ids[0]]
+    assert suivante["next_cursor"] is None
+    assert http.get(f"/factures_emises/{ids[0]}/facture-docx").status_code == 404
+    assert http.get("/factures_emises/999").status_code == 404
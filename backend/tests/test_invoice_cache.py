@@ -0,0 +1,202 @@
+import types
+
+import pytest # type: ignore
+from sqlalchemy import text # type: ignore
+
+import App.invoice_cache as invoice_cache
+from App import models
+from App.database import SessionLocal
+from App.invoice_cache import data_generation, data_version, document_etag, etag_matches, get_cached_facture
+from App.rollups import refresh_rollups
+from App.routes import facture
+
+
+@pytest.fixture
+def horloge(monkeypatch):
+    """Horloge du cache contrôlée par le test"""
+    maintenant = [1000.0]
+    monkeypatch.setattr(invoice_cache, "time", types.SimpleNamespace(monotonic=lambda: maintenant[0]))
+    monkeypatch.setattr(invoice_cache, "INVOICE_CACHE_TTL", 30.0)
+    return maintenant
+
+
+@pytest.fixture
+def chargements():
+    """Fonction de chargement qui compte ses appels"""
+    appels = []
+
+    def charger_facture(object_id, db):
+        appels.append(object_id)
+        return facture.get_sous_projet_fpack_facture(object_id, db)
+
+    charger_facture.appels = appels
+    return charger_facture
+
+
+def modifier_prix_hors_session(db, produit_id, client_id, prix):
+    """Écriture faite par un autre processus ou directement en base : aucun événement de session"""
+    with db.get_bind().begin() as connection:
+        connection.execute(
+            text('UPDATE dbo."FPM_prix" SET prix_produit = :prix WHERE produit_id = :p AND client_id = :c'),
+            {"prix": prix, "p": produit_id, "c": client_id}
+        )
+
+
+def produit_facture(db, sous_projet_fpack_id):
+    """Produit tarifé de la facture d'une instance du projet PG1 (client 1)"""
+    data = facture.get_sous_projet_fpack_facture(sous_projet_fpack_id, db)
+    produit_id = next(l["produit_id"] for l in data["lines"] if l["type"] == "produit" and l["prix_unitaire"] > 0)
+    return produit_id, 1
+
+
+@pytest.mark.parametrize("en_tete, attendu", [
+    (None, False),
+    ("", False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ('"abcd"', False),
+    ("*", True),
+])
+def test_etag_matches(en_tete, attendu):
+    assert etag_matches(en_tete, '"abc"') is attendu
+
+
+@pytest.fixture
+def materialises(seeded):
+    """Totaux matérialisés à jour : les factures de toutes les instances sont suivies"""
+    refresh_rollups(seeded)
+    seeded.commit()
+    return seeded
+
+
+def test_cache_et_version(materialises, horloge, chargements):
+    db = materialises
+    donnees, empreinte = get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    assert get_cached_facture(chargements, 1, db, "sous_projet_fpack") == (donnees, empreinte)
+    assert chargements.appels == [1]
+
+    # Écriture qui touche l'instance : version de ses totaux incrémentée, facture recalculée
+    version = data_version(db, "sous_projet_fpack", 1)
+    produit_id, client_id = produit_facture(db, 1)
+    db.get(models.Prix, (produit_id, client_id)).prix_produit += 1
+    db.commit()
+    assert data_version(db, "sous_projet_fpack", 1) != version
+    _, nouvelle_empreinte = get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    assert chargements.appels == [1, 1]
+    assert nouvelle_empreinte != empreinte
+
+
+def test_invalidation_limitee_aux_instances_touchees(materialises, horloge, chargements):
+    db = materialises
+    get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    get_cached_facture(chargements, 4, db, "sous_projet_fpack")
+    db.delete(db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=4).first())
+    db.commit()
+
+    get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    get_cached_facture(chargements, 4, db, "sous_projet_fpack")
+    assert chargements.appels == [1, 4, 4]
+
+
+@pytest.mark.parametrize("scope, object_id", [("sous_projet", 1), ("projet_global", 1)])
+def test_version_des_factures_agregees(materialises, scope, object_id):
+    db = materialises
+    version = data_version(db, scope, object_id)
+    # Instance d'un autre projet : sans effet
+    db.delete(db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=7).first())
+    db.commit()
+    assert data_version(db, scope, object_id) == version
+
+    db.delete(db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=2).first())
+    db.commit()
+    assert data_version(db, scope, object_id) != version
+
+
+def test_ecriture_d_un_autre_processus(materialises, horloge, chargements):
+    db = materialises
+    _, empreinte = get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    produit_id, client_id = produit_facture(db, 1)
+    # Autre worker : aucun événement dans la session de ce test, la version en base change
+    with SessionLocal() as autre:
+        autre.get(models.Prix, (produit_id, client_id)).prix_produit += 1
+        autre.commit()
+
+    assert get_cached_facture(chargements, 1, db, "sous_projet_fpack")[1] != empreinte
+    assert chargements.appels == [1, 1]
+
+
+def test_renommage(materialises, horloge, chargements):
+    db = materialises
+    get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    db.get(models.SousProjetFpack, 1).FPack_number = "NOUVEAU"
+    db.commit()
+
+    donnees, _ = get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    assert donnees["fpack"]["FPack_number"] == "NOUVEAU"
+    assert chargements.appels == [1, 1]
+
+
+def test_instance_sans_totaux_non_mise_en_cache(seeded, horloge, chargements):
+    get_cached_facture(chargements, 1, seeded, "sous_projet_fpack")
+    get_cached_facture(chargements, 1, seeded, "sous_projet_fpack")
+
+    assert data_version(seeded, "sous_projet_fpack", 1) is None
+    assert chargements.appels == [1, 1]
+
+
+def test_totaux_materialises_sans_invalidation(materialises, horloge, chargements):
+    db = materialises
+    get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    generation = data_generation()
+    db.query(models.RollupSousProjetFpack).update({models.RollupSousProjetFpack.stale: True})
+    db.commit()
+    refresh_rollups(db)
+    db.commit()
+
+    assert data_generation() == generation
+    get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    assert chargements.appels == [1]
+
+
+def test_expiration_ecriture_hors_processus(materialises, horloge, chargements):
+    db = materialises
+    _, empreinte = get_cached_facture(chargements, 1, db, "sous_projet_fpack")
+    produit_id, client_id = produit_facture(db, 1)
+    modifier_prix_hors_session(db, produit_id, client_id, 12345)
+
+    # SQL direct : version inchangée, la facture en cache reste servie jusqu'à son expiration
+    horloge[0] += 29
+    assert get_cached_facture(chargements, 1, db, "sous_projet_fpack")[1] == empreinte
+    horloge[0] += 2
+    assert get_cached_facture(chargements, 1, db, "sous_projet_fpack")[1] != empreinte
+    assert chargements.appels == [1, 1]
+
+
+def test_ttl_nul_desactive_le_cache(materialises, horloge, chargements, monkeypatch):
+    monkeypatch.setattr(invoice_cache, "INVOICE_CACHE_TTL", 0)
+    get_cached_facture(chargements, 1, materialises, "sous_projet_fpack")
+    get_cached_facture(chargements, 1, materialises, "sous_projet_fpack")
+
+    assert chargements.appels == [1, 1]
+
+
+def test_etag_document_sans_date():
+    assert document_etag("abc", "pdf") == '"abc-pdf"'
+
+
+def test_route_etag_304(materialises, horloge, client):
+    db = materialises
+    http = client(facture)
+    r = http.get("/sous_projet_fpack/1/facture")
+    etag = r.headers["ETag"]
+    assert r.status_code == 200 and r.headers["Cache-Control"] == "no-cache"
+
+    r = http.get("/sous_projet_fpack/1/facture", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["ETag"] == etag and r.content == b""
+
+    produit_id, client_id = produit_facture(db, 1)
+    db.get(models.Prix, (produit_id, client_id)).prix_produit += 1
+    db.commit()
+    r = http.get("/sous_projet_fpack/1/facture", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
@@ -0,0 +1,76 @@
+import pytest # type: ignore
+
+from App import models
+from App.price_coverage import price_coverage_projet_global
+from App.pricing import PricingEngine
+
+
+def comparaison(db, client_id):
+    resultat = PricingEngine(db).quote_comparison(1, [client_id])
+    return resultat["clients"][0]
+
+
+def test_comparaison_comme_la_facture(seeded):
+    db = seeded
+    facture = PricingEngine(db).facture_sous_projet(1)
+    client = comparaison(db, 1)
+
+    assert client["totaux"]["global"] == pytest.approx(facture["totaux"]["global"])
+    assert client["items_sans_prix"] == sum(1 for line in facture["lines"] if line["prix_unitaire"] == 0)
+
+
+def test_comparaison_prix_nuls(seeded):
+    db = seeded
+    lignes = PricingEngine(db).facture_sous_projet(1)["lines"]
+    produit_id = next(l["produit_id"] for l in lignes if l["type"] == "produit" and l["prix_unitaire"] > 0)
+    robot_id = next(l["produit_id"] for l in lignes if l["type"] == "robot" and l["prix_unitaire"] > 0)
+    avant = comparaison(db, 1)["items_sans_prix"]
+
+    # Lignes de prix présentes mais à zéro : toujours sans prix, comme dans les factures
+    db.get(models.Prix, (produit_id, 1)).prix_produit = 0
+    db.get(models.PrixRobot, robot_id).prix_robot = 0
+    db.commit()
+
+    client = comparaison(db, 1)
+    assert client["items_sans_prix"] == avant + 2
+    facture = PricingEngine(db).facture_sous_projet(1)
+    assert client["items_sans_prix"] == sum(1 for line in facture["lines"] if line["prix_unitaire"] == 0)
+
+
+def manquants_facture(db, projet_global_id):
+    """Produits et robots facturés à zéro dans la facture consolidée du projet"""
+    lignes = PricingEngine(db).facture_projet_global(projet_global_id)["lines"]
+    return {
+        type_item: {l["produit_id"] for l in lignes if l["type"] == type_item and l["prix_unitaire"] == 0}
+        for type_item in ("produit", "robot")
+    }
+
+
+def test_couverture_comme_la_facture(seeded):
+    db = seeded
+    lignes = PricingEngine(db).facture_projet_global(1)["lines"]
+    produit_id = next(l["produit_id"] for l in lignes if l["type"] == "produit" and l["prix_unitaire"] > 0)
+    db.get(models.Prix, (produit_id, 1)).prix_produit = 0
+    db.commit()
+
+    rapport = price_coverage_projet_global(db, 1)
+
+    attendus = manquants_facture(db, 1)
+    assert produit_id in attendus["produit"]
+    assert {p["id"] for p in rapport["produits_sans_prix"]} == attendus["produit"]
+    assert {r["id"] for r in rapport["robots_sans_prix"]} == attendus["robot"]
+    assert rapport["nb_manquants"] > 0 and not rapport["complet"]
+
+
+def test_couverture_equipement_sans_composants(seeded):
+    db = seeded
+    equipement_id = next(
+        l["produit_id"] for l in PricingEngine(db).facture_projet_global(1)["lines"] if l["type"] == "equipement"
+    )
+    db.query(models.Equipement_Produit).filter_by(equipement_id=equipement_id).delete()
+    db.commit()
+
+    rapport = price_coverage_projet_global(db, 1)
+
+    assert equipement_id in {e["id"] for e in rapport["equipements_sans_composants"]}
+    assert equipement_id not in {c["equipement_id"] for c in rapport["composants_equipements_sans_prix"]}
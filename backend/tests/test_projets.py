@@ -0,0 +1,172 @@
+import pytest # type: ignore
+from sqlalchemy import event # type: ignore
+
+from App import models
+from App.routes import fpack_config_columns, projets
+
+
+def sites(db):
+    db.expire_all()
+    return {i.id: i.delivery_site for i in db.query(models.SousProjetFpack)}
+
+
+@pytest.mark.parametrize("filtre, modifiees", [
+    ({"ids": [1, 2, 2, 8]}, {1, 2, 8}),
+    ({"sous_projet_id": 2}, {4, 5, 6}),
+    ({"projet_global_id": 1}, {1, 2, 3, 4, 5, 6}),
+    ({"ids": [1, 4, 8], "projet_global_id": 1}, {1, 4}),
+    ({"ids": [1, 4], "sous_projet_id": 3}, set()),
+])
+def test_patch_en_lot(seeded, client, filtre, modifiees):
+    db = seeded
+    http = client(projets)
+    avant = sites(db)
+
+    r = http.patch("/sous_projet_fpack:bulk", json={"filtre": filtre, "champs": {"delivery_site": "Lyon"}})
+
+    assert r.status_code == 200 and r.json()["nb_modifies"] == len(modifiees)
+    apres = sites(db)
+    assert {i for i in apres if apres[i] != avant[i]} == modifiees
+    assert all(apres[i] == "Lyon" for i in modifiees)
+
+
+def test_patch_en_lot_ids_inconnus(seeded, client):
+    db = seeded
+    http = client(projets)
+    avant = sites(db)
+
+    r = http.patch("/sous_projet_fpack:bulk", json={"filtre": {"ids": [1, 404, 2, 405]}, "champs": {"tracking": "x"}})
+
+    assert r.status_code == 404 and "[404, 405]" in r.json()["detail"]
+    assert sites(db) == avant
+
+
+@pytest.mark.parametrize("corps", [
+    {"filtre": {"ids": [1]}, "champs": {}},
+    {"filtre": {}, "champs": {"tracking": "x"}},
+])
+def test_patch_en_lot_invalide(seeded, client, corps):
+    assert client(projets).patch("/sous_projet_fpack:bulk", json=corps).status_code == 400
+
+
+def test_liste_filtre_complet(seeded, client):
+    http = client(projets, fpack_config_columns)
+    # Template du projet 2 réduit à un groupe : ses instances (8 sélections) sont complètes
+    assert http.delete("/fpack_config_columns/clear/2").status_code == 200
+    assert http.post("/fpack_config_columns", json={"fpack_id": 2, "ordre": 1, "type": "group", "ref_id": 1}).status_code == 200
+
+    complets = http.get("/projets_globaux", params={"complet": True}).json()
+    incomplets = http.get("/projets_globaux", params={"complet": False}).json()
+
+    assert 2 in {p["id"] for p in complets}
+    assert {p["id"] for p in complets} | {p["id"] for p in incomplets} == {1, 2}
+    assert all(sp["complet"] for p in complets for sp in p["sous_projets"])
+    assert all(not all(sp["complet"] for sp in p["sous_projets"]) for p in incomplets)
+
+
+def test_liste_paginee_une_requete(seeded, client):
+    db = seeded
+    http = client(projets)
+    requetes = []
+
+    def enregistrer(conn, cursor, statement, *args):
+        requetes.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", enregistrer)
+    try:
+        page = http.get("/projets_globaux", params={"limit": 1}).json()
+        suivante = http.get("/projets_globaux", params={"limit": 1, "after": page["next_cursor"]}).json()
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", enregistrer)
+
+    # Compteurs lus sur les instances de la page seulement : ni agrégat sur tout le client, ni requête par instance
+    assert len(requetes) == 2
+    assert not any("GROUP BY" in sql.upper() for sql in requetes)
+    assert [p["id"] for p in page["items"] + suivante["items"]] == [1, 2]
+    instances = {i.id: i for i in db.query(models.SousProjetFpack)}
+    for projet in page["items"] + suivante["items"]:
+        for sous_projet in projet["sous_projets"]:
+            assert sous_projet["nb_selections"] == sum(instances[f["id"]].nb_selections for f in sous_projet["fpacks"])
+
+
+def selections(db, sous_projet_fpack_id):
+    db.expire_all()
+    return {
+        s.groupe_id: (s.type_item, s.ref_id)
+        for s in db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=sous_projet_fpack_id)
+    }
+
+
+@pytest.mark.parametrize("dialecte", ["sqlite", "mssql"])
+def test_selections_en_lot(seeded, client, monkeypatch, dialecte):
+    db = seeded
+    # mssql : chemin UPDATE des groupes existants puis INSERT des autres
+    monkeypatch.setattr(db.get_bind().dialect, "name", dialecte)
+    http = client(projets)
+    avant = selections(db, 1)
+    remplace = min(avant)
+    nouveaux = [g for g in range(1, 21) if g not in avant][:3]
+    corps = [{"groupe_id": remplace, "type_item": "robot", "ref_id": 2}]
+    corps += [{"groupe_id": g, "type_item": "produit", "ref_id": g} for g in nouveaux]
+
+    r = http.put("/sous_projet_fpack/1/selections:bulk", json=corps)
+
+    assert r.status_code == 200 and len(r.json()) == 4
+    attendu = {**avant, remplace: ("robot", 2), **{g: ("produit", g) for g in nouveaux}}
+    assert selections(db, 1) == attendu
+    assert db.get(models.SousProjetFpack, 1).nb_selections == len(attendu)
+
+
+@pytest.mark.parametrize("corps, statut", [
+    ([{"groupe_id": 1, "type_item": "produit", "ref_id": 1}, {"groupe_id": 1, "type_item": "produit", "ref_id": 2}], 400),
+    ([{"groupe_id": 1, "type_item": "outil", "ref_id": 1}], 400),
+    ([{"groupe_id": 99, "type_item": "produit", "ref_id": 1}], 400),
+    ([{"groupe_id": 1, "type_item": "produit", "ref_id": 1}, {"groupe_id": 2, "type_item": "robot", "ref_id": 99}], 400),
+])
+def test_selections_en_lot_invalides(seeded, client, corps, statut):
+    db = seeded
+    avant = selections(db, 1)
+
+    assert client(projets).put("/sous_projet_fpack/1/selections:bulk", json=corps).status_code == statut
+    assert selections(db, 1) == avant
+
+
+def test_selections_en_lot_instance_inconnue(seeded, client):
+    corps = [{"groupe_id": 1, "type_item": "produit", "ref_id": 1}]
+    assert client(projets).put("/sous_projet_fpack/404/selections:bulk", json=corps).status_code == 404
+
+
+def test_creation_instances_en_lot(seeded, client):
+    db = seeded
+    corps = {
+        "fpack_id": 2,
+        "instances": [{"FPack_number": f"B{i}", "delivery_site": "Lyon"} for i in range(3)],
+        "selections": [{"groupe_id": 1, "type_item": "produit", "ref_id": 1}, {"groupe_id": 2, "type_item": "robot", "ref_id": 3}]
+    }
+
+    r = client(projets).post("/sous_projets/2/fpacks:bulk", json=corps)
+
+    assert r.status_code == 200 and r.json()["nb_selections"] == 6
+    ids = r.json()["ids"]
+    db.expire_all()
+    instances = db.query(models.SousProjetFpack).filter(models.SousProjetFpack.id.in_(ids)).order_by(models.SousProjetFpack.id).all()
+    assert [(i.sous_projet_id, i.fpack_id, i.FPack_number, i.delivery_site, i.contractor) for i in instances] == [
+        (2, 2, f"B{n}", "Lyon", "N/A") for n in range(3)
+    ]
+    nb_groupes = db.query(models.FPackConfigColumn).filter_by(fpack_id=2, type="group").count()
+    assert all((i.nb_selections, i.nb_groupes_attendus) == (2, nb_groupes) for i in instances)
+    assert all(selections(db, i.id) == {1: ("produit", 1), 2: ("robot", 3)} for i in instances)
+
+
+@pytest.mark.parametrize("sous_projet_id, fpack_id, selection, statut", [
+    (404, 1, [], 404),
+    (1, 404, [], 400),
+    (1, 1, [{"groupe_id": 1, "type_item": "produit", "ref_id": 999}], 400),
+])
+def test_creation_instances_en_lot_invalide(seeded, client, sous_projet_id, fpack_id, selection, statut):
+    db = seeded
+    nb_instances = db.query(models.SousProjetFpack).count()
+    corps = {"fpack_id": fpack_id, "instances": [{"FPack_number": "X"}], "selections": selection}
+
+    assert client(projets).post(f"/sous_projets/{sous_projet_id}/fpacks:bulk", json=corps).status_code == statut
+    assert db.query(models.SousProjetFpack).count() == nb_instances
@@ -0,0 +1,143 @@
+import time
+
+import pytest # type: ignore
+from sqlalchemy import event, update # type: ignore
+
+import App.rollups as rollups
+from App import models
+from App.database import SessionLocal
+from App.pricing import PricingEngine
+from App.rollups import (
+    rebuild_rollups, refresh_pending_rollups, refresh_rollups, start_rollup_refresher, stop_rollup_refresher
+)
+from App.routes import totaux
+
+
+def attendre(condition, delai: float = 5):
+    fin = time.monotonic() + delai
+    while not condition():
+        assert time.monotonic() < fin, "condition non remplie"
+        time.sleep(0.02)
+
+
+def snapshot(db):
+    """Totaux matérialisés des trois niveaux, arrondis"""
+    return (
+        {r.sous_projet_fpack_id: (r.sous_projet_id, r.projet_global_id, round(r.total_global, 6), r.nb_lignes_sans_prix)
+         for r in db.query(models.RollupSousProjetFpack)},
+        {r.sous_projet_id: (r.projet_global_id, r.nb_fpacks, round(r.total_global, 6))
+         for r in db.query(models.RollupSousProjet)},
+        {r.projet_global_id: (r.nb_sous_projets, r.nb_fpacks, round(r.total_global, 6))
+         for r in db.query(models.RollupProjetGlobal)},
+    )
+
+
+def check_rollups(db):
+    """Le rafraîchissement incrémental donne les mêmes totaux qu'une reconstruction et que les factures"""
+    db.expire_all()
+    refresh_rollups(db)
+    db.commit()
+    incremental = snapshot(db)
+    rebuild_rollups(db)
+    assert snapshot(db) == incremental
+    db.rollback()
+
+    instances = [i for (i,) in db.query(models.SousProjetFpack.id)]
+    assert set(incremental[0]) == set(instances)
+    engine = PricingEngine(db).load(instances)
+    for spf_id in instances:
+        attendu = engine.facture_sous_projet_fpack(spf_id)["totaux"]["global"]
+        assert incremental[0][spf_id][2] == pytest.approx(attendu)
+
+
+def test_totaux_apres_ecriture(seeded, ecriture):
+    check_rollups(seeded)
+
+    ecriture()
+
+    check_rollups(seeded)
+
+
+def supprimer_selection(db, sous_projet_fpack_id):
+    db.delete(db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=sous_projet_fpack_id).first())
+    db.commit()
+
+
+def test_lecture_sans_ecriture(seeded, client):
+    db = seeded
+    http = client(totaux)
+    refresh_rollups(db)
+    db.commit()
+    premiere = http.get("/totaux/projets_globaux").json()
+    supprimer_selection(db, 1)
+
+    requetes = []
+
+    def enregistrer(conn, cursor, statement, *args):
+        requetes.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", enregistrer)
+    try:
+        # Totaux stale servis tels quels : le rafraîchissement est fait en tâche de fond
+        assert http.get("/totaux/projets_globaux").json() == premiere
+        assert http.get("/totaux/projets_globaux/1/sous_projets").status_code == 200
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", enregistrer)
+    assert requetes and all(sql.lstrip().upper().startswith("SELECT") for sql in requetes)
+
+
+def test_tache_de_fond(seeded):
+    db = seeded
+    start_rollup_refresher(SessionLocal, interval=60)
+    try:
+        attendre(lambda: db.query(models.RollupProjetGlobal).count() == 2)
+        supprimer_selection(db, 1)
+        # Réveillée par le commit, sans attendre l'intervalle
+        attendre(lambda: db.query(models.RollupSousProjetFpack).filter_by(stale=True).count() == 0)
+    finally:
+        stop_rollup_refresher()
+    db.expire_all()
+    attendu = PricingEngine(db).facture_sous_projet_fpack(1)["totaux"]["global"]
+    assert db.get(models.RollupSousProjetFpack, 1).total_global == pytest.approx(attendu)
+
+
+def test_invalidation_pendant_le_recalcul(seeded, monkeypatch):
+    db = seeded
+    refresh_rollups(db)
+    db.execute(update(models.RollupSousProjetFpack).values(stale=True))
+    db.commit()
+
+    class Concurrent(PricingEngine):
+        def load(self, ids):
+            # Écriture validée par une autre requête entre la lecture des versions et l'écriture des totaux
+            with SessionLocal() as autre:
+                supprimer_selection(autre, 1)
+            monkeypatch.setattr(rollups, "PricingEngine", PricingEngine)
+            return super().load(ids)
+
+    monkeypatch.setattr(rollups, "PricingEngine", Concurrent)
+    refresh_rollups(db)
+    db.commit()
+
+    stale = {r.sous_projet_fpack_id for r in db.query(models.RollupSousProjetFpack).filter_by(stale=True)}
+    assert stale == {1}
+    check_rollups(db)
+
+
+def test_conflit_entre_processus(seeded, monkeypatch):
+    db = seeded
+
+    class Concurrent(PricingEngine):
+        def load(self, ids):
+            # Un autre processus insère les mêmes lignes pendant le recalcul
+            with SessionLocal() as autre:
+                autre.add(models.RollupSousProjetFpack(sous_projet_fpack_id=ids[0], stale=True))
+                autre.commit()
+            return super().load(ids)
+
+    monkeypatch.setattr(rollups, "PricingEngine", Concurrent)
+    assert refresh_pending_rollups(SessionLocal) is None
+
+    monkeypatch.setattr(rollups, "PricingEngine", PricingEngine)
+    assert refresh_pending_rollups(SessionLocal)["instances"] == 9
+    check_rollups(db)
@@ -0,0 +1,117 @@
+import pytest # type: ignore
+from sqlalchemy import delete, insert, select, update # type: ignore
+
+from App import models
+from App.write_tracking import ALL, _commit_hooks, mark_changed
+
+
+def groupe_libre(db, sous_projet_fpack_id):
+    """Groupe pas encore sélectionné sur l'instance"""
+    pris = {g for (g,) in db.query(models.ProjetSelection.groupe_id).filter_by(sous_projet_fpack_id=sous_projet_fpack_id)}
+    return min(set(range(1, 21)) - pris)
+
+
+@pytest.fixture
+def commits():
+    """Portées touchées reçues par les fonctions on_commit, un dictionnaire par commit"""
+    recus = []
+
+    def enregistrer(db, pending):
+        recus.append({scope: set(ids) for scope, ids in pending.items() if ids})
+
+    _commit_hooks.append(enregistrer)
+    yield recus
+    _commit_hooks.remove(enregistrer)
+
+
+def test_flush_orm(seeded, commits):
+    db = seeded
+    selection = db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=2).first()
+    selection.ref_id = 1
+    db.add(models.ProjetSelection(sous_projet_fpack_id=4, groupe_id=groupe_libre(db, 4), type_item="produit", ref_id=1))
+    db.delete(db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=7).first())
+    db.commit()
+
+    assert commits == [{"sous_projet_fpack": {2, 4, 7}}]
+
+
+def test_flush_orm_attribut_sans_effet(seeded, commits):
+    db = seeded
+    db.get(models.SousProjetFpack, 1).delivery_site = "Lyon"
+    db.query(models.Prix).filter_by(client_id=1).first().commentaire = "ok"
+    db.commit()
+
+    assert commits == []
+
+
+def test_deplacement_instance(seeded, commits):
+    db = seeded
+    db.get(models.SousProjetFpack, 1).sous_projet_id = 2
+    db.commit()
+
+    assert commits == [{"sous_projet_fpack": {1}}]
+
+
+def test_update_ensembliste(seeded, commits):
+    db = seeded
+    produits = {p for (p,) in db.query(models.Prix.produit_id).filter(models.Prix.client_id == 2, models.Prix.produit_id < 10)}
+    db.execute(
+        update(models.Prix)
+        .where(models.Prix.client_id == 2, models.Prix.produit_id < 10)
+        .values(prix_produit=models.Prix.prix_produit + 1)
+    )
+    # Colonne sans effet sur les totaux : non suivie
+    db.execute(update(models.Prix).where(models.Prix.client_id == 1).values(commentaire="x"))
+    db.commit()
+
+    assert commits == [{"produit": produits}]
+
+
+def test_delete_ensembliste(seeded, commits):
+    db = seeded
+    db.query(models.ProjetSelection).filter(models.ProjetSelection.sous_projet_fpack_id.in_([3, 5])).delete(synchronize_session=False)
+    db.execute(delete(models.FPackConfigColumn).where(models.FPackConfigColumn.fpack_id == 2))
+    db.commit()
+
+    assert commits == [{"sous_projet_fpack": {3, 5}, "fpack": {2}}]
+
+
+def test_insert_ensembliste(seeded, commits):
+    db = seeded
+    db.execute(insert(models.ProjetSelection), [
+        {"sous_projet_fpack_id": 1, "groupe_id": groupe_libre(db, 1), "type_item": "produit", "ref_id": 1},
+        {"sous_projet_fpack_id": 8, "groupe_id": groupe_libre(db, 8), "type_item": "produit", "ref_id": 1},
+    ])
+    db.commit()
+    # Lignes insérées inconnues (INSERT ... SELECT) : tout est invalidé
+    db.execute(insert(models.Equipement_Produit).from_select(
+        ["equipement_id", "produit_id", "quantite"],
+        select(models.Equipements.id, 60, 1).where(models.Equipements.id == 1)
+    ))
+    db.commit()
+
+    assert commits == [{"sous_projet_fpack": {1, 8}}, {ALL: {True}}]
+
+
+def test_suppression_en_cascade(seeded, commits):
+    db = seeded
+    instances = {i for (i,) in db.query(models.ProjetSelection.sous_projet_fpack_id).filter_by(groupe_id=3)}
+    db.delete(db.get(models.Groupes, 3))
+    db.commit()
+    db.query(models.Robots).filter(models.Robots.id.in_([1, 2, 3])).delete(synchronize_session=False)
+    db.commit()
+
+    assert instances
+    assert db.query(models.ProjetSelection).filter_by(groupe_id=3).count() == 0
+    assert commits == [{"sous_projet_fpack": instances}, {"robot": {1, 3}}]
+
+
+def test_rollback(seeded, commits):
+    db = seeded
+    db.query(models.ProjetSelection).filter_by(sous_projet_fpack_id=1).delete(synchronize_session=False)
+    mark_changed(db, "fpack", [1])
+    db.rollback()
+    db.get(models.SousProjetFpack, 2).delivery_site = "Lyon"
+    db.commit()
+
+    assert commits == []